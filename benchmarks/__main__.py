@@ -0,0 +1,108 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+from typing import Callable, List, Tuple
+
+from src.capture import CaptureWriter, COMMAND, NOTIFICATION, replay
+from src.crc import crc16
+from src.instrumentation import Tracer, SummaryExporter
+from src.protocol import LumiaxClient, Result
+from src.registermap import register_map
+from src.variables import battery_and_load_parameters
+
+from .common import Measurement, measure, measure_async, print_measurement, save_baseline, load_baseline, regressions
+from .frames import recorded_frames
+from .publish_benchmark import BrokerStub, poll_results
+
+def get_write_command_results() -> List[Result]:
+    items = register_map.in_range(0x9021, 10)
+    values = ["Lithium", 10.6, 11.8, 14.4, 14.7, 13.6, "Auto", 14.4, 14.0, "Normal charging"]
+    return [Result(variable, value) for variable, value in zip(items, values)]
+
+def cases() -> List[Tuple[str, Callable[[], Measurement]]]:
+    client = LumiaxClient()
+    benchmarks = []
+
+    def add(name: str, func: Callable[[], object], **kwargs):
+        benchmarks.append((name, lambda: measure(name, func, **kwargs)))
+
+    for size in [6, 85, 255]:
+        data = bytes(range(size))
+        add(f"crc16 {size} bytes", lambda data=data: crc16(data))
+    add("get_read_command 0x3030x41", lambda: client.get_read_command(0xFE, 0x3030, 41))
+    for name, (start_address, frame) in recorded_frames.items():
+        add(f"parse {name}", lambda start_address=start_address, frame=frame: client.parse(start_address, frame))
+    results = get_write_command_results()
+    add("get_write_command 0x9021x10", lambda: client.get_write_command(0xFE, list(results)))
+    for name, value in [("battery_type", "Lithium"), ("mt_series_load_mode", "Timing switch")]:
+        variable = battery_and_load_parameters[name]
+        add(f"brute force raw value {name}",
+            lambda variable=variable, value=value: client._find_raw_value_by_brute_force(variable, value), samples=20)
+
+    # What instrumentation costs on the hot path, with and without an exporter
+    def span(tracer: Tracer):
+        with tracer.span("decode", device="00:00:00:00:00:01"):
+            pass
+    enabled = Tracer()
+    enabled.add_exporter(SummaryExporter())
+    for name, tracer in [("span disabled", Tracer()), ("span summary exporter", enabled)]:
+        add(name, lambda tracer=tracer: span(tracer))
+
+    def publish(name: str, aggregate: bool) -> Measurement:
+        # A full poll of all read groups against an in-process broker stub
+        def setup():
+            sensor = BrokerStub(rtt=0, aggregate=aggregate)
+            groups = poll_results()
+            async def poll():
+                for group, results in groups.items():
+                    await sensor.publish(results, group=group)
+            return poll
+        with contextlib.redirect_stdout(io.StringIO()):
+            return measure_async(name, setup, samples=100)
+    for name, aggregate in [("MqttSensor.publish per topic", False), ("MqttSensor.publish aggregated", True)]:
+        benchmarks.append((name, lambda name=name, aggregate=aggregate: publish(name, aggregate)))
+
+    def replay_capture(name: str) -> Measurement:
+        # The recorded frames in 20 byte notifications, as a default MTU delivers them
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "capture.bin")
+            capture = CaptureWriter(path)
+            for start_address, frame in recorded_frames.values():
+                capture.record(COMMAND, "00:00:00:00:00:01", client.get_read_command(1, start_address, frame[2] // 2))
+                for offset in range(0, len(frame), 20):
+                    capture.record(NOTIFICATION, "00:00:00:00:00:01", frame[offset:offset + 20])
+            capture.close()
+            return measure_async(name, lambda: lambda: replay(path), samples=100)
+    benchmarks.append(("replay capture", lambda: replay_capture("replay capture")))
+    return benchmarks
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the poll, decode and publish pipeline")
+    parser.add_argument("--save", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Compare against a JSON baseline")
+    parser.add_argument("--threshold", help="Fail when p50 got slower by more than this fraction", default=0.1, type=float)
+    parser.add_argument("--filter", help="Only run benchmarks containing this text", default="")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.compare) if args.compare else {}
+    measurements = []
+    for name, case in cases():
+        if args.filter not in name:
+            continue
+        measurement = case()
+        print_measurement(measurement, baseline.get(measurement.name))
+        measurements.append(measurement)
+
+    if args.save:
+        save_baseline(args.save, measurements)
+    if baseline:
+        slower = regressions(measurements, baseline, args.threshold)
+        for name in slower:
+            print(f"Regression: {name}")
+        sys.exit(1 if slower else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+from src.protocol import LumiaxClient, ResultContainer, Value
+from src.registermap import register_map
+from src.variables import Variable
+
+from .common import bench, report
+from .parse_benchmark import frame
+
+@dataclass
+class DataclassResult(Variable):
+    value: Value
+
+class DataclassClient(LumiaxClient):
+    # Copies every variable into a new dataclass result and builds the name map up front
+    def parse(self, start_address: int, buffer: bytes) -> ResultContainer:
+        data_length = buffer[2]
+        results = [DataclassResult(**vars(variable), value=self.bytes_to_value(variable, buffer, offset + 3))
+                   for offset, variable in register_map.layout(buffer[1], start_address, (data_length + 1) // 2)]
+        container = ResultContainer(results)
+        container._result_map
+        return container
+
+def measure(parse: Callable[[], ResultContainer], frames: int = 1000) -> Tuple[float, float]:
+    # Returns bytes and blocks that stay allocated per decoded frame
+    parse()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [parse() for _ in range(frames)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    del kept
+    return size / frames, blocks / frames
+
+def main():
+    legacy = DataclassClient()
+    client = LumiaxClient()
+    assert [(r.name, r.value) for r in legacy.parse(0x3030, frame)] == [(r.name, r.value) for r in client.parse(0x3030, frame)]
+
+    for name, parse in [("dataclass results", lambda: legacy.parse(0x3030, frame)),
+                        ("slots results", lambda: client.parse(0x3030, frame))]:
+        size, blocks = measure(parse)
+        print(f"{'retained per frame (' + name + ')':<48} {size:>10.0f} bytes {blocks:>6.0f} blocks")
+
+    baseline = bench(lambda: legacy.parse(0x3030, frame))
+    report("parse 0x3030x41 (dataclass results)", baseline)
+    report("parse 0x3030x41 (slots results)", bench(lambda: client.parse(0x3030, frame)), baseline)
+
+if __name__ == "__main__":
+    main()
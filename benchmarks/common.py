@@ -0,0 +1,125 @@
+import asyncio
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+from dataclasses import dataclass, asdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+def bench(func: Callable[[], object], repeat: int = 5) -> float:
+    # Returns the best time per call in seconds
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def report(name: str, seconds: float, baseline: Optional[float] = None) -> None:
+    line = f"{name:<48} {seconds * 1e6:>10.2f} us/op"
+    if baseline:
+        line += f"  ({baseline / seconds:.1f}x)"
+    print(line)
+
+@dataclass
+class Measurement:
+    name: str
+    ops_per_second: float
+    p50: float         # Seconds per call
+    p99: float         # Seconds per call
+    peak_bytes: int    # Memory allocated on top during a single call
+    retained_bytes: int  # Memory still allocated after a call
+
+def _calibrate(func: Callable[[], object], min_sample: float) -> int:
+    # Number of calls per sample so that timer overhead doesn't matter
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_sample or number >= 1 << 20:
+            return number
+        number *= 2
+
+def _summarize(name: str, samples: List[float], number: int, peak: int, retained: int) -> Measurement:
+    samples = sorted(sample / number for sample in samples)
+    mean = sum(samples) / len(samples)
+    return Measurement(
+        name=name,
+        ops_per_second=1 / mean,
+        p50=samples[len(samples) // 2],
+        p99=samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        peak_bytes=peak,
+        retained_bytes=retained,
+    )
+
+def _allocations(func: Callable[[], object]) -> tuple[int, int]:
+    tracemalloc.start()
+    try:
+        func()  # Warm up caches
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        tracemalloc.stop()
+    return peak - before, current - before
+
+def measure(name: str, func: Callable[[], object], samples: int = 200, min_sample: float = 1e-4) -> Measurement:
+    number = _calibrate(func, min_sample)
+    durations = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        durations.append(time.perf_counter() - start)
+    return _summarize(name, durations, number, *_allocations(func))
+
+def measure_async(name: str, setup: Callable[[], Callable[[], Awaitable[object]]], samples: int = 200) -> Measurement:
+    # `setup` runs inside the event loop and returns the coroutine function to measure
+    async def run() -> tuple[list[float], tuple[int, int]]:
+        func = setup()
+        await func()
+        durations = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            await func()
+            durations.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await func()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return durations, (peak - before, current - before)
+    durations, allocations = asyncio.run(run())
+    return _summarize(name, durations, 1, *allocations)
+
+def print_measurement(measurement: Measurement, baseline: Optional[dict] = None) -> None:
+    line = (f"{measurement.name:<48} {measurement.ops_per_second:>12,.0f} ops/s"
+            f" {measurement.p50 * 1e6:>10.2f} us p50 {measurement.p99 * 1e6:>10.2f} us p99"
+            f" {measurement.peak_bytes:>8} B peak")
+    if baseline:
+        line += f"  {(measurement.p50 / baseline['p50'] - 1) * 100:+6.1f}% p50"
+    print(line)
+
+def save_baseline(path: str, measurements: List[Measurement]) -> None:
+    data = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "time": time.time(),
+        "results": {m.name: asdict(m) for m in measurements},
+    }
+    with open(path, "w") as file:
+        json.dump(data, file, indent=2)
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    with open(path) as file:
+        return json.load(file)["results"]
+
+def regressions(measurements: List[Measurement], baseline: Dict[str, dict], threshold: float) -> List[str]:
+    # Names whose median latency got worse by more than `threshold` (a fraction)
+    return [m.name for m in measurements
+            if m.name in baseline and m.p50 > baseline[m.name]["p50"] * (1 + threshold)]
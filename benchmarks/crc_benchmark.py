@@ -0,0 +1,43 @@
+from src import crc
+
+from .common import bench, report
+
+def crc16_bitwise(data: bytes) -> bytes:
+    crc = 0xFFFF
+    for n in range(len(data)):
+        crc ^= data[n]
+        for i in range(8):
+            if crc & 1:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc.to_bytes(2, 'little')
+
+def main():
+    for size in [6, 85, 255]:
+        data = bytes(range(size))
+        baseline = bench(lambda: crc16_bitwise(data))
+        report(f"crc16 {size} bytes (bitwise)", baseline)
+        report(f"crc16 {size} bytes (table)", bench(lambda: crc._crc16_update(crc.CRC16_INIT, data)), baseline)
+        if crc._native_crc16:
+            report(f"crc16 {size} bytes (crcmod)", bench(lambda: crc._native_crc16(data)), baseline)
+
+    # A 85 byte response arriving in 20 byte notifications
+    data = bytes(range(85))
+    fragments = [data[i:i+20] for i in range(0, len(data), 20)]
+    def rehash():
+        buffer = bytearray()
+        for fragment in fragments:
+            buffer += fragment
+            crc.crc16(buffer)
+    def streaming():
+        running = crc.Crc16()
+        for fragment in fragments:
+            running.update(fragment)
+    baseline = bench(rehash)
+    report("fragmented 85 bytes (rehash buffer)", baseline)
+    report("fragmented 85 bytes (Crc16.update)", bench(streaming), baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from src import decoder
+from src.decoder import BlockDecoder
+from src.protocol import LumiaxClient
+
+from .common import bench, report
+from .parse_benchmark import frame
+
+def main():
+    frames = [frame] * 1000
+    client = LumiaxClient()
+    block = BlockDecoder(0x04, 0x3030, 41)
+
+    baseline = bench(lambda: [client.parse(0x3030, f) for f in frames], repeat=3)
+    report("1000 frames (parse)", baseline)
+    numpy, decoder.np = decoder.np, None
+    report("1000 frames (decode_frames, struct)", bench(lambda: block.decode_frames(frames), repeat=3), baseline)
+    decoder.np = numpy
+    if numpy is not None:
+        report("1000 frames (decode_frames, numpy)", bench(lambda: block.decode_frames(frames), repeat=3), baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# Responses recorded from a real controller (see tests/transaction_test.py)
+recorded_frames = {
+    "0x3011x28": (0x3011, bytes.fromhex("010438410113f7000f0000043804b004600474050004b0000000000000000000000000012c032003200000000000000000000000000000003c0000b1b7")),
+    "0x3030x40": (0x3030, bytes.fromhex("01045000010000096000000020000109c40b540000000000000000000000000000000000000000000000000000001f0924000000000000092400000000000002440000000000000000000000000000000000007004")),
+    "0x3000x1": (0x3000, bytes.fromhex("0104021770b724")),
+    "0x8ff0x29": (0x8FF0, bytes.fromhex("01033a410113f7000f0000043804b004600474050004b0000000000000000000000000012c0320032000000000000000000000096000000000003c00007bb4")),
+    "0x9017x10": (0x9017, bytes.fromhex("01031400340024000000010001001200010000000000014585")),
+}
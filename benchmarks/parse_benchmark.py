@@ -0,0 +1,64 @@
+from src.crc import crc16
+from src.protocol import LumiaxClient, ResultContainer, Result
+from src.variables import variables, FunctionCodes
+
+from .common import bench, report
+
+# request_details() response (0x3030, 41 registers)
+payload = bytes([
+    0x00, 0x01, 0x00, 0x00, 0x09, 0x60, 0x00, 0x00, 0x00, 0x20, 0x00, 0x01, 0x09, 0xC4, 0x0B, 0x54,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x1F, 0x09, 0x24, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x09, 0x24, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x02, 0x44, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00,
+])
+header = bytes([0x01, 0x04, len(payload)])
+frame = header + payload + crc16(header + payload)
+
+class LegacyClient(LumiaxClient):
+    # Linear scans over the variable table, as before the register map was introduced
+    def get_read_command(self, device_id: int, start_address: int, count: int) -> bytes:
+        items = [v for v in variables if v.address >= start_address and v.address < start_address + count]
+        if not items:
+            raise Exception(f"the range {hex(start_address)}-{hex(start_address+count-1)} contains no variables")
+        function_code = items[0].function_codes[0]
+        if not all(function_code in v.function_codes for v in items):
+            raise Exception(f"the range {hex(start_address)}-{hex(start_address+count-1)} spans multiple function codes")
+        result = bytes([device_id, function_code, start_address >> 8, start_address & 0xFF, count >> 8, count & 0xFF])
+        return result + crc16(result)
+
+    def parse(self, start_address: int, buffer: bytes) -> ResultContainer:
+        function_code = FunctionCodes(buffer[1])
+        results = []
+        data_length = buffer[2]
+        received_crc = buffer[3+data_length:3+data_length+2]
+        calculated_crc = crc16(buffer[:3+data_length])
+        if received_crc != calculated_crc:
+            raise Exception(f"CRC mismatch (0x{calculated_crc.hex()} != 0x{received_crc.hex()})")
+        address = start_address
+        cursor = 3
+        while cursor < data_length + 3:
+            items = [v for v in variables if address == v.address and function_code.value in v.function_codes]
+            for variable in items:
+                value = self.bytes_to_value(variable, buffer, cursor)
+                results.append(Result(**vars(variable), value=value))
+            cursor += 2
+            address += 1
+        return ResultContainer(results)
+
+def main():
+    legacy = LegacyClient()
+    client = LumiaxClient()
+    assert [(r.name, r.value) for r in legacy.parse(0x3030, frame)] == [(r.name, r.value) for r in client.parse(0x3030, frame)]
+
+    baseline = bench(lambda: legacy.parse(0x3030, frame))
+    report("parse 0x3030x41 (linear scan)", baseline)
+    report("parse 0x3030x41 (register map)", bench(lambda: client.parse(0x3030, frame)), baseline)
+
+    baseline = bench(lambda: legacy.get_read_command(0xFE, 0x3030, 41))
+    report("get_read_command (linear scan)", baseline)
+    report("get_read_command (register map)", bench(lambda: client.get_read_command(0xFE, 0x3030, 41)), baseline)
+
+if __name__ == "__main__":
+    main()
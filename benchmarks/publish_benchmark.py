@@ -0,0 +1,67 @@
+import asyncio
+import contextlib
+import io
+import time
+
+from src.homeassistant import MqttSensor
+from src.protocol import Result, ResultContainer
+from src.registermap import register_map
+
+from .common import report
+
+round_trip = 0.002  # Simulated broker acknowledgement time in seconds
+
+groups = {
+    "power": register_map.in_range(0x3045, 13),
+    "status": register_map.in_range(0x3032, 6) + register_map.in_range(0x3052, 7),
+    "counters": register_map.in_range(0x3030, 2) + register_map.in_range(0x3038, 9),
+    "parameters": register_map.in_range(0x9021, 12),
+}
+
+class BrokerStub(MqttSensor):
+    # Stands in for a local broker that acknowledges every message after one round trip
+    def __init__(self, rtt: float = round_trip, **kwargs):
+        super().__init__(hostname="localhost", max_silence=0, **kwargs)
+        self.rtt = rtt
+        self.messages_sent = 0
+
+    async def publish_message(self, topic, payload, retain=False, qos=0):
+        await asyncio.sleep(self.rtt)
+        self.messages_sent += 1
+
+class SequentialBrokerStub(BrokerStub):
+    async def publish_all(self, messages):
+        for topic, payload, retain in messages:
+            await self.publish_message(topic, payload=payload, retain=retain)
+
+def poll_results() -> dict[str, ResultContainer]:
+    return {name: ResultContainer([Result(**vars(variable), value=0) for variable in group])
+            for name, group in groups.items()}
+
+async def measure(sensor: BrokerStub, polls: int = 5) -> tuple[float, float]:
+    results = poll_results()
+    # The first poll also publishes discovery
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, group in results.items():
+            await sensor.publish(group, group=name)
+    sent = sensor.messages_sent
+    start = time.perf_counter()
+    for _ in range(polls):
+        for name, group in results.items():
+            await sensor.publish(group, group=name)
+    return (time.perf_counter() - start) / polls, (sensor.messages_sent - sent) / polls
+
+def main():
+    print(f"Simulated broker round trip: {round_trip * 1e3:.1f} ms, {sum(len(g) for g in groups.values())} values per poll")
+    for name, sensor in [
+        ("publish per topic (sequential)", SequentialBrokerStub()),
+        ("publish per topic (pipelined)", BrokerStub()),
+        ("publish per group (aggregated)", BrokerStub(aggregate=True)),
+    ]:
+        seconds, messages = asyncio.run(measure(sensor))
+        if name.endswith("(sequential)"):
+            baseline = seconds
+        report(f"{name}, {messages:.0f} msgs/poll", seconds, None if seconds == baseline else baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import time
+
+from src.protocol import LumiaxClient, Result
+from src.registermap import register_map
+from src.variables import battery_and_load_parameters
+
+from .common import bench, report
+
+class BruteForceClient(LumiaxClient):
+    def _find_raw_value(self, variable, value):
+        return self._find_raw_value_by_brute_force(variable, value)
+
+def command(name: str, value: str) -> list[Result]:
+    return [Result(**vars(battery_and_load_parameters[name]), value=value)]
+
+def main():
+    legacy = BruteForceClient()
+    client = LumiaxClient()
+
+    register_map.clear_caches()
+    start = time.perf_counter()
+    register_map.prepare(battery_and_load_parameters)
+    report("build reverse lookups (cold, all params)", time.perf_counter() - start)
+
+    for name, value in [
+        ("charging_at_zero_celsius", "Slow charging"),
+        ("mt_series_load_mode", "Timing switch"),
+        ("mt_series_timing_period_1", "600"),
+    ]:
+        baseline = bench(lambda: legacy.get_write_command(0xFE, command(name, value)), repeat=3)
+        report(f"write {name} (brute force)", baseline)
+        report(f"write {name} (lookup)", bench(lambda: client.get_write_command(0xFE, command(name, value))), baseline)
+
+    # An invalid value has to probe every raw value
+    variable = battery_and_load_parameters["mt_series_load_mode"]
+    baseline = bench(lambda: legacy._find_raw_value(variable, "Never"), repeat=3)
+    report("invalid mt_series_load_mode (brute force)", baseline)
+    report("invalid mt_series_load_mode (lookup)", bench(lambda: client._find_raw_value(variable, "Never")), baseline)
+
+if __name__ == "__main__":
+    main()
@@ -2,90 +2,160 @@
 
 import argparse
 import asyncio
+import functools
 import signal
+import time
 import traceback
+from typing import Optional
 
 import aiomqtt
-from bleak import BleakScanner
 from bleak.exc import BleakError, BleakDeviceNotFoundError
 
-from src.homeassistant import MqttSensor
-from src.bleclient import BleClient, Result
-from src.variables import variables, VariableContainer, battery_and_load_parameters, switches
+from src.homeassistant import MqttSensor, MqttDevice
+from src.bleclient import BleClient, Result, ResultContainer
+from src.capture import CaptureWriter, replay
+from src.session import BleSession
+from src.devicecache import DeviceCache
+from src.registermap import register_map
+from src.scheduler import PollScheduler, ReadGroup
+from src.coalescer import CommandCoalescer
+from src.history import HistoryStore
+from src.registercache import RegisterCache
+from src.instrumentation import tracer, LogExporter, JsonLinesExporter, SummaryExporter
+from src.metrics import MetricsSnapshot
+from src.publisher import Publisher
+from src.spool import Spool, OVERFLOW_POLICIES
+from src.simulator import Simulator
+from src.snapshot import snapshot_fleet, restore_fleet, save_snapshots, load_snapshots
+from src.variables import variables, VariableContainer, FunctionCodes, battery_and_load_parameters, switches
 
 request_interval = 20   # In seconds
+power_interval = 5      # In seconds
+counter_interval = 3600 # In seconds
 reconnect_interval = 5  # In seconds
 
-ble_lock = asyncio.Lock()
+command_parameters = battery_and_load_parameters[:12] + switches
 
-async def request_and_publish_details(sensor: MqttSensor, address: str) -> None:
-    async with ble_lock:
-        try:
-            async with BleClient(address) as mppt:
-                details = await mppt.request_details()
-                if details:
-                    print(f"Battery: {details['battery_percentage'].value}% ({details['battery_voltage'].value}V)")
-                    await sensor.publish(details)
-                else:
-                    print("No values recieved")
-        except (BleakError, asyncio.TimeoutError) as e:
-            print(f"Got {type(e).__name__} while fetching details: {e}")
-
-async def request_and_publish_parameters(sensor: MqttSensor, address: str) -> None:
-    async with ble_lock:
-        async with BleClient(address) as mppt:
-            parameters = await mppt.request_parameters()
-            if parameters:
-                await sensor.publish(parameters)
-
-async def subscribe_and_watch(sensor: MqttSensor, address: str):
-    parameters = battery_and_load_parameters[:12] + switches
-    await sensor.subscribe(parameters)
+def get_read_groups() -> list[ReadGroup]:
+    return [
+        ReadGroup("power", VariableContainer(register_map.in_range(0x3045, 13)), power_interval, priority=2),
+        ReadGroup("status", VariableContainer(register_map.in_range(0x3032, 6) + register_map.in_range(0x3052, 7)), request_interval, priority=1),
+        ReadGroup("counters", VariableContainer(register_map.in_range(0x3030, 2) + register_map.in_range(0x3038, 9)), counter_interval),
+        ReadGroup("parameters", VariableContainer(register_map.in_range(0x9021, 12)), counter_interval),
+    ]
+
+async def request_and_publish(publisher: Publisher, session: BleSession, scheduler: PollScheduler, groups: list[ReadGroup],
+                              history: Optional[HistoryStore] = None, metrics: Optional[MetricsSnapshot] = None) -> None:
+    results = ResultContainer([])
+    start = time.monotonic()
+    try:
+        with tracer.span("poll", device=session.address, groups=",".join(g.name for g in groups)):
+            async with session.transaction() as mppt:
+                # Queue all reads at once, so that they are sent back to back
+                replies = await asyncio.gather(*[mppt.read(request.start_address, request.count)
+                                                 for request in scheduler.plan(groups)], return_exceptions=True)
+                for reply in replies:
+                    if not isinstance(reply, BaseException):
+                        results += reply
+                for reply in replies:
+                    if isinstance(reply, BaseException):
+                        raise reply
+    except (BleakError, asyncio.TimeoutError) as e:
+        print(f"{session.address}: Got {type(e).__name__} while fetching {', '.join(g.name for g in groups)}: {e}")
+    duration = time.monotonic() - start
+    scheduler.complete(groups, duration)
+
+    if results:
+        if history:
+            history.append(session.address, results)
+        if metrics:
+            metrics.update(session.address, results, duration)
+        battery = results.get('battery_percentage')
+        if await publisher.publish(session.address, results, groups):
+            published = publisher.devices[session.address].publish_filter
+            status = f"{published.sent} messages sent, {published.suppressed} suppressed"
+        else:
+            status = f"{len(publisher.spool)} readings spooled"
+        if battery:
+            print(f"{session.address}: Battery: {battery.value}% ({results['battery_voltage'].value}V) in {session.request_latency:.2f}s, {status}")
+    else:
+        print(f"{session.address}: No values recieved")
+
+async def subscribe_and_watch(sensor: MqttDevice, session: BleSession, command_window: float = 0.5):
+    await sensor.subscribe(command_parameters)
     await sensor.store_config(switches)
 
+    # Bursts of commands, e.g. from dragging a slider, end up in a single transaction
+    coalescer = CommandCoalescer(command_window, max_delay=command_window * 5)
     while True:
-        command = await sensor.get_command()
-        print(f"Received command to set {command.name} to '{command.value}'")
-        async with ble_lock:
-            try:
-                async with BleClient(address) as mppt:
-                    results = await mppt.write([command])
-                    await sensor.publish(results)
-            except (BleakError, asyncio.TimeoutError) as e:
-                print(f"Get {type(e).__name__} while writing command: {e}")
-
+        commands = await coalescer.collect(sensor.get_command)
+        for command in commands:
+            print(f"{session.address}: Received command to set {command.name} to '{command.value}'")
+        batches, rejected = coalescer.plan(commands)
+        for command, e in rejected:
+            print(f"{session.address}: Can not set {command.name} to '{command.value}': {e}")
+        if not batches:
+            continue
+        written = ResultContainer([])
+        try:
+            async with session.transaction() as mppt:
+                for batch in batches:
+                    written += await mppt.write(batch)
+        except (BleakError, asyncio.TimeoutError) as e:
+            print(f"{session.address}: Got {type(e).__name__} while writing command: {e}")
+        if written:
+            await sensor.publish(written, force=True)
+        print(f"{session.address}: Wrote {len(commands)} commands with {len(batches)} frames, "
+              f"{coalescer.saved} of {coalescer.received} writes saved so far")
 
-async def run_mppt(sensor: MqttSensor, address: str):
-    loop = asyncio.get_event_loop()
-    task = loop.create_task(subscribe_and_watch(sensor, address))
 
+async def run_mppt(publisher: Publisher, session: BleSession, scheduler: PollScheduler, history: Optional[HistoryStore] = None,
+                   metrics: Optional[MetricsSnapshot] = None):
     try:
-        await request_and_publish_parameters(sensor, address)
         while True:
-            await request_and_publish_details(sensor, address)
-            await asyncio.sleep(request_interval)
-            if task.done() and task.exception():
-                break
+            groups = scheduler.due()
+            if groups:
+                await request_and_publish(publisher, session, scheduler, groups, history, metrics)
+            await asyncio.sleep(scheduler.next_wakeup())
     except (asyncio.TimeoutError, BleakDeviceNotFoundError, BleakError) as e:
-        print(f"{type(e).__name__} occurred: {e}")
-    finally:
-        task.cancel()
-        try:
-            await task
-        except asyncio.CancelledError:
-            pass
+        print(f"{session.address}: {type(e).__name__} occurred: {e}")
 
-    print("BLE session ended.")
+    print(f"{session.address}: BLE session ended: {session.health()}")
 
+async def run_device(publisher: Publisher, session: BleSession, history: Optional[HistoryStore] = None,
+                     metrics: Optional[MetricsSnapshot] = None):
+    # Polling goes on independently of the broker connection
+    scheduler = PollScheduler(get_read_groups())
+    while True:
+        try:
+            await run_mppt(publisher, session, scheduler, history, metrics)
+        except Exception:
+            print(traceback.format_exc())
+        await asyncio.sleep(reconnect_interval)
 
-async def run_mqtt(address, host, port, username, password):
+async def run_mqtt(sessions: list[BleSession], publisher: Publisher, max_silence, aggregate, host, port, username, password,
+                   command_window: float = 0.5):
+    await asyncio.to_thread(register_map.prepare, command_parameters)  # keep command writes off the slow path
     while True:
         try:
-            async with MqttSensor(hostname=host, port=port, username=username, password=password) as sensor:
+            async with MqttSensor(hostname=host, port=port, username=username, password=password,
+                                  max_silence=max_silence, aggregate=aggregate) as client:
                 print(f"Connected to MQTT broker at {host}:{port}")
-                while True:
-                    await run_mppt(sensor, address)
-                    await asyncio.sleep(reconnect_interval)
+                # A single controller keeps the original topics and device
+                if len(sessions) == 1:
+                    devices = {sessions[0].address: client.device()}
+                else:
+                    devices = {session.address: client.device(session.address) for session in sessions}
+                tasks = []
+                try:
+                    await publisher.attach(devices)
+                    tasks = [asyncio.create_task(subscribe_and_watch(devices[session.address], session, command_window)) for session in sessions]
+                    await asyncio.gather(*tasks)
+                finally:
+                    publisher.detach()
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
         except aiomqtt.MqttError as error:
             print(f'Error "{error}". Reconnecting in {reconnect_interval} seconds.')
         except asyncio.CancelledError:
@@ -94,10 +164,50 @@ async def run_mqtt(address, host, port, username, password):
             print(traceback.format_exc())
         await asyncio.sleep(reconnect_interval)
 
-async def main(*args):
+async def run(sessions: list[BleSession], publisher: Publisher, history: Optional[HistoryStore],
+              metrics: Optional[MetricsSnapshot], *args):
+    pollers = [asyncio.create_task(run_device(publisher, session, history, metrics)) for session in sessions]
     try:
+        await run_mqtt(sessions, publisher, *args)
+    finally:
+        for poller in pollers:
+            poller.cancel()
+        await asyncio.gather(*pollers, return_exceptions=True)
+
+def create_sessions(addresses: list[str], max_connections: int, simulator: Optional[Simulator] = None,
+                    device_cache: Optional[DeviceCache] = None, register_cache: Optional[RegisterCache] = None,
+                    verify_writes: bool = False, capture: Optional[CaptureWriter] = None) -> list[BleSession]:
+    # Keep every link open if the adapter can handle it, otherwise take turns
+    limiter = asyncio.Semaphore(max_connections) if len(addresses) > max_connections else None
+    client_factory = functools.partial(BleClient, register_cache=register_cache, verify_writes=verify_writes, capture=capture)
+    if simulator:
+        client_factory = functools.partial(client_factory, bleak_client_factory=simulator.client)
+    else:
+        client_factory = functools.partial(client_factory, device_cache=device_cache)
+    return [BleSession(address, max_backoff=request_interval * 3, client_factory=client_factory, limiter=limiter)
+            for address in addresses]
+
+async def main(addresses: list[str], max_connections: int, history_path: Optional[str], spool: Spool, *args,
+               simulator: Optional[Simulator] = None, device_cache: Optional[DeviceCache] = None,
+               verify_writes: bool = False, metrics_host: str = "", metrics_port: Optional[int] = None,
+               capture: Optional[CaptureWriter] = None):
+    # Parameters written from Home Assistant are known without reading them again
+    sessions = create_sessions(addresses, max_connections, simulator, device_cache, RegisterCache(), verify_writes, capture)
+    history = HistoryStore(history_path) if history_path else None
+    metrics = MetricsSnapshot(sessions, spool) if metrics_port is not None else None
+    server = None
+    try:
+        if device_cache:
+            await device_cache.start()
+            # Reconnects go straight to the devices found here
+            if not await device_cache.find(addresses, timeout=10):
+                print("Not all devices were found yet, scanning continues in the background")
+        if metrics:
+            # Scrapes are answered from the snapshot and never wait for a device
+            server = await metrics.serve(metrics_host, metrics_port)
+            print(f"Serving metrics on port {metrics_port}")
         loop = asyncio.get_running_loop()
-        task = loop.create_task(run_mqtt(*args))
+        task = loop.create_task(run(sessions, Publisher(spool, get_read_groups()), history, metrics, *args))
 
         # Setup signal handler to cancel the task on termination
         for signame in {'SIGINT', 'SIGTERM'}:
@@ -108,36 +218,150 @@ async def main(*args):
 
     except asyncio.CancelledError:
         pass  # Task was cancelled, no need for an error message
+    finally:
+        if server:
+            server.close()
+        if device_cache:
+            await device_cache.stop()
+        for session in sessions:
+            await session.close()
+        if history:
+            history.close()
+
+async def manage_parameters(addresses: list[str], max_connections: int, snapshot_path: Optional[str], restore_path: Optional[str],
+                            dry_run: bool = False, simulator: Optional[Simulator] = None):
+    # Snapshots or restores the battery and load parameters of all devices at once
+    sessions = create_sessions(addresses, max_connections, simulator)
+    try:
+        if snapshot_path:
+            snapshots = []
+            for session, result in zip(sessions, await snapshot_fleet(sessions)):
+                if isinstance(result, Exception):
+                    print(f"{session.address}: Got {type(result).__name__} while taking a snapshot: {result}")
+                else:
+                    print(f"{session.address}: Saved {len(result.registers)} registers")
+                    snapshots.append(result)
+            save_snapshots(snapshot_path, snapshots)
+        else:
+            snapshots = load_snapshots(restore_path)
+            for session, result in zip(sessions, await restore_fleet(sessions, snapshots, dry_run=dry_run)):
+                if result is None:
+                    print(f"{session.address}: No snapshot for this device")
+                elif isinstance(result, Exception):
+                    print(f"{session.address}: Got {type(result).__name__} while restoring: {result}")
+                else:
+                    for address, value in result.changes.items():
+                        names = ", ".join(v.name for v in register_map.lookup(FunctionCodes.READ_PARAMETER.value, address))
+                        print(f"{session.address}: {hex(address)} {names} = {value}")
+                    action = "would be written" if dry_run else f"written in {result.frames} frames"
+                    print(f"{session.address}: {len(result.changes)} registers {action}")
+                    for address, (expected, actual) in result.mismatches.items():
+                        print(f"{session.address}: {hex(address)} reads back {actual} instead of {expected}")
+    finally:
+        for session in sessions:
+            await session.close()
+
+class DiscardingSensor(MqttSensor):
+    # Builds every message like the broker connection would, without sending it
+    def __init__(self, aggregate: bool = False):
+        super().__init__(hostname="localhost", max_silence=0, aggregate=aggregate)
+        self.messages_sent = 0
+
+    async def publish_message(self, topic, payload, retain=False, qos=0):
+        self.messages_sent += 1
+
+async def replay_capture(path: str, aggregate: bool = False):
+    # Decodes and publishes a capture as fast as possible, e.g. to measure or check the decoder against field traffic
+    sensor = DiscardingSensor(aggregate)
+    groups = get_read_groups()
+    async def publish(address: str, results: ResultContainer):
+        # Like a poll, with the groups the values belong to
+        await sensor.device(address).publish_groups(results, groups)
+    stats = await replay(path, publish)
+    print(f"Replayed {stats.records} records in {stats.seconds:.2f}s: {stats.frames} frames, {stats.results} values, "
+          f"{sensor.messages_sent} messages, {stats.stale} stale, {stats.errors} errors, {stats.crc_failures} CRC failures")
+    if stats.seconds:
+        print(f"{stats.frames / stats.seconds:.0f} frames/s")
+    return stats
 
 async def list_services(address):
     async with BleClient(address) as mppt:
         await mppt.list_services()
 
-async def scan_for_devices():
-    devices = await BleakScanner.discover()
-    if not devices:
+async def scan_for_devices(device_cache: DeviceCache, duration: float):
+    # Devices are listed as soon as the scanner sees them
+    print("Available BLE devices:")
+    device_cache.listeners.append(lambda seen: print(f"{seen.device.address} - {seen.name} ({seen.rssi} dBm)"))
+    async with device_cache:
+        await asyncio.sleep(duration)
+    if not device_cache.devices:
         print("No BLE devices found.")
-    else:
-        print("Available BLE devices:")
-        for device in devices:
-            print(f"{device.address} - {device.name}")
-    return devices
+    return device_cache.devices
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Solarlife MPPT BLE Client')
-    parser.add_argument('address', help='BLE device address')
+    parser.add_argument('address', help='BLE device address', nargs='+')
     parser.add_argument('--host', help='MQTT broker host', default='localhost')
     parser.add_argument('--port', help='MQTT broker port', default=1883, type=int)
     parser.add_argument('--username', help='MQTT username')
     parser.add_argument('--password', help='MQTT password')
+    parser.add_argument('--max-connections', help='Maximum number of simultaneous BLE connections', default=3, type=int)
+    parser.add_argument('--aggregate', help='Publish one JSON state document per read group instead of one topic per value', action='store_true')
+    parser.add_argument('--max-silence', help='Republish unchanged values after this many seconds, 0 to publish every reading', default=300, type=float)
+    parser.add_argument('--command-window', help='Collect commands for this many seconds and write them together', default=0.5, type=float)
+    parser.add_argument('--verify-writes', help='Read written parameters back from the controller', action='store_true')
+    parser.add_argument('--history', help='Directory to keep a local history of all readings in')
+    parser.add_argument('--spool', help='Directory to keep readings in while the MQTT broker is unreachable (default: in memory)')
+    parser.add_argument('--spool-size', help='Maximum size of the spool in MiB', default=10, type=float)
+    parser.add_argument('--spool-overflow', help='What to do when the spool is full', choices=OVERFLOW_POLICIES, default='drop_oldest')
+    parser.add_argument('--simulate', help='Talk to simulated controllers instead of BLE devices', action='store_true')
+    parser.add_argument('--metrics-port', help='Serve Prometheus metrics over HTTP on this port', type=int)
+    parser.add_argument('--metrics-host', help='Address to serve the metrics on (default: all interfaces)', default='')
+    parser.add_argument('--trace', help='Emit timing spans and counters of every request', choices=['log', 'jsonl', 'summary'])
+    parser.add_argument('--trace-file', help='File to append JSON lines traces to', default='trace.jsonl')
+    parser.add_argument('--snapshot', help='Save the battery and load parameters of all devices to this file and exit')
+    parser.add_argument('--restore', help='Write the parameters from this snapshot file to all devices and exit')
+    parser.add_argument('--dry-run', help='Only show what --restore would change', action='store_true')
+    parser.add_argument('--capture', help='Append all commands and notifications to this binary file')
+    parser.add_argument('--replay', help='Decode and publish a file written with --capture as fast as possible and exit')
     parser.add_argument('--list-services', help='List GATT services', action='store_true')
     parser.add_argument('--scan', help='Scan for bluetooth devices', action='store_true')
+    parser.add_argument('--scan-time', help='Duration of --scan in seconds', default=5, type=float)
+    parser.add_argument('--gatt-cache', help='File to keep the GATT handles of the controllers in')
 
     args = parser.parse_args()
 
+    if args.trace == 'log':
+        exporter = LogExporter()
+    elif args.trace == 'jsonl':
+        exporter = JsonLinesExporter(args.trace_file)
+    elif args.trace == 'summary':
+        exporter = SummaryExporter()
+    if args.trace:
+        tracer.add_exporter(exporter)
+
+    device_cache = DeviceCache(args.gatt_cache)
     if args.scan:
-        asyncio.run(scan_for_devices())
+        asyncio.run(scan_for_devices(device_cache, args.scan_time))
     elif args.list_services:
-        asyncio.run(list_services(args.address))
+        asyncio.run(list_services(args.address[0]))
+    elif args.replay:
+        asyncio.run(replay_capture(args.replay, args.aggregate))
+    elif args.snapshot or args.restore:
+        simulator = Simulator() if args.simulate else None
+        asyncio.run(manage_parameters(args.address, args.max_connections, args.snapshot, args.restore, args.dry_run, simulator))
     else:
-        asyncio.run(main(args.address, args.host, args.port, args.username, args.password))
+        spool = Spool(args.spool, max_bytes=int(args.spool_size * 2**20), overflow=args.spool_overflow)
+        simulator = Simulator(loss=0.02, corruption=0.01, link_loss=0.001) if args.simulate else None
+        capture = CaptureWriter(args.capture) if args.capture else None
+        asyncio.run(main(args.address, args.max_connections, args.history, spool, args.max_silence, args.aggregate,
+                         args.host, args.port, args.username, args.password, args.command_window, simulator=simulator,
+                         device_cache=None if simulator else device_cache, verify_writes=args.verify_writes,
+                         metrics_host=args.metrics_host, metrics_port=args.metrics_port, capture=capture))
+        if capture:
+            capture.close()
+
+    if args.trace == 'jsonl':
+        exporter.close()
+    elif args.trace == 'summary':
+        print(exporter.report())
@@ -0,0 +1,96 @@
+from typing import List, Optional
+
+from .crc import CRC16_INIT, crc16_update
+from .instrumentation import tracer
+from .protocol import LumiaxClient, MAX_READ_COUNT
+
+MAX_FRAME_LENGTH = 2 * MAX_READ_COUNT + 5
+
+class FrameAssembler:
+    """Reassembles response frames from BLE notification fragments.
+
+    Fragments are copied into a preallocated buffer and frames are returned as
+    memoryviews into it, so they are only valid until the next call to `feed`.
+    Bytes that cannot start a frame with a valid CRC are skipped one at a time
+    until the stream is in sync again.
+    """
+
+    def __init__(self, protocol: Optional[LumiaxClient] = None, size: int = 2 * MAX_FRAME_LENGTH):
+        self.protocol = protocol or LumiaxClient()
+        self.max_length = min(size, MAX_FRAME_LENGTH)
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0    # First byte of the current frame
+        self.end = 0      # End of the received data
+        self.checked = 0  # End of the bytes covered by `crc`
+        self.crc = CRC16_INIT
+
+        self.frames = 0
+        self.crc_failures = 0
+        self.discarded = 0  # Bytes skipped while resynchronizing
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def pending(self) -> memoryview:
+        return self.view[self.start:self.end]
+
+    def reset(self) -> None:
+        self.start = self.end = self.checked = 0
+        self.crc = CRC16_INIT
+
+    def feed(self, data: bytes) -> List[memoryview]:
+        self._append(data)
+        frames = []
+        while True:
+            available = self.end - self.start
+            if available < 4:
+                break
+            length = self.protocol.frame_length(self.view[self.start:self.end])
+            if length is None or length > self.max_length:
+                self._skip()
+                continue
+            stop = self.start + min(length, available)
+            if stop > self.checked:
+                self.crc = crc16_update(self.crc, self.view[self.checked:stop])
+                self.checked = stop
+            if available < length:
+                break
+            if self.crc != 0:
+                # Running the CRC over a frame including its own CRC leaves zero
+                self.crc_failures += 1
+                tracer.count("crc_failures")
+                self._skip()
+                continue
+            frames.append(self.view[self.start:stop])
+            self.frames += 1
+            self.start = self.checked = stop
+            self.crc = CRC16_INIT
+        if self.start == self.end:
+            self.reset()
+        return frames
+
+    def _skip(self) -> None:
+        self.discarded += 1
+        self.start += 1
+        self.checked = self.start
+        self.crc = CRC16_INIT
+
+    def _append(self, data: bytes) -> None:
+        size = len(data)
+        if self.end + size > len(self.buffer):
+            # Move the unfinished frame to the front, frames returned earlier are no longer in use
+            pending = self.end - self.start
+            if pending + size > len(self.buffer):
+                # Longer than any valid frame, keep only the newest bytes
+                self.discarded += pending
+                self.reset()
+                data = data[-len(self.buffer):]
+                size = len(data)
+            else:
+                self.view[:pending] = self.view[self.start:self.end]
+                self.checked -= self.start
+                self.start, self.end = 0, pending
+        self.view[self.end:self.end + size] = data
+        self.end += size
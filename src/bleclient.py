@@ -1,67 +1,289 @@
 import asyncio
 import struct
+import time
+from typing import Callable, Dict, Optional, Tuple
 from bleak import BleakClient, BleakScanner
 from bleak.backends.characteristic import BleakGATTCharacteristic
+from bleak.exc import BleakError
 
-from src.crc import crc16
-from src.protocol import LumiaxClient, ResultContainer, Result
+from src.assembler import FrameAssembler
+from src.capture import CaptureWriter, COMMAND, NOTIFICATION
+from src.devicecache import DeviceCache, GattHandles
+from src.instrumentation import tracer
+from src.protocol import LumiaxClient, ResultContainer, Result, READ_FUNCTION_CODES
+from src.registercache import RegisterCache, WRITTEN_FUNCTION_CODES, invalidating_switches
+from src.transaction import PendingRequest, RttEstimator
+from src.variables import FunctionCodes
 
 class BleClient(LumiaxClient):
     DEVICE_NAME_UUID = "00002a00-0000-1000-8000-00805f9b34fb"
     NOTIFY_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
     WRITE_UUID = "0000ff02-0000-1000-8000-00805f9b34fb"
 
-    buffer = bytearray()
-
-    def __init__(self, mac_address: str):
-        self.client = BleakClient(mac_address)
-        self.response_queue = asyncio.Queue()
-        self.lock = asyncio.Lock()
+    def __init__(self, mac_address: str, disconnected_callback: Optional[Callable[[BleakClient], None]] = None,
+                 bleak_client_factory: Callable[..., BleakClient] = BleakClient, device_cache: Optional[DeviceCache] = None,
+                 register_cache: Optional[RegisterCache] = None, verify_writes: bool = False,
+                 capture: Optional[CaptureWriter] = None):
+        self.address = mac_address
+        self.capture = capture
+        self.device_cache = device_cache
+        self.register_cache = register_cache
+        self.verify_writes = verify_writes  # Read written registers back instead of trusting the echo
+        # A device found by the background scan connects right away, without scanning for it first
+        device = device_cache.get(mac_address) if device_cache else None
+        handles = device_cache.gatt(mac_address) if device_cache else None
+        options = {"services": handles.services} if handles else {}
+        self.client = bleak_client_factory(device or mac_address, disconnected_callback=disconnected_callback, **options)
+        self.uses_cached_device = device is not None
+        self.notify_characteristic: int | str = self.NOTIFY_UUID
+        self.write_characteristic: int | str = self.WRITE_UUID
         super().__init__()
+        self.assembler = FrameAssembler(self)
+        self.queue: asyncio.Queue[PendingRequest] = asyncio.Queue()
+        self.worker: Optional[asyncio.Task] = None
+        self.pending: Optional[PendingRequest] = None
+        self.late_replies: Dict[bytes, Tuple[int, float]] = {}  # Response prefix -> replies that may still arrive, and until when
+        self.late_reply: Optional[asyncio.Future] = None
+        self.rtt = RttEstimator()
+        self.retries = 0
+        self.parse_errors = 0
+        self.stale_responses = 0
+        self.sent_at: Optional[float] = None  # Only tracked while tracing
+        self.first_fragment_at: Optional[float] = None
 
     async def __aenter__(self):
-        await self.client.connect()  # Connect to the BLE device
-        await self.client.start_notify(self.NOTIFY_UUID, self.notification_handler)  # Start receiving notifications
+        with tracer.span("connect", device=self.address):
+            try:
+                await self.client.connect()  # Connect to the BLE device
+            except Exception:
+                if self.uses_cached_device:
+                    self.device_cache.forget(self.address)  # Scan for it again next time
+                raise
+        if self.device_cache:
+            self.resolve_handles()
+        with tracer.span("notify_subscribe", device=self.address):
+            await self.client.start_notify(self.notify_characteristic, self.notification_handler)  # Start receiving notifications
         return self
 
+    def resolve_handles(self):
+        # Handles are looked up directly and limit service discovery on the next connect
+        services = self.client.services
+        handles = self.device_cache.gatt(self.address)
+        if handles:
+            notify = services.get_characteristic(handles.notify)
+            write = services.get_characteristic(handles.write)
+            if notify and write and notify.uuid == self.NOTIFY_UUID and write.uuid == self.WRITE_UUID:
+                self.notify_characteristic, self.write_characteristic = handles.notify, handles.write
+                return
+        notify = services.get_characteristic(self.NOTIFY_UUID)
+        write = services.get_characteristic(self.WRITE_UUID)
+        if notify is None or write is None:
+            self.device_cache.store_gatt(self.address, None)
+            return
+        self.notify_characteristic, self.write_characteristic = notify.handle, write.handle
+        service_uuids = list(dict.fromkeys([notify.service_uuid, write.service_uuid]))
+        self.device_cache.store_gatt(self.address, GattHandles(service_uuids, notify.handle, write.handle))
+
     async def __aexit__(self, exc_type, exc, tb):
-        await self.client.stop_notify(self.NOTIFY_UUID)  # Stop receiving notifications
+        await self.stop()
+        await self.client.stop_notify(self.notify_characteristic)  # Stop receiving notifications
         try:
             await self.client.disconnect()  # Disconnect from the BLE device
         except EOFError:
             pass
+
+    @property
+    def is_connected(self) -> bool:
+        return self.client.is_connected
+
+    def counters(self) -> dict:
+        return {
+            "retries": self.retries,
+            "crc_failures": self.assembler.crc_failures,
+            "parse_errors": self.parse_errors,
+            "stale_responses": self.stale_responses,
+            "discarded_bytes": self.assembler.discarded,
+        }
+
     def notification_handler(self, characteristic: BleakGATTCharacteristic, data: bytearray):
         if characteristic.uuid != self.NOTIFY_UUID:
             return
-        self.buffer += data  # Append the received data to the buffer
-        try:
-            if not self.is_complete(self.buffer):
-                return
-            results = self.parse(self.start_address, self.buffer)
-            self.response_queue.put_nowait(results)
-        except Exception as e:
-            print(f"Response from device: 0x{self.buffer.hex()}")
-            print(f"Error while parsing response: {e}")
-
-    async def read(self, start_address: int, count: int, repeat = 10, timeout = 2) -> ResultContainer:
-        async with self.lock:
-            self.start_address = start_address
-            command = self.get_read_command(0xFE, start_address, count)
-            self.response_queue = asyncio.Queue() # Clear the queue
-            i = 0
-            # send the command multiple times
-            while i < repeat:
-                i += 1
-                self.buffer = bytearray()
-                await self.client.write_gatt_char(self.WRITE_UUID, command)
-                try:
-                    # Wait for either a response or timeout
-                    return await asyncio.wait_for(self.response_queue.get(), timeout=timeout)
-                except asyncio.TimeoutError:
-                    if self.buffer:
-                        print(f"Got partial response: 0x{self.buffer.hex()}")
-                    print(f"Repeating read command...")
-            return ResultContainer([])
+        if self.capture:
+            self.capture.record(NOTIFICATION, self.address, data)
+        if tracer.enabled:
+            self.trace_fragment()
+        # Frames are views into the assembler's buffer and have to be parsed right away
+        for frame in self.assembler.feed(data):
+            if tracer.enabled and self.first_fragment_at is not None:
+                tracer.timing("reassembly", time.perf_counter() - self.first_fragment_at, device=self.address, length=len(frame))
+                self.first_fragment_at = None
+            if frame[1] & 0x80:
+                self.parse_errors += 1
+                tracer.count("parse_errors", device=self.address)
+                tracer.event("exception_response", device=self.address, function_code=frame[1] & 0x7F, code=frame[2])
+                continue
+            request = self.pending
+            if request is None or request.response.done() or not request.matches(frame):
+                # A late reply to an earlier request
+                self.stale_responses += 1
+                tracer.count("stale_responses", device=self.address)
+                continue
+            if request.late_replies:
+                # Looks like the answer, but is the reply to an earlier command with the same prefix
+                request.late_replies -= 1
+                self.stale_responses += 1
+                tracer.count("stale_responses", device=self.address)
+                if self.late_reply is not None and not self.late_reply.done():
+                    self.late_reply.set_result(None)
+                continue
+            try:
+                if request.raw:
+                    results = bytes(frame[3:3 + frame[2]] if frame[1] in READ_FUNCTION_CODES else frame[2:6])
+                    self.device_id = frame[0]
+                else:
+                    with tracer.span("decode", device=self.address):
+                        results = self.parse(request.start_address, frame, check_crc=False)  # The assembler checked the CRC
+                request.response.set_result(results)
+            except Exception as e:
+                self.parse_errors += 1
+                tracer.count("parse_errors", device=self.address)
+                tracer.event("parse_error", device=self.address, frame=frame.hex(), error=str(e))
+
+    def trace_fragment(self):
+        now = time.perf_counter()
+        if self.sent_at is not None:
+            tracer.timing("first_fragment", now - self.sent_at, device=self.address)
+            self.sent_at = None
+            self.first_fragment_at = now
+        elif self.first_fragment_at is None:
+            self.first_fragment_at = now  # A response to an earlier attempt
+
+    async def send(self, command: bytes) -> None:
+        self.assembler.reset()
+        if self.capture:
+            self.capture.record(COMMAND, self.address, command)
+        with tracer.span("command_write", device=self.address, length=len(command)):
+            await self.client.write_gatt_char(self.write_characteristic, command)
+        if tracer.enabled:
+            self.sent_at = time.perf_counter()
+            self.first_fragment_at = None
+
+    def retry(self, kind: str) -> None:
+        self.retries += 1
+        tracer.count("retries", device=self.address, command=kind)
+        tracer.event("timeout", device=self.address, command=kind, partial=self.assembler.pending.hex())
+
+    async def submit(self, request: PendingRequest) -> Optional[ResultContainer]:
+        # Returns None if the device never answered
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.get_running_loop().create_task(self.run_requests())
+        self.queue.put_nowait(request)
+        return await request.future
+
+    async def run_requests(self):
+        # Queued requests are sent back to back, one at a time
+        while True:
+            request = await self.queue.get()
+            if request.future.done():
+                continue  # Cancelled while waiting
+            try:
+                with tracer.span(request.kind, device=self.address, start=request.start_address) as span:
+                    results = await self.execute(request)
+                    span.set(attempts=request.attempts)
+                if not request.future.done():
+                    request.future.set_result(results)
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            finally:
+                self.pending = None
+
+    async def execute(self, request: PendingRequest) -> Optional[ResultContainer]:
+        self.pending = request
+        await self.drain(request)
+        results = None
+        timeout = 0.0
+        while request.attempts < request.repeat and not request.future.done():
+            request.attempts += 1
+            sent = time.monotonic()
+            await self.send(request.command)
+            timeout = request.timeout if request.timeout is not None else self.rtt.timeout()
+            done, _ = await asyncio.wait([request.response], timeout=timeout)
+            if done:
+                if request.attempts == 1:
+                    # Replies to repeated commands can't be attributed to an attempt
+                    self.rtt.sample(time.monotonic() - sent)
+                results = request.response.result()
+                break
+            self.rtt.timed_out()
+            self.retry(request.kind)
+        unanswered = request.attempts - (1 if request.response.done() else 0)
+        if unanswered:
+            # Given as long again as the last attempt waited for it
+            self.late_replies[request.prefix] = (unanswered, time.monotonic() + timeout)
+        return results
+
+    async def drain(self, request: PendingRequest) -> None:
+        # Replies to timed out commands can't be told apart from the answer to
+        # a command with the same prefix, so they are waited for before sending it
+        late = self.late_replies.pop(request.prefix, None)
+        if late is None:
+            return
+        request.late_replies, until = late
+        while request.late_replies and time.monotonic() < until:
+            self.late_reply = asyncio.get_running_loop().create_future()
+            await asyncio.wait([self.late_reply], timeout=until - time.monotonic())
+        self.late_reply = None
+        request.late_replies = 0
+
+    async def stop(self):
+        if self.pending is not None and not self.pending.future.done():
+            self.pending.future.set_exception(BleakError("Disconnected while waiting for the response"))
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        while not self.queue.empty():
+            request = self.queue.get_nowait()
+            if not request.future.done():
+                request.future.set_exception(BleakError("Disconnected before the request was sent"))
+
+    async def read(self, start_address: int, count: int, repeat = 10, timeout: Optional[float] = None) -> ResultContainer:
+        command = self.get_read_command(0xFE, start_address, count)
+        if self.register_cache:
+            data = self.register_cache.get(self.address, command[1], start_address, count)
+            if data is None:
+                data = await self.read_registers(start_address, count, repeat, timeout)
+            return self.decode(command[1], start_address, data) if data is not None else ResultContainer([])
+        request = PendingRequest("read", command, start_address, self.response_prefix(command), repeat, timeout)
+        results = await self.submit(request)
+        return results if results is not None else ResultContainer([])
+
+    def decode(self, function_code: int, start_address: int, data: bytes) -> ResultContainer:
+        with tracer.span("decode", device=self.address):
+            return self.parse(start_address, bytes([self.device_id, function_code, len(data)]) + data, check_crc=False)
+
+    async def read_registers(self, start_address: int, count: int, repeat = 10, timeout: Optional[float] = None) -> Optional[bytes]:
+        # The raw register contents, or None without a response. Never served from the cache.
+        command = self.get_read_command(0xFE, start_address, count)
+        request = PendingRequest("read", command, start_address, self.response_prefix(command), repeat, timeout, raw=True)
+        data = await self.submit(request)
+        if data is not None and self.register_cache:
+            self.register_cache.store(self.address, command[1], start_address, data)
+        return data
+
+    async def write_registers(self, start_address: int, registers: list[int], repeat = 10, timeout: Optional[float] = None) -> bool:
+        command = self.get_range_write_command(self.device_id, start_address, registers)
+        request = PendingRequest("write", command, start_address, self.response_prefix(command), repeat, timeout, raw=True)
+        tracer.event("command", device=self.address, command=command.hex())
+        if await self.submit(request) is None:
+            return False
+        if self.register_cache:
+            self.register_cache.store(self.address, WRITTEN_FUNCTION_CODES[command[1]], start_address, command[7:-2])
+        return True
 
     async def request_details(self) -> ResultContainer:
         return await self.read(0x3030, 41)
@@ -69,28 +291,38 @@ class BleClient(LumiaxClient):
     async def request_parameters(self) -> ResultContainer:
         return await self.read(0x9021, 12)
     
-    async def write(self, results: list[Result], repeat = 10, timeout = 2) -> ResultContainer:
-        async with self.lock:
-            start_address, command = self.get_write_command(self.device_id, results)
-            self.start_address = start_address
-            self.response_queue = asyncio.Queue() # Clear the queue
-            i = 0
-            # send the command multiple times
-            while i < repeat:
-                i += 1
-                self.buffer = bytearray()
-                await self.client.write_gatt_char(self.WRITE_UUID, command)
-                print(f"Wrote command 0x{command.hex()}")
-                try:
-                    # Wait for either a response or timeout
-                    await asyncio.wait_for(self.response_queue.get(), timeout=timeout)
-                    return ResultContainer(results)
-                except asyncio.TimeoutError:
-                    if self.buffer:
-                        print(f"Got partial response: 0x{self.buffer.hex()}")
-                    print(f"Repeating write command...")
+    async def write(self, results: list[Result], repeat = 10, timeout: Optional[float] = None) -> ResultContainer:
+        # Returns the values the device confirmed, which can differ from the requested ones
+        start_address, command = self.get_write_command(self.device_id, results)
+        request = PendingRequest("write", command, start_address, self.response_prefix(command), repeat, timeout, raw=True)
+        tracer.event("command", device=self.address, command=command.hex())
+        echo = await self.submit(request)
+        if echo is None:
             return ResultContainer([])
 
+        function_code = command[1]
+        if function_code not in WRITTEN_FUNCTION_CODES:
+            # Switches can't be read back, but some of them reset registers
+            for result in results:
+                if self.register_cache and result.name in invalidating_switches:
+                    self.register_cache.invalidate(self.address, invalidating_switches[result.name])
+            return ResultContainer(results)
+
+        read_function_code = WRITTEN_FUNCTION_CODES[function_code]
+        # A single write echoes the value the device took, a range write only its length
+        data = echo[2:4] if function_code == FunctionCodes.WRITE_MEMORY_SINGLE.value else bytes(command[7:-2])
+        if self.verify_writes:
+            written = await self.read_registers(start_address, len(data) // 2, repeat, timeout)
+            if written is not None and written != data:
+                tracer.event("write_mismatch", device=self.address, start=start_address, requested=data.hex(), actual=written.hex())
+            data = written if written is not None else data
+        elif self.register_cache:
+            self.register_cache.store(self.address, read_function_code, start_address, data)
+        try:
+            return self.decode(read_function_code, start_address, data)
+        except Exception:
+            return ResultContainer(results)  # Not every written register has a documented value
+
     async def get_device_name(self):
         device_name = await self.client.read_gatt_char(self.DEVICE_NAME_UUID)  # Read the device name from the BLE device
         return "".join(map(chr, device_name))
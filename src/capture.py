@@ -0,0 +1,123 @@
+import struct
+import time
+from typing import Awaitable, Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+from .assembler import FrameAssembler
+from .protocol import LumiaxClient, ResultContainer
+
+MAGIC = b"LMXCAP1\n"
+FILE_HEADER = struct.Struct("<dd")  # Wall clock and monotonic time when the file was started
+RECORD_HEADER = struct.Struct("<dBBH")  # Monotonic time, kind, device number, payload length
+
+DEVICE = 0        # Announces the address of a device number
+COMMAND = 1       # Written to the device
+NOTIFICATION = 2  # A notification fragment received from the device
+
+class CaptureRecord(NamedTuple):
+    time: float  # Monotonic
+    kind: int
+    device: str
+    data: bytes
+
+class CaptureWriter:
+    """Appends commands and notification fragments to a compact binary log.
+
+    Devices are numbered in the order they appear, a DEVICE record maps the
+    number to the address before the first record that uses it.
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.monotonic):
+        self.path = path
+        self.clock = clock
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC + FILE_HEADER.pack(time.time(), clock()))
+        self.devices: Dict[str, int] = {}
+        self.records = 0
+
+    def record(self, kind: int, device: str, data: bytes) -> None:
+        number = self.devices.get(device)
+        if number is None:
+            if len(self.devices) == 256:
+                self.devices.clear()  # Numbers are reused after announcing them again
+            number = self.devices[device] = len(self.devices)
+            address = device.encode()
+            self.file.write(RECORD_HEADER.pack(self.clock(), DEVICE, number, len(address)) + address)
+        self.file.write(RECORD_HEADER.pack(self.clock(), kind, number, len(data)))
+        self.file.write(data)
+        self.records += 1
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    with open(path, "rb") as file:
+        buffer = file.read()
+    if not buffer.startswith(MAGIC):
+        raise Exception(f"{path} is not a capture file")
+    view = memoryview(buffer)
+    offset = len(MAGIC) + FILE_HEADER.size
+    devices: Dict[int, str] = {}
+    while offset + RECORD_HEADER.size <= len(buffer):
+        timestamp, kind, number, length = RECORD_HEADER.unpack_from(buffer, offset)
+        offset += RECORD_HEADER.size
+        if offset + length > len(buffer):
+            break  # Cut off while writing
+        data = view[offset:offset + length]
+        offset += length
+        if kind == DEVICE:
+            devices[number] = bytes(data).decode()
+        else:
+            yield CaptureRecord(timestamp, kind, devices.get(number, str(number)), data)
+
+class ReplayStats(NamedTuple):
+    records: int
+    frames: int
+    results: int
+    stale: int
+    errors: int
+    crc_failures: int
+    seconds: float
+
+async def replay(path: str, handler: Optional[Callable[[str, ResultContainer], Awaitable[None]]] = None,
+                 protocol: Optional[LumiaxClient] = None) -> ReplayStats:
+    # Runs a capture through reassembly, parsing and `handler` as fast as possible
+    protocol = protocol or LumiaxClient()
+    start = time.perf_counter()
+    assemblers: Dict[str, FrameAssembler] = {}
+    pending: Dict[str, Tuple[int, bytes]] = {}  # Device -> start address and response prefix of the last command
+    records = frames = results = stale = errors = 0
+    for record in read_capture(path):
+        records += 1
+        if record.kind == COMMAND:
+            command = bytes(record.data)
+            pending[record.device] = ((command[2] << 8) | command[3], protocol.response_prefix(command))
+            assembler = assemblers.get(record.device)
+            if assembler:
+                assembler.reset()
+            continue
+        assembler = assemblers.get(record.device)
+        if assembler is None:
+            assembler = assemblers[record.device] = FrameAssembler(protocol)
+        for frame in assembler.feed(record.data):
+            frames += 1
+            request = pending.get(record.device)
+            if frame[1] & 0x80:
+                errors += 1
+                continue
+            if request is None or frame[1:1 + len(request[1])] != request[1]:
+                stale += 1
+                continue
+            try:
+                parsed = protocol.parse(request[0], frame, check_crc=False)
+            except Exception:
+                errors += 1
+                continue
+            results += len(parsed)
+            if handler:
+                await handler(record.device, parsed)
+    crc_failures = sum(assembler.crc_failures for assembler in assemblers.values())
+    return ReplayStats(records, frames, results, stale, errors, crc_failures, time.perf_counter() - start)
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from .protocol import LumiaxClient, Result, MAX_WRITE_COUNT
+from .variables import FunctionCodes
+
+class CommandCoalescer:
+    """Collects bursts of commands and writes them with as few frames as possible.
+
+    Commands arriving within `window` seconds of each other are collected, for
+    at most `max_delay` seconds. Only the latest value per variable is kept
+    and adjacent registers are merged into range writes.
+    """
+
+    def __init__(self, window: float = 0.5, max_delay: float = 2.5):
+        self.window = window
+        self.max_delay = max_delay
+        self.protocol = LumiaxClient()
+        self.received = 0
+        self.rejected = 0
+        self.writes = 0
+
+    @property
+    def saved(self) -> int:
+        # Each command used to be a write of its own
+        return self.received - self.rejected - self.writes
+
+    async def collect(self, get_command: Callable[[], Awaitable[Result]]) -> List[Result]:
+        latest: Dict[str, Result] = {}
+        command = await get_command()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while True:
+            self.received += 1
+            latest.pop(command.name, None)  # The latest value wins
+            latest[command.name] = command
+            timeout = min(self.window, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                command = await asyncio.wait_for(get_command(), timeout=timeout)
+            except asyncio.TimeoutError:
+                break
+        return list(latest.values())
+
+    def plan(self, commands: List[Result]) -> Tuple[List[List[Result]], List[Tuple[Result, Exception]]]:
+        # Returns the batches to write and the commands that can't be written at all
+        valid = []
+        rejected = []
+        for command in commands:
+            try:
+                self.protocol.get_write_command(self.protocol.device_id, [command])
+                valid.append(command)
+            except Exception as e:
+                rejected.append((command, e))
+
+        batches: List[List[Result]] = []
+        for command in sorted(valid, key=lambda c: c.address):
+            if batches and self._extends(batches[-1], command):
+                batches[-1].append(command)
+            else:
+                batches.append([command])
+        self.rejected += len(rejected)
+        self.writes += len(batches)
+        return batches, rejected
+
+    def _extends(self, batch: List[Result], command: Result) -> bool:
+        last = batch[-1]
+        end = last.address + (2 if last.is_32_bit else 1)
+        count = command.address + (2 if command.is_32_bit else 1) - batch[0].address
+        return command.address == end and count <= MAX_WRITE_COUNT and \
+               all(FunctionCodes.WRITE_MEMORY_RANGE.value in c.function_codes for c in batch + [command])
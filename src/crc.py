@@ -1,11 +1,59 @@
-def crc16(data: bytes) -> bytes:
-    crc = 0xFFFF
-    for n in range(len(data)):
-        crc ^= data[n]
+from typing import Optional
+
+def _make_table(poly: int) -> tuple[int, ...]:
+    table = []
+    for byte in range(256):
+        crc = byte
         for i in range(8):
             if crc & 1:
-                crc >>= 1
-                crc ^= 0xA001
+                crc = (crc >> 1) ^ poly
             else:
                 crc >>= 1
-    return crc.to_bytes(2, 'little')
\ No newline at end of file
+        table.append(crc)
+    return tuple(table)
+
+CRC16_INIT = 0xFFFF
+CRC16_TABLE = _make_table(0xA001)
+
+def _crc16_update(crc: int, data: bytes) -> int:
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+try:
+    # Only worth it when crcmod was built with its C extension
+    from crcmod import _crcfunext
+    from crcmod.predefined import mkPredefinedCrcFun
+    _native_crc16 = mkPredefinedCrcFun("modbus")
+except ImportError:
+    _native_crc16 = None
+
+def crc16_update(crc: int, data: bytes) -> int:
+    if _native_crc16:
+        return _native_crc16(data, crc)
+    return _crc16_update(crc, data)
+
+def crc16(data: bytes) -> bytes:
+    return crc16_update(CRC16_INIT, data).to_bytes(2, 'little')
+
+class Crc16:
+    def __init__(self, data: Optional[bytes] = None):
+        self.value = CRC16_INIT
+        if data:
+            self.update(data)
+
+    def update(self, data: bytes) -> "Crc16":
+        self.value = crc16_update(self.value, data)
+        return self
+
+    def reset(self) -> None:
+        self.value = CRC16_INIT
+
+    def digest(self) -> bytes:
+        return self.value.to_bytes(2, 'little')
+
+    @property
+    def residue_ok(self) -> bool:
+        # Running the CRC over a frame including its own (little endian) CRC leaves zero
+        return self.value == 0
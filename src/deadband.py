@@ -0,0 +1,59 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from .protocol import Value
+
+@dataclass
+class Deadband:
+    absolute: float = 0.0
+    relative: float = 0.0  # Fraction of the last published value
+
+default_deadbands = {
+    "V": Deadband(absolute=0.05),
+    "A": Deadband(absolute=0.05),
+    "W": Deadband(absolute=1.0, relative=0.02),
+    "℃": Deadband(absolute=0.5),
+}
+
+class PublishFilter:
+    """Suppresses state messages that did not change meaningfully.
+
+    Numeric values are only published when they moved further than the deadband
+    of their unit, anything else when it changed at all. Every topic is
+    republished at least every `max_silence` seconds.
+    """
+
+    def __init__(self, deadbands: Optional[Dict[str, Deadband]] = None, max_silence: float = 300,
+                 clock: Callable[[], float] = time.monotonic):
+        self.deadbands = default_deadbands if deadbands is None else deadbands
+        self.max_silence = max_silence
+        self.clock = clock
+        self.last: Dict[str, Tuple[Value, float]] = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def should_publish(self, topic: str, value: Value, unit: str = "") -> bool:
+        now = self.clock()
+        last = self.last.get(topic)
+        if last is None or now - last[1] >= self.max_silence or self._changed(last[0], value, unit):
+            self.last[topic] = (value, now)
+            self.sent += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def _changed(self, last: Value, value: Value, unit: str) -> bool:
+        deadband = self.deadbands.get(unit)
+        is_numeric = isinstance(value, (int, float)) and not isinstance(value, bool) and \
+                     isinstance(last, (int, float)) and not isinstance(last, bool)
+        if deadband is None or not is_numeric:
+            return value != last
+        band = max(deadband.absolute, deadband.relative * abs(last))
+        return abs(value - last) > band if band else value != last
+
+    def forget(self, topic: Optional[str] = None) -> None:
+        if topic is None:
+            self.last.clear()
+        else:
+            self.last.pop(topic, None)
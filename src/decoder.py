@@ -0,0 +1,102 @@
+import struct
+from typing import Any, Iterable, List, Sequence, Tuple
+
+from .variables import Variable, FunctionCodes
+from .registermap import register_map
+from .protocol import ResultContainer, Result, Value
+from .crc import crc16
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+type Column = Any  # numpy array when numpy is available, a list otherwise
+
+class BlockDecoder:
+    """Decodes whole register blocks of one read request shape at once.
+
+    Variables that do not fit completely into the block (the upper half of a
+    32 bit register would be past the end) are skipped.
+    """
+
+    def __init__(self, function_code: int, start_address: int, count: int):
+        self.function_code = function_code
+        self.start_address = start_address
+        self.count = count
+        self.struct = struct.Struct(f">{count}H")
+        self.fields: List[Tuple[int, Variable]] = []
+        for offset, variable in register_map.layout(function_code, start_address, count):
+            index = offset // 2
+            if index + (2 if variable.is_32_bit else 1) <= count:
+                self.fields.append((index, variable))
+
+    @property
+    def variables(self) -> List[Variable]:
+        return [variable for _, variable in self.fields]
+
+    def _apply(self, variable: Variable, raw_value: int) -> Value:
+        if variable.multiplier:
+            return raw_value / variable.multiplier
+        elif variable.func:
+            try:
+                return variable.func(raw_value)
+            except IndexError:
+                raise Exception(f"unexpected value for {variable.name} ({hex(variable.address)}): '{raw_value}'")
+        return raw_value
+
+    def decode_words(self, words: Sequence[int]) -> List[Value]:
+        values = []
+        for index, variable in self.fields:
+            raw_value = words[index]
+            if variable.is_32_bit:
+                high = words[index + 1]
+                if variable.is_signed and high & 0x8000:
+                    high -= 0x10000
+                raw_value |= high << 16
+            elif variable.is_signed and raw_value & 0x8000:
+                raw_value -= 0x10000
+            values.append(self._apply(variable, raw_value))
+        return values
+
+    def decode(self, payload: bytes) -> ResultContainer:
+        values = self.decode_words(self.struct.unpack_from(payload))
+        return ResultContainer([Result(variable, value) for (_, variable), value in zip(self.fields, values)])
+
+    def decode_many(self, payloads: Iterable[bytes]) -> List[Tuple[Variable, Column]]:
+        if np is None:
+            rows = [self.decode_words(words) for words in self.struct.iter_unpack(b"".join(payloads))]
+            return [(variable, [row[i] for row in rows]) for i, (_, variable) in enumerate(self.fields)]
+
+        words = np.frombuffer(b"".join(payloads), dtype=">u2").reshape(-1, self.count).astype(np.int64)
+        columns = []
+        for index, variable in self.fields:
+            raw = words[:, index]
+            if variable.is_32_bit:
+                high = words[:, index + 1]
+                if variable.is_signed:
+                    high = np.where(high & 0x8000, high - 0x10000, high)
+                raw = raw | (high << 16)
+            elif variable.is_signed:
+                raw = np.where(raw & 0x8000, raw - 0x10000, raw)
+
+            if variable.multiplier:
+                column = raw / variable.multiplier
+            elif variable.func:
+                lookup = {int(x): self._apply(variable, int(x)) for x in np.unique(raw)}
+                column = [lookup[x] for x in raw.tolist()]
+            else:
+                column = raw
+            columns.append((variable, column))
+        return columns
+
+    def decode_frames(self, frames: Iterable[bytes], check_crc: bool = True) -> List[Tuple[Variable, Column]]:
+        payloads = []
+        byte_count = self.count * 2
+        for frame in frames:
+            if frame[1] != self.function_code or frame[2] != byte_count or len(frame) < byte_count + 5:
+                raise Exception(f"frame does not match a {FunctionCodes(self.function_code).name} response of {self.count} registers")
+            if check_crc and crc16(frame[:byte_count + 3]) != frame[byte_count + 3:byte_count + 5]:
+                raise Exception(f"CRC mismatch in frame 0x{bytes(frame).hex()}")
+            payloads.append(frame[3:byte_count + 3])
+        return self.decode_many(payloads)
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bleak import BleakScanner
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+
+@dataclass
+class SeenDevice:
+    device: BLEDevice
+    name: Optional[str]
+    rssi: Optional[int]
+    last_seen: float
+
+@dataclass
+class GattHandles:
+    services: List[str]  # UUIDs of the services holding the characteristics
+    notify: int
+    write: int
+
+class DeviceCache:
+    """Resolved BLE devices from a background scan, and the GATT handles of known controllers.
+
+    Connecting with a cached BLEDevice instead of an address skips the scan
+    bleak would otherwise run on every connect. The handles are kept in the
+    JSON file at `path` so that they survive restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None, scanner_factory: Callable[..., BleakScanner] = BleakScanner,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.scanner_factory = scanner_factory
+        self.clock = clock
+        self.scanner: Optional[BleakScanner] = None
+        self.devices: Dict[str, SeenDevice] = {}
+        self.handles: Dict[str, GattHandles] = {}
+        self.seen = asyncio.Event()
+        self.listeners = []
+        if path and os.path.exists(path):
+            with open(path) as file:
+                self.handles = {address: GattHandles(**handles) for address, handles in json.load(file).items()}
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self) -> None:
+        if self.scanner is None:
+            self.scanner = self.scanner_factory(detection_callback=self._on_detection)
+            await self.scanner.start()
+
+    async def stop(self) -> None:
+        scanner, self.scanner = self.scanner, None
+        if scanner is not None:
+            await scanner.stop()
+
+    def _on_detection(self, device: BLEDevice, advertisement: AdvertisementData) -> None:
+        address = device.address.upper()
+        is_new = address not in self.devices
+        self.devices[address] = SeenDevice(device, advertisement.local_name or device.name, advertisement.rssi, self.clock())
+        if is_new:
+            for listener in self.listeners:
+                listener(self.devices[address])
+        # Wake up everyone waiting for a device
+        self.seen.set()
+        self.seen = asyncio.Event()
+
+    def get(self, address: str) -> Optional[BLEDevice]:
+        entry = self.devices.get(address.upper())
+        return entry.device if entry else None
+
+    def forget(self, address: str) -> None:
+        # The device object went stale, e.g. the adapter removed it
+        self.devices.pop(address.upper(), None)
+
+    async def find(self, addresses: Iterable[str], timeout: float = 10) -> bool:
+        # Waits until all addresses were seen by the scanner
+        missing = {address.upper() for address in addresses}
+        deadline = time.monotonic() + timeout
+        while self.scanner is not None and missing - self.devices.keys():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self.seen.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                break
+        return not missing - self.devices.keys()
+
+    def gatt(self, address: str) -> Optional[GattHandles]:
+        return self.handles.get(address.upper())
+
+    def store_gatt(self, address: str, handles: Optional[GattHandles]) -> None:
+        # None forgets the handles, e.g. after a firmware update moved them
+        address = address.upper()
+        if self.handles.get(address) == handles:
+            return
+        if handles is None:
+            del self.handles[address]
+        else:
+            self.handles[address] = handles
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temporary = self.path + ".tmp"
+            with open(temporary, "w") as file:
+                json.dump({address: vars(handles) for address, handles in self.handles.items()}, file, indent=2)
+            os.replace(temporary, self.path)
@@ -0,0 +1,242 @@
+import bisect
+import mmap
+import os
+import re
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .protocol import ResultContainer
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+RAW_RECORD = struct.Struct("<dd")           # time, value
+AGGREGATE_RECORD = struct.Struct("<dIddd")  # bucket start, count, min, max, mean
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    resolution: float  # Bucket size in seconds, 0 keeps every reading
+    segment: float     # Time span of a single file in seconds
+    retention: float   # In seconds
+
+    @property
+    def record(self) -> struct.Struct:
+        return AGGREGATE_RECORD if self.resolution else RAW_RECORD
+
+default_tiers = [
+    Tier("raw", 0, DAY, 7 * DAY),
+    Tier("1m", MINUTE, 30 * DAY, 90 * DAY),
+    Tier("1h", HOUR, 365 * DAY, 5 * 365 * DAY),
+]
+
+class Point(NamedTuple):
+    time: float
+    count: int
+    min: float
+    max: float
+    mean: float
+
+class _Bucket:
+    __slots__ = ("start", "count", "min", "max", "sum")
+
+    def __init__(self, start: float, value: float):
+        self.start = start
+        self.count = 1
+        self.min = self.max = self.sum = value
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+
+    def pack(self) -> bytes:
+        return AGGREGATE_RECORD.pack(self.start, self.count, self.min, self.max, self.sum / self.count)
+
+class HistoryStore:
+    """Keeps numeric readings in append-only files, one directory per device and variable.
+
+    Every tier is split into segment files named after the time they start, so
+    queries only open the segments they overlap and retention deletes whole
+    files. Records within a file are sorted by time and located by bisection.
+    Writes are buffered and appended every `flush_interval` seconds.
+    """
+
+    def __init__(self, path: str, tiers: List[Tier] = default_tiers, flush_interval: float = 60,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.tiers = sorted(tiers, key=lambda tier: tier.resolution)
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.pending: Dict[str, bytearray] = {}
+        self.buckets: Dict[Tuple[str, str, str], _Bucket] = {}
+        self.last_time: Dict[Tuple[str, str], float] = {}
+        self.last_flush = clock()
+        self.last_retention = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def get_directory(self, device: str, name: str) -> str:
+        return os.path.join(self.path, re.sub(r"[^\w.-]", "_", device), name)
+
+    def get_segment_path(self, device: str, name: str, tier: Tier, timestamp: float) -> str:
+        segment = int(timestamp // tier.segment * tier.segment)
+        return os.path.join(self.get_directory(device, name), f"{tier.name}-{segment}.bin")
+
+    def append(self, device: str, results: ResultContainer, timestamp: Optional[float] = None) -> None:
+        timestamp = self.clock() if timestamp is None else timestamp
+        for key, result in results.items():
+            value = result.value
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            # Files have to stay sorted even if the clock jumps back
+            at = max(timestamp, self.last_time.get((device, key), timestamp))
+            self.last_time[(device, key)] = at
+            for tier in self.tiers:
+                if tier.resolution:
+                    self._aggregate(device, key, tier, at, float(value))
+                else:
+                    self._write(device, key, tier, at, RAW_RECORD.pack(at, value))
+        if self.clock() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def _aggregate(self, device: str, name: str, tier: Tier, timestamp: float, value: float) -> None:
+        start = timestamp // tier.resolution * tier.resolution
+        bucket = self.buckets.get((device, name, tier.name))
+        if bucket is not None and bucket.start == start:
+            bucket.add(value)
+            return
+        if bucket is not None:
+            self._write(device, name, tier, bucket.start, bucket.pack())
+        self.buckets[(device, name, tier.name)] = _Bucket(start, value)
+
+    def _write(self, device: str, name: str, tier: Tier, timestamp: float, record: bytes) -> None:
+        path = self.get_segment_path(device, name, tier, timestamp)
+        self.pending.setdefault(path, bytearray()).extend(record)
+
+    def flush(self, partial: bool = False) -> None:
+        if partial:
+            # Unfinished buckets are written as well, queries merge them with their continuation
+            for (device, name, tier_name), bucket in self.buckets.items():
+                tier = next(tier for tier in self.tiers if tier.name == tier_name)
+                self._write(device, name, tier, bucket.start, bucket.pack())
+            self.buckets.clear()
+        for path, data in self.pending.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as file:
+                file.write(data)
+        self.pending.clear()
+        self.last_flush = self.clock()
+        if self.last_flush - self.last_retention >= HOUR:
+            self.enforce_retention(self.last_flush)
+
+    def close(self) -> None:
+        self.flush(partial=True)
+
+    def _segments(self, device: str, name: str, tier: Tier) -> List[Tuple[int, str]]:
+        directory = self.get_directory(device, name)
+        try:
+            files = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        segments = []
+        for file in files:
+            match = re.match(rf"^{re.escape(tier.name)}-(\d+)\.bin$", file)
+            if match:
+                segments.append((int(match.group(1)), os.path.join(directory, file)))
+        return sorted(segments)
+
+    def enforce_retention(self, now: Optional[float] = None) -> int:
+        now = self.clock() if now is None else now
+        self.last_retention = now
+        removed = 0
+        if not os.path.isdir(self.path):
+            return removed
+        for device in os.listdir(self.path):
+            device_path = os.path.join(self.path, device)
+            if not os.path.isdir(device_path):
+                continue  # E.g. .DS_Store or a lock file
+            for name in os.listdir(device_path):
+                if not os.path.isdir(os.path.join(device_path, name)):
+                    continue
+                for tier in self.tiers:
+                    for start, path in self._segments(device, name, tier):
+                        if start + tier.segment < now - tier.retention:
+                            os.remove(path)
+                            removed += 1
+        return removed
+
+    def select_tier(self, start: float, resolution: float = 0) -> Tier:
+        now = self.clock()
+        candidates = [i for i, tier in enumerate(self.tiers) if tier.resolution <= resolution] or [0]
+        # Fall back to coarser tiers when the range reaches beyond the retention
+        for tier in self.tiers[candidates[-1]:]:
+            if now - tier.retention <= start:
+                return tier
+        return self.tiers[-1]
+
+    def query(self, device: str, name: str, start: float, end: float, resolution: float = 0,
+              tier: Optional[Tier] = None) -> List[Point]:
+        tier = tier or self.select_tier(start, resolution)
+        self.flush()
+        if not tier.resolution:
+            return list(self._read(device, name, tier, start, end))
+        points: List[Point] = []
+        for point in self._read(device, name, tier, start, end):
+            _add(points, point)
+        bucket = self.buckets.get((device, name, tier.name))
+        if bucket is not None and start <= bucket.start < end:
+            _add(points, Point(bucket.start, bucket.count, bucket.min, bucket.max, bucket.sum / bucket.count))
+        return points
+
+    def _read(self, device: str, name: str, tier: Tier, start: float, end: float) -> Iterator[Point]:
+        record = tier.record
+        for segment, path in self._segments(device, name, tier):
+            if segment + tier.segment <= start or segment >= end:
+                continue
+            with open(path, "rb") as file:
+                size = os.fstat(file.fileno()).st_size // record.size * record.size
+                if not size:
+                    continue
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    times = _RecordTimes(data, record, size // record.size)
+                    first = bisect.bisect_left(times, start)
+                    last = bisect.bisect_left(times, end, first)
+                    for fields in record.iter_unpack(data[first * record.size:last * record.size]):
+                        if tier.resolution:
+                            yield Point(*fields)
+                        else:
+                            yield Point(fields[0], 1, fields[1], fields[1], fields[1])
+
+class _RecordTimes:
+    # Sequence view on the timestamps of fixed size records for bisect
+    def __init__(self, data: mmap.mmap, record: struct.Struct, count: int):
+        self.data = data
+        self.record = record
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int) -> float:
+        return self.record.unpack_from(self.data, index * self.record.size)[0]
+
+def _add(points: List[Point], point: Point) -> None:
+    # Buckets that were flushed unfinished show up more than once
+    last = points[-1] if points else None
+    if last is None or last.time != point.time:
+        points.append(point)
+        return
+    count = last.count + point.count
+    points[-1] = Point(last.time, count, min(last.min, point.min), max(last.max, point.max),
+                       (last.mean * last.count + point.mean * point.count) / count)
@@ -1,29 +1,45 @@
+import asyncio
 import json
 import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 from aiomqtt import Client
 
 from src.protocol import ResultContainer, Result, FunctionCodes
 from src.variables import VariableContainer, Variable, variables
+from src.deadband import PublishFilter
+from src.instrumentation import tracer
+from src.scheduler import ReadGroup
 
-class MqttSensor(Client):
+class Entity(NamedTuple):
+    platform: str
+    config_topic: str
+    state_topic: str
+    command_topic: str
+    config: bytes  # Discovery payload
+    is_writable: bool
+
+class MqttDevice:
     # Define the base topic for MQTT Discovery
     base_topic = "homeassistant"
 
-    # Define the sensor name
-    sensor_name = "solarlife"
+    # Entities survive broker reconnects, keyed by sensor name and variable name
+    entity_cache: Dict[str, Dict[Tuple[str, Optional[str]], Entity]] = {}
 
-    # Define the device information
-    device_info = {
-        "identifiers": ["solarlife_mppt_ble"],
-        "name": "Solarlife",
-        "manufacturer": "Solarlife",
-    }
-
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.known_names = set()
+    def __init__(self, client: "MqttSensor", sensor_name: str, device_info: dict, publish_filter: PublishFilter,
+                 aggregate: bool = False):
+        self.client = client
+        self.sensor_name = sensor_name
+        self.device_info = device_info
+        self.publish_filter = publish_filter
+        self.aggregate = aggregate
+        self.entities = self.entity_cache.setdefault(sensor_name, {})
+        # With aggregation, variable name -> group whose JSON document holds its state
+        self.groups: Dict[str, str] = {}
+        self.documents: Dict[str, dict] = {}
+        self.known_names: Dict[str, None] = {}  # Keeps the discovery order for republishing
         self.subscribed_names = set()
+        self.commands = asyncio.Queue()
 
     # https://www.home-assistant.io/integrations/#search/mqtt
     def get_platform(self, variable: Variable) -> str:
@@ -41,103 +57,167 @@ class MqttSensor(Client):
         elif is_writable and is_numeric:
             return "number"
         elif is_writable:
-            # to-do: select or text 
+            # to-do: select or text
             pass
         return "sensor"
 
+    def get_entity(self, variable: Variable) -> Entity:
+        key = (variable.name, self.groups.get(variable.name))
+        entity = self.entities.get(key)
+        if entity is None:
+            entity = self.entities[key] = self.create_entity(variable, key[1])
+        return entity
+
+    def get_group_topic(self, group: str) -> str:
+        return f"{self.base_topic}/{self.sensor_name}/{group}/state"
+
+    def get_history_topic(self) -> str:
+        return f"{self.base_topic}/{self.sensor_name}/history"
+
     def get_config_topic(self, variable: Variable) -> str:
-        platform = self.get_platform(variable)
-        return f"{self.base_topic}/{platform}/{self.sensor_name}/{variable.name}/config"
-    
+        return self.get_entity(variable).config_topic
+
     def get_state_topic(self, variable: Variable) -> str:
-        platform = self.get_platform(variable)
-        return f"{self.base_topic}/{platform}/{self.sensor_name}/{variable.name}/state"
+        return self.get_entity(variable).state_topic
 
     def get_command_topic(self, variable: Variable) -> str:
+        return self.get_entity(variable).command_topic
+
+    def create_entity(self, variable: Variable, group: Optional[str] = None) -> Entity:
+        key = variable.name
         platform = self.get_platform(variable)
-        return f"{self.base_topic}/{platform}/{self.sensor_name}/{variable.name}/command"
+        config_topic = f"{self.base_topic}/{platform}/{self.sensor_name}/{key}/config"
+        if group:
+            state_topic = self.get_group_topic(group)
+        else:
+            state_topic = f"{self.base_topic}/{platform}/{self.sensor_name}/{key}/state"
+        command_topic = f"{self.base_topic}/{platform}/{self.sensor_name}/{key}/command"
+        is_writable = FunctionCodes.WRITE_MEMORY_SINGLE.value in variable.function_codes or \
+                      FunctionCodes.WRITE_STATUS_REGISTER.value in variable.function_codes
+
+        # Create the MQTT Discovery payload
+        payload = {
+            "name": variable.friendly_name,
+            "device": self.device_info,
+            "object_id": f"{self.sensor_name}_{key}",
+            "unique_id": f"{self.sensor_name}_{key}",
+            "state_topic": state_topic,
+        }
+        if group:
+            payload["value_template"] = f"{{{{ value_json.{key} }}}}"
+
+        if variable.multiplier != 0:
+            payload["unit_of_measurement"] = variable.unit
+            payload["mode"] = "box"
+            payload["min"] = 0
+
+        if "daily" in key and "Wh" in variable.unit:
+            payload['device_class'] = "energy"
+            payload['state_class'] = "total_increasing"
+        elif "total" in key and "Wh" in variable.unit:
+            payload['device_class'] = "energy"
+            payload['state_class'] = "total"
+        elif "Wh" in variable.unit:
+            payload['device_class'] = "energy"
+            payload['state_class'] = "measurement"
+        elif "V" in variable.unit:
+            payload['device_class'] = "voltage"
+            payload['state_class'] = "measurement"
+        elif "A" in variable.unit:
+            payload['device_class'] = "current"
+            payload['state_class'] = "measurement"
+        elif "W" in variable.unit:
+            payload['device_class'] = "power"
+            payload['state_class'] = "measurement"
+        elif "°C" in variable.unit:
+            payload['device_class'] = "temperature"
+            payload['state_class'] = "measurement"
+        elif key == "battery_percentage":
+            payload['device_class'] = "battery"
+            payload['state_class'] = "measurement"
+        elif "timing_period" in key or "delay" in key or "total_light_time" in key:
+            payload['device_class'] = "duration"
+
+        if platform == "button":
+            on, off = variable.binary_payload
+            payload["payload_press"] = on
+        elif variable.binary_payload:
+            on, off = variable.binary_payload
+            payload["payload_on"] = on
+            payload["payload_off"] = off
+
+        # Handle writable entities
+        if is_writable:
+            payload["command_topic"] = command_topic
+
+        config = json.dumps(payload).encode()
+        return Entity(platform, config_topic, state_topic, command_topic, config, is_writable)
+
+    async def publish_all(self, messages: list[Tuple[str, str | bytes, bool]]) -> None:
+        if not messages:
+            return
+        # Keep all messages in flight at once instead of waiting for each acknowledgement
+        with tracer.span("mqtt_publish", device=self.sensor_name, messages=len(messages)):
+            await asyncio.gather(*[self.client.publish_message(topic, payload=payload, retain=retain)
+                                   for topic, payload, retain in messages])
 
     async def store_config(self, variables: VariableContainer) -> None:
         # Publish each item in the results to its own MQTT topic
+        messages = []
         for key, variable in variables.items():
             if key in self.known_names:
                 continue
-            self.known_names.add(key)
-
-            platform = self.get_platform(variable)
-            config_topic = self.get_config_topic(variable)
-            state_topic = self.get_state_topic(variable)
-            command_topic = self.get_command_topic(variable)
-
-            print(f"Publishing homeassistant config for {platform} {key}")
-
-            # Create the MQTT Discovery payload
-            payload = {
-                "name": variable.friendly_name,
-                "device": self.device_info,
-                "object_id": f"{self.sensor_name}_{key}",
-                "unique_id": f"{self.sensor_name}_{key}",
-                "state_topic": state_topic,
-            }
-
-            if variable.multiplier != 0:
-                payload["unit_of_measurement"] = variable.unit
-                payload["mode"] = "box"
-                payload["min"] = 0
-                
-            if "daily" in key and "Wh" in variable.unit:
-                payload['device_class'] = "energy"
-                payload['state_class'] = "total_increasing"
-            elif "total" in key and "Wh" in variable.unit:
-                payload['device_class'] = "energy"
-                payload['state_class'] = "total"
-            elif "Wh" in variable.unit:
-                payload['device_class'] = "energy"
-                payload['state_class'] = "measurement"
-            elif "V" in variable.unit:
-                payload['device_class'] = "voltage"
-                payload['state_class'] = "measurement"
-            elif "A" in variable.unit:
-                payload['device_class'] = "current"
-                payload['state_class'] = "measurement"
-            elif "W" in variable.unit:
-                payload['device_class'] = "power"
-                payload['state_class'] = "measurement"
-            elif "°C" in variable.unit:
-                payload['device_class'] = "temperature"
-                payload['state_class'] = "measurement"
-            elif key == "battery_percentage":
-                payload['device_class'] = "battery"
-                payload['state_class'] = "measurement"
-            elif "timing_period" in key or "delay" in key or "total_light_time" in key:
-                payload['device_class'] = "duration"
-
-            if platform == "button":
-                on, off = variable.binary_payload
-                payload["payload_press"] = on
-            elif variable.binary_payload:
-                on, off = variable.binary_payload
-                payload["payload_on"] = on
-                payload["payload_off"] = off
-
-            # Handle writable entities
-            if FunctionCodes.WRITE_MEMORY_SINGLE.value in variable.function_codes or \
-               FunctionCodes.WRITE_STATUS_REGISTER.value in variable.function_codes:
-                payload["command_topic"] = command_topic
-
+            self.known_names[key] = None
+            entity = self.get_entity(variable)
+            print(f"Publishing homeassistant config for {entity.platform} {key}")
             # Publish the MQTT Discovery payload
-            await super().publish(config_topic, payload=json.dumps(payload), retain=True)
+            messages.append((entity.config_topic, entity.config, True))
+        await self.publish_all(messages)
+
+    async def republish_config(self) -> None:
+        # Home Assistant restarted and lost all entities that are not retained
+        messages = []
+        for key in self.known_names:
+            entity = self.entities[(key, self.groups.get(key))]
+            messages.append((entity.config_topic, entity.config, True))
+        await self.publish_all(messages)
+        self.publish_filter.forget()
 
-    async def publish(self, results: ResultContainer):
+    async def publish(self, results: ResultContainer, force: bool = False, group: Optional[str] = None):
+        if self.aggregate and group:
+            for key, result in results.items():
+                self.groups.setdefault(key, group)
         await self.store_config(results)
+
+        messages = []
+        changed_groups = {}
         # Publish each item in the details dictionary to its own MQTT topic
         for key, result in results.items():
-            state_topic = self.get_state_topic(result)
-            is_writable = FunctionCodes.WRITE_MEMORY_SINGLE.value in result.function_codes or \
-                          FunctionCodes.WRITE_STATUS_REGISTER.value in result.function_codes
+            entity = self.get_entity(result.variable)
+            result_group = self.groups.get(key)
+            filter_key = f"{entity.state_topic}/{key}" if result_group else entity.state_topic
+            if force:
+                self.publish_filter.forget(filter_key)
+            changed = self.publish_filter.should_publish(filter_key, result.value, result.variable.unit)
+            if result_group:
+                # Every field is kept so that the document always holds all of them
+                self.documents.setdefault(result_group, {})[key] = result.value
+                if changed:
+                    changed_groups[result_group] = changed_groups.get(result_group, False) or entity.is_writable
+            elif changed:
+                # Publish the entity state
+                messages.append((entity.state_topic, str(result.value), entity.is_writable))
+
+        for result_group, is_writable in changed_groups.items():
+            messages.append((self.get_group_topic(result_group), json.dumps(self.documents[result_group]), is_writable))
+        await self.publish_all(messages)
 
-            # Publish the entity state
-            await super().publish(state_topic, payload=str(result.value), retain=is_writable)
+    async def publish_groups(self, results: ResultContainer, groups: List[ReadGroup]):
+        if self.aggregate:
+            for group in groups:
+                await self.publish(ResultContainer([r for r in results if group.variables.get(r.name)]), group=group.name)
+        # Anything that was not part of a group (or all values without aggregation)
+        await self.publish(ResultContainer([r for r in results if r.name not in self.groups]))
 
     async def subscribe(self, variables: VariableContainer):
         for key, variable in variables.items():
@@ -146,15 +226,100 @@ class MqttSensor(Client):
                 if key in self.subscribed_names:
                     continue
                 self.subscribed_names.add(key)
-                platform = self.get_platform(variable)
-                command_topic = self.get_command_topic(variable)
-                print(f"Subscribing to homeassistant commands for {platform} {variable.name}")
-                await super().subscribe(topic=command_topic, qos=2)
-    
+                entity = self.get_entity(variable)
+                print(f"Subscribing to homeassistant commands for {entity.platform} {variable.name}")
+                await self.client.subscribe_topic(entity.command_topic, qos=2)
+
     async def get_command(self) -> Result:
-        message = await anext(self.messages)
+        self.client.start_dispatcher()
+        if self.client.dispatch_error and self.commands.empty():
+            raise self.client.dispatch_error
+        message = await self.commands.get()
+        if isinstance(message, Exception):
+            raise message
         match = re.match(rf"^{self.base_topic}/\w+/{self.sensor_name}/(\w+)/", message.topic.value)
         variable_name = match.group(1)
         variable = variables[variable_name]
         value = str(message.payload, encoding="utf8")
-        return Result(**vars(variable), value=value)
\ No newline at end of file
+        return Result(variable, value)
+
+class MqttSensor(MqttDevice, Client):
+    # Define the sensor name
+    sensor_name = "solarlife"
+
+    # Home Assistant announces "online" here after it (re)started
+    status_topic = f"{MqttDevice.base_topic}/status"
+
+    # Define the device information
+    device_info = {
+        "identifiers": ["solarlife_mppt_ble"],
+        "name": "Solarlife",
+        "manufacturer": "Solarlife",
+    }
+
+    def __init__(self, *args, deadbands: Optional[dict] = None, max_silence: float = 300, aggregate: bool = False, **kwargs):
+        Client.__init__(self, *args, **kwargs)
+        self.deadbands = deadbands
+        self.max_silence = max_silence
+        MqttDevice.__init__(self, self, self.sensor_name, self.device_info, self.create_filter(), aggregate)
+        self.devices = {self.sensor_name: self}
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.dispatch_error: Optional[Exception] = None
+
+    def device(self, address: Optional[str] = None) -> MqttDevice:
+        # Without an address this is the single, unnamed controller for compatibility
+        if address is None:
+            return self
+        mac = address.replace(":", "").lower()
+        sensor_name = f"{self.sensor_name}_{mac}"
+        if sensor_name not in self.devices:
+            device_info = {
+                "identifiers": [f"solarlife_mppt_ble_{mac}"],
+                "connections": [["bluetooth", address]],
+                "name": f"Solarlife {address}",
+                "manufacturer": "Solarlife",
+            }
+            self.devices[sensor_name] = MqttDevice(self, sensor_name, device_info, self.create_filter(), self.aggregate)
+        return self.devices[sensor_name]
+
+    def create_filter(self) -> PublishFilter:
+        return PublishFilter(self.deadbands, self.max_silence)
+
+    async def publish_message(self, topic: str, payload: str | bytes, retain: bool = False, qos: int = 0) -> None:
+        await Client.publish(self, topic, payload=payload, retain=retain, qos=qos)
+
+    async def subscribe_topic(self, topic: str, qos: int = 0) -> None:
+        await Client.subscribe(self, topic=topic, qos=qos)
+
+    def start_dispatcher(self) -> None:
+        if self.dispatcher is None:
+            self.dispatcher = asyncio.get_running_loop().create_task(self.dispatch_commands())
+
+    async def dispatch_commands(self) -> None:
+        # Route incoming command messages to the queue of the device they address
+        try:
+            async for message in self.messages:
+                if message.topic.matches(self.status_topic):
+                    if message.payload == b"online":
+                        for device in list(self.devices.values()):
+                            await device.republish_config()
+                    continue
+                match = re.match(rf"^{self.base_topic}/\w+/(\w+)/\w+/command$", message.topic.value)
+                device = self.devices.get(match.group(1)) if match else None
+                if device:
+                    device.commands.put_nowait(message)
+        except Exception as e:
+            self.dispatch_error = e
+            for device in self.devices.values():
+                device.commands.put_nowait(e)
+
+    async def __aenter__(self):
+        await Client.__aenter__(self)
+        await self.subscribe_topic(self.status_topic, qos=1)
+        self.start_dispatcher()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+        return await Client.__aexit__(self, exc_type, exc, tb)
@@ -0,0 +1,139 @@
+import json
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, TextIO
+
+class Record(NamedTuple):
+    kind: str  # "span", "counter" or "event"
+    name: str
+    timestamp: float  # Wall clock time the span started or the counter/event happened
+    value: Optional[float]  # Duration of a span in seconds, increment of a counter
+    attributes: dict
+
+Exporter = Callable[[Record], None]
+
+class _Span:
+    __slots__ = ("tracer", "name", "attributes", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.timing(self.name, time.perf_counter() - self.start, **self.attributes)
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def set(self, **attributes) -> None:
+        pass
+
+_null_span = _NullSpan()
+
+class Tracer:
+    """Emits timed spans, counters and events to the registered exporters.
+
+    Without exporters the tracer is disabled and `span` returns a shared no-op
+    context manager, hot paths can additionally check `enabled` before taking
+    timestamps of their own.
+    """
+
+    def __init__(self):
+        self.exporters: List[Exporter] = []
+        self.enabled = False
+
+    def add_exporter(self, exporter: Exporter) -> None:
+        self.exporters.append(exporter)
+        self.enabled = True
+
+    def remove_exporter(self, exporter: Exporter) -> None:
+        self.exporters.remove(exporter)
+        self.enabled = bool(self.exporters)
+
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            return _null_span
+        return _Span(self, name, attributes)
+
+    def timing(self, name: str, duration: float, **attributes) -> None:
+        # A span that was measured by the caller
+        if self.enabled:
+            self.emit(Record("span", name, time.time() - duration, duration, attributes))
+
+    def count(self, name: str, value: float = 1, **attributes) -> None:
+        if self.enabled:
+            self.emit(Record("counter", name, time.time(), value, attributes))
+
+    def event(self, name: str, **attributes) -> None:
+        if self.enabled:
+            self.emit(Record("event", name, time.time(), None, attributes))
+
+    def emit(self, record: Record) -> None:
+        for exporter in self.exporters:
+            exporter(record)
+
+# Shared by all modules, disabled until an exporter is added
+tracer = Tracer()
+
+class LogExporter:
+    def __init__(self, stream: TextIO = sys.stdout):
+        self.stream = stream
+
+    def __call__(self, record: Record) -> None:
+        attributes = " ".join(f"{key}={value}" for key, value in record.attributes.items())
+        if record.kind == "span":
+            print(f"[span] {record.name} {record.value * 1000:.1f}ms {attributes}", file=self.stream)
+        elif record.kind == "counter":
+            print(f"[counter] {record.name} +{record.value:g} {attributes}", file=self.stream)
+        else:
+            print(f"[event] {record.name} {attributes}", file=self.stream)
+
+class JsonLinesExporter:
+    def __init__(self, path: str):
+        self.file = open(path, "a", encoding="utf8")
+
+    def __call__(self, record: Record) -> None:
+        self.file.write(json.dumps(record._asdict(), default=str) + "\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+class SummaryExporter:
+    """Aggregates spans and counters by name, to see where the time goes."""
+
+    def __init__(self):
+        self.spans: Dict[str, List[float]] = {}  # Name -> [count, total, max]
+        self.counters: Dict[str, float] = {}
+
+    def __call__(self, record: Record) -> None:
+        if record.kind == "span":
+            stats = self.spans.setdefault(record.name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += record.value
+            stats[2] = max(stats[2], record.value)
+        elif record.kind == "counter":
+            self.counters[record.name] = self.counters.get(record.name, 0) + record.value
+
+    def report(self) -> str:
+        lines = [f"{'span':<20} {'count':>8} {'total':>10} {'mean':>10} {'max':>10}"]
+        for name, (count, total, peak) in sorted(self.spans.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<20} {count:>8} {total:>9.3f}s {total / count * 1000:>8.1f}ms {peak * 1000:>8.1f}ms")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<20} {value:>8g}")
+        return "\n".join(lines)
@@ -0,0 +1,115 @@
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .protocol import ResultContainer, Value
+from .session import BleSession
+from .spool import Spool
+
+prefix = "solarlife"
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _metric_type(name: str) -> str:
+    # Counters that only ever increase, daily values reset and are gauges
+    return "counter" if name.endswith("_times") or name.endswith("_total_energy") or name == "run_days" else "gauge"
+
+class MetricsSnapshot:
+    """Latest readings and link statistics, rendered in the Prometheus text format.
+
+    Readings are pushed after every poll, statistics are read from the
+    sessions and the spool when scraped, so a scrape never talks to a device.
+    """
+
+    def __init__(self, sessions: Optional[List[BleSession]] = None, spool: Optional[Spool] = None):
+        self.sessions = sessions or []
+        self.spool = spool
+        self.readings: Dict[Tuple[str, str], Tuple[Value, str]] = {}
+        self.polls: Dict[str, Tuple[float, float]] = {}  # Device -> (duration, timestamp)
+        self.scrapes = 0
+
+    def update(self, device: str, results: ResultContainer, duration: Optional[float] = None) -> None:
+        for key, result in results.items():
+            self.readings[(key, device)] = (result.value, result.variable.unit)
+        if duration is not None:
+            self.polls[device] = (duration, time.time())
+
+    def render(self) -> str:
+        lines = []
+        families: Dict[str, List[str]] = {}
+        for (key, device), (value, unit) in sorted(self.readings.items()):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                # Text values become info style metrics
+                families.setdefault(f"{key}_info", []).append(
+                    f"{prefix}_{key}_info{_labels({'device': device, 'value': value})} 1")
+            else:
+                families.setdefault(key, []).append(
+                    f"{prefix}_{key}{_labels({'device': device, 'unit': unit})} {value}")
+        for name, samples in families.items():
+            lines.append(f"# TYPE {prefix}_{name} {'gauge' if name.endswith('_info') else _metric_type(name)}")
+            lines.extend(samples)
+
+        def family(name: str, kind: str, help: str, samples: List[Tuple[str, float]]) -> None:
+            if samples:
+                lines.append(f"# HELP {prefix}_{name} {help}")
+                lines.append(f"# TYPE {prefix}_{name} {kind}")
+                lines.extend(f"{prefix}_{name}{_labels({'device': device})} {value}" for device, value in samples)
+
+        health = [(session.address, session.health(), session.counters()) for session in self.sessions]
+        family("ble_connects_total", "counter", "Successful BLE connections",
+               [(address, h["connects"]) for address, h, c in health])
+        family("ble_connect_failures_total", "counter", "Failed BLE connection attempts",
+               [(address, h["connect_failures"]) for address, h, c in health])
+        family("ble_link_losses_total", "counter", "BLE links lost while connected",
+               [(address, h["link_losses"]) for address, h, c in health])
+        family("ble_requests_total", "counter", "BLE transactions",
+               [(address, h["requests"]) for address, h, c in health])
+        family("ble_retries_total", "counter", "Repeated read and write commands",
+               [(address, c.get("retries", 0)) for address, h, c in health])
+        family("ble_crc_failures_total", "counter", "Responses with a wrong CRC",
+               [(address, c.get("crc_failures", 0)) for address, h, c in health])
+        family("ble_parse_errors_total", "counter", "Responses that could not be parsed",
+               [(address, c.get("parse_errors", 0)) for address, h, c in health])
+        family("ble_stale_responses_total", "counter", "Late responses to earlier requests that were dropped",
+               [(address, c.get("stale_responses", 0)) for address, h, c in health])
+        family("ble_connect_seconds", "gauge", "Duration of the last BLE connection setup",
+               [(address, h["connect_latency"]) for address, h, c in health if h["connect_latency"] is not None])
+        family("poll_duration_seconds", "gauge", "Duration of the last poll",
+               [(device, duration) for device, (duration, _) in sorted(self.polls.items())])
+        family("last_poll_timestamp_seconds", "gauge", "Time of the last successful poll",
+               [(device, timestamp) for device, (_, timestamp) in sorted(self.polls.items())])
+        if self.spool is not None:
+            lines.append(f"# TYPE {prefix}_spool_readings gauge")
+            lines.append(f"{prefix}_spool_readings {len(self.spool)}")
+            lines.append(f"# TYPE {prefix}_spool_dropped_total counter")
+            lines.append(f"{prefix}_spool_dropped_total {self.spool.dropped}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=10)
+            while (await asyncio.wait_for(reader.readline(), timeout=10)) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            match = re.match(rb"^(GET|HEAD) (?:(/metrics(?:\?\S*)?)|\S*) HTTP/1\.[01]", request)
+            if match and match.group(2):
+                self.scrapes += 1
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+            if match and match.group(1) == b"GET":
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.Server:
+        return await asyncio.start_server(self.handle, host, port)
@@ -1,20 +1,60 @@
 import struct
 from dataclasses import dataclass
-from typing import Any, List, Union, Tuple, Optional
+from typing import Any, Iterable, List, Union, Tuple, Optional
 
-from .variables import variables, Variable, FunctionCodes
+from .variables import Variable, FunctionCodes
+from .registermap import register_map
 from .crc import crc16
 
 type Value = str|int|float
 
-@dataclass
-class Result(Variable):
-    value: Value
+MAX_READ_COUNT = 127  # The byte count of a response must fit into a single byte
+MAX_WRITE_COUNT = 127  # Same for the byte count of a range write
+READ_FUNCTION_CODES = [FunctionCodes.READ_STATUS_REGISTER.value, FunctionCodes.READ_PARAMETER.value, FunctionCodes.READ_MEMORY.value]
+
+@dataclass(frozen=True)
+class ReadRequest:
+    function_code: int
+    start_address: int
+    count: int
+
+class Result:
+    """A value together with the (shared) variable it was decoded for.
+
+    Attributes of the variable can be read from the result directly. Results
+    are also accepted in the old form `Result(**vars(variable), value=value)`,
+    which creates a new variable.
+    """
+    __slots__ = ("variable", "value")
+
+    def __init__(self, variable: Optional[Variable] = None, value: Value = None, **fields):
+        self.variable = Variable(**fields) if fields else variable
+        self.value = value
+
+    def __getattr__(self, name: str):
+        if name == "variable":  # Not initialized yet
+            raise AttributeError(name)
+        return getattr(self.variable, name)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Result):
+            return NotImplemented
+        return self.variable == other.variable and self.value == other.value
+
+    def __repr__(self) -> str:
+        return f"Result({self.variable.name}={self.value!r})"
 
 class ResultContainer:
     def __init__(self, results: List[Result]):
         self._results = results
-        self._result_map = {res.name: res for res in results}
+        self._map: Optional[dict] = None
+
+    @property
+    def _result_map(self) -> dict:
+        # Only built when results are looked up by name
+        if self._map is None:
+            self._map = {res.name: res for res in self._results}
+        return self._map
 
     def __getitem__(self, key: Union[int, str, slice]) -> Result:
         if isinstance(key, int):
@@ -76,7 +116,7 @@ class LumiaxClient:
         if variable.multiplier and not variable.func:
             raw_value = round(float(value) * variable.multiplier)
         elif variable.func:
-            raw_value = self._find_raw_value_by_brute_force(variable, value)
+            raw_value = self._find_raw_value(variable, value)
             if raw_value == None:
                 raise Exception(f"invalid value for {variable.name}: '{value}'")
         elif variable.binary_payload and value == variable.binary_payload[0]:
@@ -106,7 +146,7 @@ class LumiaxClient:
         return offset + length
 
     def get_read_command(self, device_id: int, start_address: int, count: int) -> bytes:
-        items = [v for v in variables if v.address >= start_address and v.address < start_address + count]
+        items = register_map.in_range(start_address, count)
         if not items:
             raise Exception(f"the range {hex(start_address)}-{hex(start_address+count-1)} contains no variables")
         
@@ -124,6 +164,59 @@ class LumiaxClient:
         ])
         return result + crc16(result)
 
+    def plan_reads(self, variables: Iterable[Union[str, Variable]], request_cost: int = 40) -> List[ReadRequest]:
+        # Finds the cheapest set of read requests covering all variables, where every
+        # request costs `request_cost` plus one per register read
+        spans = {}
+        for variable in variables:
+            if isinstance(variable, str):
+                name, variable = variable, register_map.variable(variable)
+                if variable is None:
+                    raise Exception(f"unknown variable {name}")
+            function_code = next((fc for fc in variable.function_codes if fc in READ_FUNCTION_CODES), None)
+            if function_code is None:
+                raise Exception(f"{variable.name} ({hex(variable.address)}) can not be read")
+            end = variable.address + (2 if variable.is_32_bit else 1)
+            spans.setdefault(function_code, set()).add((variable.address, end))
+
+        requests = []
+        for function_code, ranges in sorted(spans.items()):
+            ranges = sorted(ranges)
+            # cost[j] is the cheapest plan for the first j ranges as (cost, number of requests),
+            # choice[j] is where the last request of that plan starts
+            cost = [(0, 0)] + [None] * len(ranges)
+            choice = [0] * (len(ranges) + 1)
+            for j in range(1, len(ranges) + 1):
+                end = 0
+                for i in range(j, 0, -1):
+                    start = ranges[i-1][0]
+                    end = max(end, ranges[i-1][1])
+                    if end - start > MAX_READ_COUNT:
+                        break
+                    if not all(function_code in v.function_codes for v in register_map.in_range(start, end - start)):
+                        break
+                    candidate = (cost[i-1][0] + request_cost + end - start, cost[i-1][1] + 1)
+                    if cost[j] is None or candidate < cost[j]:
+                        cost[j] = candidate
+                        choice[j] = i
+
+            plan = []
+            j = len(ranges)
+            while j > 0:
+                i = choice[j]
+                start = ranges[i-1][0]
+                end = max(r[1] for r in ranges[i-1:j])
+                plan.append(ReadRequest(function_code, start, end - start))
+                j = i - 1
+            requests.extend(reversed(plan))
+        return requests
+
+    def get_read_commands(self, device_id: int, variables: Iterable[Union[str, Variable]], request_cost: int = 40) -> List[Tuple[int, bytes]]:
+        return [
+            (request.start_address, self.get_read_command(device_id, request.start_address, request.count))
+            for request in self.plan_reads(variables, request_cost)
+        ]
+
     def get_write_command(self, device_id: int, results: list[Result]) -> Tuple[int, bytes]:
         if not results:
             raise Exception(f"values list is empty")
@@ -179,54 +272,87 @@ class LumiaxClient:
         result = header + bytes(data)
         return start_address, result + crc16(result)
 
-    def is_complete(self, buffer: bytes) -> bool:
+    def frame_length(self, buffer: bytes) -> Optional[int]:
         if len(buffer) < 4:
-            return False
+            return None
         device_id = buffer[0]
+        if buffer[1] & 0x80 and buffer[1] & 0x7F in FunctionCodes._value2member_map_:
+            return 5  # Exception response
         if not buffer[1] in FunctionCodes._value2member_map_:
-            return False
+            return None
         function_code = FunctionCodes(buffer[1])
         if function_code in [FunctionCodes.READ_MEMORY, FunctionCodes.READ_PARAMETER, FunctionCodes.READ_STATUS_REGISTER]:
             data_length = buffer[2]
-            return len(buffer) >= data_length + 5
+            return data_length + 5
         else:
-            return len(buffer) >= 8
+            return 8
 
-    def parse(self, start_address: int, buffer: bytes) -> ResultContainer:
+    def get_range_write_command(self, device_id: int, start_address: int, registers: List[int]) -> bytes:
+        # Writes raw register values, without looking up the variables they belong to
+        count = len(registers)
+        if not 0 < count <= MAX_WRITE_COUNT:
+            raise Exception(f"can not write {count} registers at once")
+        result = bytes([
+            device_id,
+            FunctionCodes.WRITE_MEMORY_RANGE.value,
+            start_address >> 8,
+            start_address & 0xFF,
+            count >> 8,
+            count & 0xFF,
+            count * 2,
+        ]) + struct.pack(f">{count}H", *registers)
+        return result + crc16(result)
+
+    def response_prefix(self, command: bytes) -> bytes:
+        # What a response to the command starts with, after the device id
+        if command[1] in READ_FUNCTION_CODES:
+            count = (command[4] << 8) | command[5]
+            return bytes([command[1], count * 2])
+        return bytes(command[1:6])  # Writes echo the address and the value or register count
+
+    def is_complete(self, buffer: bytes) -> bool:
+        length = self.frame_length(buffer)
+        return length is not None and len(buffer) >= length
+
+    def parse(self, start_address: int, buffer: bytes, check_crc: bool = True) -> ResultContainer:
+        if buffer[1] & 0x80:
+            raise Exception(f"Device returned exception code {buffer[2]} for function code {hex(buffer[1] & 0x7F)}")
         function_code = FunctionCodes(buffer[1])
         results = []
         if function_code in [FunctionCodes.READ_MEMORY, FunctionCodes.READ_PARAMETER, FunctionCodes.READ_STATUS_REGISTER]:
             data_length = buffer[2]
             received_crc = buffer[3+data_length:3+data_length+2]
-            calculated_crc = crc16(buffer[:3+data_length])
+            calculated_crc = crc16(buffer[:3+data_length]) if check_crc else received_crc
             if received_crc != calculated_crc:
                 raise Exception(f"CRC mismatch (0x{calculated_crc.hex()} != 0x{received_crc.hex()})")
 
-            address = start_address
-            cursor = 3
-            while cursor < data_length + 3:
-                items = [v for v in variables if address == v.address and function_code.value in v.function_codes]
-                for variable in items:
-                    value = self.bytes_to_value(variable, buffer, cursor)
-                    results.append(Result(**vars(variable), value=value))
-                cursor += 2
-                address += 1
+            layout = register_map.layout(function_code.value, start_address, (data_length + 1) // 2)
+            for offset, variable in layout:
+                value = self.bytes_to_value(variable, buffer, offset + 3)
+                results.append(Result(variable, value))
         else:
             address = struct.unpack_from('>H', buffer, 2)[0]
             if address != start_address:
                 raise Exception(f"Write result address mismatch ({hex(address)} != {hex(start_address)})")
             received_crc = buffer[6:8]
-            calculated_crc = crc16(buffer[:6])
+            calculated_crc = crc16(buffer[:6]) if check_crc else received_crc
             if received_crc != calculated_crc:
                 raise Exception(f"CRC mismatch (0x{calculated_crc.hex()} != 0x{received_crc.hex()})")
             
             if function_code in [FunctionCodes.WRITE_MEMORY_SINGLE, FunctionCodes.WRITE_STATUS_REGISTER]:
-                variable = [v for v in variables if address == v.address and function_code.value in v.function_codes][0]
+                variable = register_map.lookup(function_code.value, address)[0]
                 value = self.bytes_to_value(variable, buffer, 4)
-                results.append(Result(**vars(variable), value=value))
+                results.append(Result(variable, value))
         self.device_id = buffer[0]
         return ResultContainer(results)
 
+    def _find_raw_value(self, variable: Variable, value: str):
+        if variable.is_32_bit:
+            return self._find_raw_value_by_brute_force(variable, value)
+        if variable.multiplier:
+            value = float(value) * variable.multiplier
+        return register_map.reverse_lookup(variable).get(value)
+
     def _find_raw_value_by_brute_force(self, variable: Variable, value: str):
         if variable.multiplier:
             value = float(value) * variable.multiplier
@@ -0,0 +1,64 @@
+import json
+from typing import Dict, List, Optional
+
+from aiomqtt import MqttError
+
+from src.homeassistant import MqttDevice
+from src.protocol import ResultContainer
+from src.scheduler import ReadGroup
+from src.spool import Spool, entry_results
+
+class Publisher:
+    """Hands readings to the MQTT devices of the current broker connection.
+
+    While there is no connection (or older readings are still waiting) readings
+    go to the spool instead. After reconnecting, the spooled readings are sent
+    in bulk with their timestamps to each device's history topic before live
+    publishing resumes.
+    """
+
+    def __init__(self, spool: Spool, groups: Optional[List[ReadGroup]] = None):
+        self.spool = spool
+        self.groups = groups or []  # To publish the latest spooled readings like a poll would
+        self.devices: Dict[str, MqttDevice] = {}
+        self.online = False
+        self.replayed = 0
+
+    async def publish(self, address: str, results: ResultContainer, groups: Optional[List[ReadGroup]] = None) -> bool:
+        device = self.devices.get(address)
+        if self.online and device and not self.spool:
+            try:
+                await device.publish_groups(results, groups or [])
+                return True
+            except MqttError:
+                self.online = False  # The broker connection is reconnected elsewhere
+        await self.spool.put(address, results)
+        return False
+
+    async def attach(self, devices: Dict[str, MqttDevice]) -> None:
+        self.devices = devices
+        latest = {}
+
+        async def send(entries: List[dict]):
+            records = {}
+            for entry in entries:
+                records.setdefault(entry["device"], []).append({"time": entry["time"], "values": entry["values"]})
+            for address, device_records in records.items():
+                device = self.devices.get(address)
+                if device is None:
+                    continue  # Not polled anymore
+                await device.client.publish_message(device.get_history_topic(), payload=json.dumps(device_records), qos=1)
+                latest[address] = device_records[-1]
+
+        replayed = await self.spool.replay(send)
+        if replayed:
+            print(f"Replayed {replayed} spooled readings")
+            self.replayed += replayed
+        # Bring the current state up to date before going live
+        for address, record in latest.items():
+            await self.devices[address].publish_groups(entry_results(record), self.groups)
+        self.online = True
+
+    def detach(self) -> None:
+        self.online = False
+        self.devices = {}
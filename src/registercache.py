@@ -0,0 +1,89 @@
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .variables import FunctionCodes
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+@dataclass(frozen=True)
+class CacheTtl:
+    name: str
+    function_code: int  # The function code the registers are read with
+    start_address: int
+    end_address: int    # Inclusive
+    ttl: float          # In seconds, 0 never serves reads from the cache
+
+default_ttls = [
+    CacheTtl("rated_parameters", FunctionCodes.READ_MEMORY.value, 0x3000, 0x300B, DAY),
+    CacheTtl("real_time_clock", FunctionCodes.READ_PARAMETER.value, 0x9017, 0x901C, 0),
+    CacheTtl("device_parameters", FunctionCodes.READ_PARAMETER.value, 0x8FF4, 0x9020, DAY),
+    CacheTtl("battery_and_load_parameters", FunctionCodes.READ_PARAMETER.value, 0x9021, 0x906A, HOUR),
+]
+
+# Switches that change registers behind our back, with the function code of
+# the registers they affect (None for all)
+invalidating_switches = {
+    "restore_system_default_values": None,
+    "clear_device_statistics": FunctionCodes.READ_MEMORY.value,
+    "clear_counters": FunctionCodes.READ_MEMORY.value,
+    "clear_charge_discharge_ah": FunctionCodes.READ_MEMORY.value,
+    "clear_all": FunctionCodes.READ_MEMORY.value,
+}
+
+# Registers written with these function codes are read back with READ_PARAMETER
+WRITTEN_FUNCTION_CODES = {
+    FunctionCodes.WRITE_MEMORY_SINGLE.value: FunctionCodes.READ_PARAMETER.value,
+    FunctionCodes.WRITE_MEMORY_RANGE.value: FunctionCodes.READ_PARAMETER.value,
+}
+
+class RegisterCache:
+    """Raw register values per device, from reads and confirmed writes.
+
+    Reads are served from the cache while every register of the range is
+    younger than the TTL of its group.
+    """
+
+    def __init__(self, ttls: List[CacheTtl] = default_ttls, clock: Callable[[], float] = time.monotonic):
+        self.ttls = ttls
+        self.clock = clock
+        self.devices: Dict[str, Dict[Tuple[int, int], Tuple[int, float]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self, function_code: int, address: int) -> float:
+        for ttl in self.ttls:
+            if ttl.function_code == function_code and ttl.start_address <= address <= ttl.end_address:
+                return ttl.ttl
+        return 0
+
+    def store(self, device: str, function_code: int, start_address: int, data: bytes) -> None:
+        registers = self.devices.setdefault(device, {})
+        now = self.clock()
+        for i, (value,) in enumerate(struct.iter_unpack(">H", data)):
+            registers[(function_code, start_address + i)] = (value, now)
+
+    def get(self, device: str, function_code: int, start_address: int, count: int) -> Optional[bytes]:
+        registers = self.devices.get(device, {})
+        now = self.clock()
+        values = []
+        for address in range(start_address, start_address + count):
+            entry = registers.get((function_code, address))
+            if entry is None or now - entry[1] >= self.ttl(function_code, address):
+                self.misses += 1
+                return None
+            values.append(entry[0])
+        self.hits += 1
+        return struct.pack(f">{count}H", *values)
+
+    def invalidate(self, device: Optional[str] = None, function_code: Optional[int] = None) -> None:
+        for name in [device] if device is not None else list(self.devices):
+            registers = self.devices.get(name, {})
+            if function_code is None:
+                registers.clear()
+            else:
+                for key in [key for key in registers if key[0] == function_code]:
+                    del registers[key]
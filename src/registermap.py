@@ -0,0 +1,92 @@
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .variables import variables, Variable, VariableContainer
+
+type Layout = Tuple[Tuple[int, Variable], ...]
+
+class RegisterMap:
+    def __init__(self, variables: VariableContainer):
+        self.variables = variables
+        self._layouts: Dict[Tuple[int, int, int], Layout] = {}
+        self._reverse_lookups: Dict[Tuple[Any, bool, bool], Dict[Any, int]] = {}
+        self._build()
+
+    def _build(self) -> None:
+        index = defaultdict(list)
+        by_address = defaultdict(list)
+        by_name = defaultdict(list)
+        for variable in self.variables:
+            by_address[variable.address].append(variable)
+            by_name[variable.name].append(variable)
+            for function_code in variable.function_codes:
+                index[(function_code, variable.address)].append(variable)
+        self._index: Dict[Tuple[int, int], Tuple[Variable, ...]] = {key: tuple(items) for key, items in index.items()}
+        self._by_address: Dict[int, Tuple[Variable, ...]] = {key: tuple(items) for key, items in by_address.items()}
+        self._by_name: Dict[str, Tuple[Variable, ...]] = {key: tuple(items) for key, items in by_name.items()}
+
+    def lookup(self, function_code: int, address: int) -> Tuple[Variable, ...]:
+        return self._index.get((function_code, address), ())
+
+    def by_name(self, name: str) -> Tuple[Variable, ...]:
+        # Some values are mirrored at several addresses, in table order
+        return self._by_name.get(name, ())
+
+    def variable(self, name: str) -> Optional[Variable]:
+        # What a name stands for everywhere, the last of several like in VariableContainer
+        matches = self._by_name.get(name)
+        return matches[-1] if matches else None
+
+    def in_range(self, start_address: int, count: int) -> List[Variable]:
+        items = []
+        for address in range(start_address, start_address + count):
+            items.extend(self._by_address.get(address, ()))
+        return items
+
+    def layout(self, function_code: int, start_address: int, count: int) -> Layout:
+        # (byte offset into the register block, variable) pairs for a read response
+        key = (function_code, start_address, count)
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = tuple(
+                (i * 2, variable)
+                for i in range(count)
+                for variable in self.lookup(function_code, start_address + i)
+            )
+            self._layouts[key] = layout
+        return layout
+
+    def reverse_lookup(self, variable: Variable) -> Dict[Any, int]:
+        # Maps every output of variable.func back to the first raw value producing it,
+        # probing candidates in the same order as a brute force search would.
+        # Keyed on the function itself, so a variable with a replaced function gets a fresh table.
+        key = (variable.func, variable.is_32_bit, variable.is_signed)
+        lookup = self._reverse_lookups.get(key)
+        if lookup is None:
+            n_bits = 32 if variable.is_32_bit else 16
+            if variable.is_signed:
+                candidates = list(range(0, 2**(n_bits-1) + 1)) + list(range(0, -2**(n_bits-1) - 2, -1))
+            else:
+                candidates = range(0, 2**n_bits + 1)
+            lookup = {}
+            func = variable.func
+            for i in candidates:
+                try:
+                    lookup.setdefault(func(i), i)
+                except IndexError:
+                    pass
+            self._reverse_lookups[key] = lookup
+        return lookup
+
+    def prepare(self, variables: VariableContainer) -> None:
+        for variable in variables:
+            if variable.func and not variable.is_32_bit:
+                self.reverse_lookup(variable)
+
+    def clear_caches(self) -> None:
+        # Call after changing the variable table
+        self._build()
+        self._layouts.clear()
+        self._reverse_lookups.clear()
+
+register_map = RegisterMap(variables)
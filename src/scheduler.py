@@ -0,0 +1,61 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from .variables import VariableContainer
+from .protocol import LumiaxClient, ReadRequest
+
+@dataclass
+class ReadGroup:
+    name: str
+    variables: VariableContainer
+    interval: float  # In seconds
+    priority: int = 0
+
+class PollScheduler:
+    """Decides which read groups are due and how to fetch them.
+
+    If a poll takes more than `busy_ratio` of the shortest interval involved,
+    intervals are stretched (up to `max_slowdown` times) until the link keeps
+    up again. The lowest priority groups give way first, higher priorities
+    are only stretched once all lower ones are at `max_slowdown`, and they
+    are the first to get their interval back.
+    """
+
+    def __init__(self, groups: List[ReadGroup], busy_ratio: float = 0.5, max_slowdown: float = 8,
+                 request_cost: int = 40, clock: Callable[[], float] = time.monotonic):
+        self.groups = sorted(groups, key=lambda g: -g.priority)
+        self.protocol = LumiaxClient()
+        self.request_cost = request_cost
+        self.busy_ratio = busy_ratio
+        self.max_slowdown = max_slowdown
+        self.clock = clock
+        self.slowdown: Dict[int, float] = {group.priority: 1.0 for group in groups}
+        self.next_due: Dict[str, float] = {group.name: 0.0 for group in groups}
+
+    def due(self, now: Optional[float] = None) -> List[ReadGroup]:
+        now = self.clock() if now is None else now
+        return [group for group in self.groups if self.next_due[group.name] <= now]
+
+    def next_wakeup(self, now: Optional[float] = None) -> float:
+        now = self.clock() if now is None else now
+        return max(0.0, min(self.next_due.values()) - now)
+
+    def plan(self, groups: List[ReadGroup]) -> List[ReadRequest]:
+        return self.protocol.plan_reads([v for group in groups for v in group.variables], self.request_cost)
+
+    def complete(self, groups: List[ReadGroup], duration: float, now: Optional[float] = None) -> None:
+        now = self.clock() if now is None else now
+        if groups:
+            if duration > self.busy_ratio * min(group.interval for group in groups):
+                for priority in sorted(self.slowdown):
+                    if self.slowdown[priority] < self.max_slowdown:
+                        self.slowdown[priority] = min(self.slowdown[priority] * 2, self.max_slowdown)
+                        break
+            else:
+                for priority in sorted(self.slowdown, reverse=True):
+                    if self.slowdown[priority] > 1.0:
+                        self.slowdown[priority] = max(1.0, self.slowdown[priority] * 0.75)
+                        break
+        for group in groups:
+            self.next_due[group.name] = now + group.interval * self.slowdown[group.priority]
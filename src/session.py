@@ -0,0 +1,171 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+from typing import Callable, Dict, Optional
+
+from bleak.exc import BleakError
+
+from src.bleclient import BleClient
+
+class SessionState(Enum):
+    DISCONNECTED = "disconnected"
+    CONNECTING   = "connecting"
+    CONNECTED    = "connected"
+    BACKOFF      = "backoff"
+
+class BleSession:
+    """Keeps a single BleClient connected across many transactions.
+
+    The link is (re)established lazily when a transaction starts. Failed
+    connection attempts are retried with an exponential backoff between
+    `min_backoff` and `max_backoff` seconds.
+
+    Sessions sharing a `limiter` only stay connected for the duration of a
+    transaction, so no more links are open than the adapter can handle.
+    """
+
+    def __init__(self, address: str, min_backoff: float = 1, max_backoff: float = 60,
+                 client_factory: Callable[..., BleClient] = BleClient,
+                 limiter: Optional[asyncio.Semaphore] = None):
+        self.address = address
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.client_factory = client_factory
+        self.limiter = limiter
+        self.client: Optional[BleClient] = None
+        self.state = SessionState.DISCONNECTED
+        self.lock = asyncio.Lock()
+
+        self.backoff = 0
+        self.next_attempt = 0.0
+
+        self.connects = 0
+        self.connect_failures = 0
+        self.link_losses = 0
+        self.requests = 0
+        self.connect_latency: Optional[float] = None
+        self.request_latency: Optional[float] = None
+        self.total_connect_time = 0.0
+        self.total_request_time = 0.0
+        self.client_counters: Dict[str, int] = {}  # Of clients that were closed already
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.client is not None and self.client.is_connected
+
+    def health(self) -> dict:
+        return {
+            "address": self.address,
+            "state": self.state.value,
+            "connects": self.connects,
+            "connect_failures": self.connect_failures,
+            "link_losses": self.link_losses,
+            "requests": self.requests,
+            "backoff": self.backoff,
+            "connect_latency": self.connect_latency,
+            "request_latency": self.request_latency,
+            "mean_connect_latency": self.total_connect_time / self.connects if self.connects else None,
+            "mean_request_latency": self.total_request_time / self.requests if self.requests else None,
+        }
+
+    def counters(self) -> Dict[str, int]:
+        # Protocol level counters summed over all clients of this session
+        counters = dict(self.client_counters)
+        if self.client is not None and hasattr(self.client, "counters"):
+            for key, value in self.client.counters().items():
+                counters[key] = counters.get(key, 0) + value
+        return counters
+
+    def _on_disconnect(self, _):
+        if self.state == SessionState.CONNECTED:
+            self.state = SessionState.DISCONNECTED
+            self.link_losses += 1
+
+    async def connect(self) -> BleClient:
+        if self.state == SessionState.CONNECTED and self.is_connected:
+            return self.client
+        await self._drop()
+        await self._wait_for_backoff()
+
+        self.state = SessionState.CONNECTING
+        client = self.client_factory(self.address, disconnected_callback=self._on_disconnect)
+        start = time.monotonic()
+        try:
+            await client.__aenter__()
+        except Exception:
+            self.connect_failures += 1
+            self.backoff = min(max(self.backoff * 2, self.min_backoff), self.max_backoff)
+            self.next_attempt = time.monotonic() + self.backoff
+            self.state = SessionState.BACKOFF
+            await self._close_client(client)
+            raise
+        except asyncio.CancelledError:
+            self.state = SessionState.DISCONNECTED
+            await self._close_client(client)
+            raise
+
+        self.connect_latency = time.monotonic() - start
+        self.total_connect_time += self.connect_latency
+        self.connects += 1
+        self.backoff = 0
+        self.client = client
+        self.state = SessionState.CONNECTED
+        print(f"Connected to {self.address} in {self.connect_latency:.2f}s")
+        return client
+
+    async def _wait_for_backoff(self):
+        delay = self.next_attempt - time.monotonic()
+        if delay > 0:
+            self.state = SessionState.BACKOFF
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def transaction(self):
+        async with self.lock:
+            if self.limiter:
+                # Don't hold a connection slot while waiting for the backoff to expire
+                await self._wait_for_backoff()
+                await self.limiter.acquire()
+            try:
+                client = await self.connect()
+                start = time.monotonic()
+                try:
+                    yield client
+                except (BleakError, asyncio.TimeoutError, EOFError):
+                    await self._drop()
+                    raise
+                finally:
+                    self.request_latency = time.monotonic() - start
+                    self.total_request_time += self.request_latency
+                    self.requests += 1
+            finally:
+                if self.limiter:
+                    await self._drop()
+                    self.limiter.release()
+
+    async def close(self):
+        async with self.lock:
+            await self._drop()
+
+    async def _drop(self):
+        client, self.client = self.client, None
+        if self.state != SessionState.BACKOFF:
+            self.state = SessionState.DISCONNECTED
+        if client is not None:
+            await self._close_client(client)
+
+    async def _close_client(self, client: BleClient):
+        if hasattr(client, "counters"):
+            for key, value in client.counters().items():
+                self.client_counters[key] = self.client_counters.get(key, 0) + value
+        try:
+            await client.__aexit__(None, None, None)
+        except (BleakError, asyncio.TimeoutError, EOFError):
+            pass
@@ -0,0 +1,208 @@
+import asyncio
+import math
+import random
+import struct
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from bleak.exc import BleakError
+
+from .bleclient import BleClient
+from .crc import crc16
+from .registermap import register_map
+from .variables import FunctionCodes, Variable, variables
+
+# Typical values per unit, everything else starts at zero
+base_values = {
+    "V": 13.2,
+    "A": 2.5,
+    "W": 33.0,
+    "℃": 25.0,
+    "%": 80,
+    "kWh": 12.5,
+    "min": 600,
+}
+
+class SimulatedDevice:
+    """Register state of a Lumiax controller answering Modbus requests.
+
+    Input registers (function code 0x04) drift slowly around typical values,
+    energy counters keep increasing and writes change holding registers.
+    """
+
+    def __init__(self, address: str, seed: Optional[int] = None, clock: Callable[[], float] = time.monotonic):
+        self.address = address
+        self.rng = random.Random(seed if seed is not None else address)
+        self.clock = clock
+        self.start = clock()
+        self.registers: Dict[int, int] = {}
+        self.evolving: List[Variable] = []
+        for variable in variables:
+            if variable.address in self.registers:
+                continue  # Bit fields sharing a register
+            if variable.multiplier and not variable.func and variable.unit in base_values:
+                value = base_values[variable.unit] * (1.5 if variable.name.startswith("solar_panel_voltage") else 1)
+                self.set_value(variable, value)
+                if FunctionCodes.READ_MEMORY.value in variable.function_codes:
+                    self.evolving.append(variable)
+            else:
+                self.set_raw(variable, self._first_valid_raw(variable))
+        self.requests = 0
+
+    def _first_valid_raw(self, variable: Variable) -> int:
+        if not variable.func:
+            return 0
+        for raw in range(0x10000):
+            try:
+                variable.func(raw)
+                return raw
+            except (IndexError, KeyError, ValueError):
+                pass
+        return 0
+
+    def set_raw(self, variable: Variable, raw: int) -> None:
+        raw &= 0xFFFFFFFF if variable.is_32_bit else 0xFFFF
+        self.registers[variable.address] = raw & 0xFFFF
+        if variable.is_32_bit:
+            self.registers[variable.address + 1] = raw >> 16
+
+    def set_value(self, variable: Variable, value: float) -> None:
+        self.set_raw(variable, round(value * variable.multiplier))
+
+    def evolve(self) -> None:
+        elapsed = self.clock() - self.start
+        for variable in self.evolving:
+            base = base_values[variable.unit]
+            if variable.unit == "kWh":
+                value = base + elapsed / 3600
+            else:
+                value = base * (1 + 0.05 * math.sin(elapsed * 2 * math.pi / 600 + variable.address)) + self.rng.gauss(0, base * 0.005)
+            if variable.unit == "%":
+                value = min(100, max(0, value))
+            if not variable.is_signed:
+                value = max(0, value)
+            self.set_value(variable, value)
+
+    def handle(self, request: bytes) -> Optional[bytes]:
+        # Returns the response frame, or None for requests a device would ignore
+        if len(request) < 8 or crc16(request[:-2]) != request[-2:]:
+            return None
+        self.requests += 1
+        device_id, function_code = request[0], request[1]
+        address, count = struct.unpack_from(">HH", request, 2)
+        if function_code in [FunctionCodes.READ_STATUS_REGISTER.value, FunctionCodes.READ_PARAMETER.value, FunctionCodes.READ_MEMORY.value]:
+            if not 0 < count <= 127 or not register_map.in_range(address, count):
+                return self._exception(device_id, function_code, 2)
+            self.evolve()
+            data = b"".join(struct.pack(">H", self.registers.get(a, 0)) for a in range(address, address + count))
+            response = bytes([device_id, function_code, len(data)]) + data
+        elif function_code in [FunctionCodes.WRITE_STATUS_REGISTER.value, FunctionCodes.WRITE_MEMORY_SINGLE.value]:
+            if not register_map.lookup(function_code, address):
+                return self._exception(device_id, function_code, 2)
+            self.registers[address] = count  # The value of single writes
+            response = request[:6]
+        elif function_code == FunctionCodes.WRITE_MEMORY_RANGE.value:
+            if len(request) != 9 + 2 * count or request[6] != 2 * count:
+                return self._exception(device_id, function_code, 3)
+            for i in range(count):
+                self.registers[address + i] = struct.unpack_from(">H", request, 7 + 2 * i)[0]
+            response = request[:6]
+        else:
+            return self._exception(device_id, function_code, 1)
+        return response + crc16(response)
+
+    def _exception(self, device_id: int, function_code: int, code: int) -> bytes:
+        response = bytes([device_id, function_code | 0x80, code])
+        return response + crc16(response)
+
+class _Characteristic(NamedTuple):
+    uuid: str
+
+class SimulatedBleakClient:
+    """Stands in for BleakClient, answering writes with notifications from a SimulatedDevice.
+
+    Responses are split into `mtu` sized notifications after `latency` seconds.
+    With the given probabilities a response is lost, gets a corrupted byte, or
+    the link drops.
+    """
+
+    def __init__(self, device: SimulatedDevice, disconnected_callback: Optional[Callable] = None,
+                 mtu: int = 20, latency: float = 0.05, connect_time: float = 0.5,
+                 loss: float = 0.0, corruption: float = 0.0, link_loss: float = 0.0):
+        self.device = device
+        self.address = device.address
+        self.disconnected_callback = disconnected_callback
+        self.mtu = mtu
+        self.latency = latency
+        self.connect_time = connect_time
+        self.loss = loss
+        self.corruption = corruption
+        self.link_loss = link_loss
+        self.rng = device.rng
+        self.callback = None
+        self.services = []
+        self._connected = False
+        self.tasks = set()
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self, **kwargs) -> bool:
+        await asyncio.sleep(self.connect_time)
+        self._connected = True
+        return True
+
+    async def disconnect(self) -> bool:
+        self._connected = False
+        for task in self.tasks:
+            task.cancel()
+        return True
+
+    async def start_notify(self, uuid: str, callback: Callable, **kwargs) -> None:
+        self.callback = callback
+
+    async def stop_notify(self, uuid: str) -> None:
+        self.callback = None
+
+    async def read_gatt_char(self, uuid: str, **kwargs) -> bytearray:
+        return bytearray(f"Simulated {self.address}".encode())
+
+    async def write_gatt_char(self, uuid: str, data: bytes, response: bool = None) -> None:
+        if not self._connected:
+            raise BleakError("Not connected")
+        if self.rng.random() < self.link_loss:
+            self._connected = False
+            if self.disconnected_callback:
+                self.disconnected_callback(self)
+            raise BleakError("Link lost")
+        frame = self.device.handle(bytes(data))
+        if frame is None or self.rng.random() < self.loss:
+            return
+        if self.rng.random() < self.corruption:
+            frame = bytearray(frame)
+            frame[self.rng.randrange(len(frame))] ^= 1 << self.rng.randrange(8)
+        task = asyncio.get_running_loop().create_task(self._notify(bytes(frame)))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _notify(self, frame: bytes) -> None:
+        await asyncio.sleep(self.latency)
+        for i in range(0, len(frame), self.mtu):
+            if not self._connected or self.callback is None:
+                return
+            self.callback(_Characteristic(BleClient.NOTIFY_UUID), bytearray(frame[i:i + self.mtu]))
+            await asyncio.sleep(0)
+
+class Simulator:
+    """Creates simulated BLE clients, keeping one device state per address."""
+
+    def __init__(self, **options):
+        self.options = options
+        self.devices: Dict[str, SimulatedDevice] = {}
+
+    def client(self, address: str, disconnected_callback: Optional[Callable] = None) -> SimulatedBleakClient:
+        device = self.devices.get(address)
+        if device is None:
+            device = self.devices[address] = SimulatedDevice(address)
+        return SimulatedBleakClient(device, disconnected_callback, **self.options)
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .bleclient import BleClient
+from .protocol import MAX_READ_COUNT, MAX_WRITE_COUNT, Value
+from .session import BleSession
+from .variables import VariableContainer, battery_and_load_parameters
+
+@dataclass
+class Snapshot:
+    device: str
+    time: float
+    registers: Dict[int, int]  # Address -> raw register value
+    values: Dict[str, Value] = field(default_factory=dict)  # Decoded, only for people reading the file
+
+    def to_json(self) -> dict:
+        return {
+            "time": self.time,
+            "registers": {f"0x{address:04X}": value for address, value in sorted(self.registers.items())},
+            "values": self.values,
+        }
+
+    @staticmethod
+    def from_json(device: str, data: dict) -> "Snapshot":
+        registers = {int(address, 16): value for address, value in data["registers"].items()}
+        return Snapshot(device, data["time"], registers, data.get("values", {}))
+
+class RestoreResult(NamedTuple):
+    changes: Dict[int, int]  # Address -> value that was written
+    frames: int
+    mismatches: Dict[int, Tuple[int, Optional[int]]]  # Address -> (expected, read back)
+
+def save_snapshots(path: str, snapshots: List[Snapshot]) -> None:
+    with open(path, "w") as file:
+        json.dump({"devices": {snapshot.device: snapshot.to_json() for snapshot in snapshots}}, file, indent=2)
+
+def load_snapshots(path: str) -> Dict[str, Snapshot]:
+    with open(path) as file:
+        devices = json.load(file)["devices"]
+    return {device: Snapshot.from_json(device, data) for device, data in devices.items()}
+
+def target_for(snapshots: Dict[str, Snapshot], address: str) -> Optional[Snapshot]:
+    # A file with a single snapshot serves as template for every device
+    if address in snapshots:
+        return snapshots[address]
+    if len(snapshots) == 1:
+        return next(iter(snapshots.values()))
+    return None
+
+async def take_snapshot(client: BleClient, parameters: VariableContainer = battery_and_load_parameters) -> Snapshot:
+    addresses = set()
+    for variable in parameters:
+        addresses.update(range(variable.address, variable.address + (2 if variable.is_32_bit else 1)))
+    registers = {}
+    values = {}
+    # Registers are cheap compared to requests, so read as few ranges as possible
+    for request in client.plan_reads(parameters, request_cost=MAX_READ_COUNT):
+        data = await client.read_registers(request.start_address, request.count)
+        if data is None:
+            raise Exception(f"{client.address}: no response reading {hex(request.start_address)}")
+        for i, (value,) in enumerate(struct.iter_unpack(">H", data)):
+            if request.start_address + i in addresses:
+                registers[request.start_address + i] = value
+        for variable in parameters:
+            offset = (variable.address - request.start_address) * 2
+            if 0 <= offset < len(data):
+                try:
+                    values[variable.name] = client.bytes_to_value(variable, data, offset)
+                except Exception:
+                    pass  # Raw values outside of the documented range are restored all the same
+    return Snapshot(client.address, time.time(), registers, values)
+
+def diff(target: Snapshot, live: Snapshot) -> Dict[int, int]:
+    # Registers of the live device that differ from the target, with their target value
+    return {address: value for address, value in sorted(target.registers.items())
+            if address in live.registers and live.registers[address] != value}
+
+def plan_writes(changes: Dict[int, int], live: Dict[int, int], max_gap: int = 4) -> List[Tuple[int, List[int]]]:
+    # Groups changed registers into range writes. Short gaps of known registers are
+    # bridged by writing their current value again, which is cheaper than another frame.
+    runs: List[Tuple[int, List[int]]] = []
+    for address in sorted(changes):
+        if runs:
+            start, values = runs[-1]
+            gap = range(start + len(values), address)
+            if len(gap) <= max_gap and all(a in live for a in gap) and address - start < MAX_WRITE_COUNT:
+                values.extend(live[a] for a in gap)
+                values.append(changes[address])
+                continue
+        runs.append((address, [changes[address]]))
+    return runs
+
+async def restore(client: BleClient, target: Snapshot, parameters: VariableContainer = battery_and_load_parameters,
+                  dry_run: bool = False) -> RestoreResult:
+    live = await take_snapshot(client, parameters)
+    changes = diff(target, live)
+    runs = plan_writes(changes, live.registers)
+    if dry_run or not runs:
+        return RestoreResult(changes, len(runs), {})
+    for start, values in runs:
+        if not await client.write_registers(start, values):
+            raise Exception(f"{client.address}: no response writing {hex(start)}")
+    # Read everything back, the controller may reject values silently
+    written = await take_snapshot(client, parameters)
+    mismatches = {address: (value, written.registers.get(address)) for address, value in changes.items()
+                  if written.registers.get(address) != value}
+    return RestoreResult(changes, len(runs), mismatches)
+
+async def snapshot_fleet(sessions: List[BleSession], parameters: VariableContainer = battery_and_load_parameters) -> list:
+    # Returns a snapshot or the exception per session
+    async def snapshot(session: BleSession) -> Snapshot:
+        async with session.transaction() as client:
+            return await take_snapshot(client, parameters)
+    return await asyncio.gather(*[snapshot(session) for session in sessions], return_exceptions=True)
+
+async def restore_fleet(sessions: List[BleSession], snapshots: Dict[str, Snapshot],
+                        parameters: VariableContainer = battery_and_load_parameters, dry_run: bool = False) -> list:
+    # Returns a RestoreResult, None without a snapshot for the device, or the exception per session
+    async def restore_one(session: BleSession) -> Optional[RestoreResult]:
+        target = target_for(snapshots, session.address)
+        if target is None:
+            return None
+        async with session.transaction() as client:
+            return await restore(client, target, parameters, dry_run)
+    return await asyncio.gather(*[restore_one(session) for session in sessions], return_exceptions=True)
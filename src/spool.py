@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from .protocol import Result, ResultContainer
+from .registermap import register_map
+
+OVERFLOW_POLICIES = ["drop_oldest", "drop_newest", "block"]
+
+class _Segment:
+    def __init__(self, number: int, path: Optional[str] = None):
+        self.number = number
+        self.path = path
+        self.lines: List[bytes] = []  # Only used without a path
+        self.count = 0
+        self.size = 0
+
+    def append(self, line: bytes) -> None:
+        if self.path:
+            with open(self.path, "ab") as file:
+                file.write(line)
+        else:
+            self.lines.append(line)
+        self.count += 1
+        self.size += len(line)
+
+    def read(self) -> List[dict]:
+        if self.path:
+            with open(self.path, "rb") as file:
+                lines = file.readlines()
+        else:
+            lines = self.lines
+        # A crash can leave a partial line at the end
+        return [json.loads(line) for line in lines if line.endswith(b"\n")]
+
+    def remove(self) -> None:
+        if self.path:
+            os.remove(self.path)
+
+class Spool:
+    """Bounded FIFO of readings that could not be published yet.
+
+    Entries are appended as JSON lines to segment files in `path` (or kept in
+    memory without one) and consumed segment by segment. Once `max_bytes` are
+    spooled, `overflow` decides whether the oldest segment is dropped, the new
+    entry is dropped or `put` waits until a replay made room.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: int = 10 * 2**20, segment_bytes: int = 64 * 2**10,
+                 overflow: str = "drop_oldest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise Exception(f"Unknown overflow policy '{overflow}'")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max_bytes)
+        self.overflow = overflow
+        self.segments: List[_Segment] = []
+        self.current: Optional[_Segment] = None
+        self.space = asyncio.Condition()
+        self.size = 0
+        self.count = 0
+        self.dropped = 0
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def __len__(self):
+        return self.count
+
+    def _load(self) -> None:
+        for file in sorted(os.listdir(self.path)):
+            match = re.match(r"^spool-(\d+)\.jsonl$", file)
+            if not match:
+                continue
+            segment = _Segment(int(match.group(1)), os.path.join(self.path, file))
+            segment.count = len(segment.read())
+            segment.size = os.path.getsize(segment.path)
+            self.segments.append(segment)
+            self.size += segment.size
+            self.count += segment.count
+        self.segments.sort(key=lambda segment: segment.number)
+
+    def _new_segment(self) -> _Segment:
+        number = self.segments[-1].number + 1 if self.segments else 0
+        path = os.path.join(self.path, f"spool-{number:08d}.jsonl") if self.path else None
+        segment = _Segment(number, path)
+        self.segments.append(segment)
+        return segment
+
+    def _remove(self, segment: _Segment) -> None:
+        if segment not in self.segments:
+            return
+        self.segments.remove(segment)
+        if segment is self.current:
+            self.current = None
+        segment.remove()
+        self.size -= segment.size
+        self.count -= segment.count
+
+    async def put(self, device: str, results: ResultContainer, timestamp: Optional[float] = None) -> bool:
+        entry = {
+            "time": time.time() if timestamp is None else timestamp,
+            "device": device,
+            "values": {key: result.value for key, result in results.items()},
+        }
+        line = (json.dumps(entry) + "\n").encode()
+        if self.size + len(line) > self.max_bytes:
+            if self.overflow == "drop_newest":
+                self.dropped += 1
+                return False
+            elif self.overflow == "block":
+                async with self.space:
+                    await self.space.wait_for(lambda: self.size + len(line) <= self.max_bytes)
+            else:
+                while self.segments and self.size + len(line) > self.max_bytes:
+                    self.dropped += self.segments[0].count
+                    self._remove(self.segments[0])
+
+        if self.current is None or self.current.size + len(line) > self.segment_bytes:
+            self.current = self._new_segment()
+        self.current.append(line)
+        self.size += len(line)
+        self.count += 1
+        return True
+
+    async def replay(self, handler: Callable[[List[dict]], Awaitable[None]]) -> int:
+        # Hands over one segment at a time and only removes it once the handler succeeded
+        replayed = 0
+        while self.segments:
+            segment = self.segments[0]
+            if segment is self.current:
+                self.current = None  # Don't append to a segment that is being replayed
+            entries = segment.read()
+            if entries:
+                await handler(entries)
+            replayed += len(entries)
+            self._remove(segment)
+            async with self.space:
+                self.space.notify_all()
+        return replayed
+
+def entry_results(entry: dict) -> ResultContainer:
+    return ResultContainer([Result(register_map.variable(name), value)
+                            for name, value in entry["values"].items() if register_map.variable(name)])
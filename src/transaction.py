@@ -0,0 +1,63 @@
+import asyncio
+from typing import Optional
+
+class RttEstimator:
+    """Derives request timeouts from the observed round trip times.
+
+    Uses the smoothed RTT and RTT variance of TCP (RFC 6298). Every timeout
+    doubles the next one until a fresh sample comes in.
+    """
+
+    def __init__(self, initial: float = 2, min_timeout: float = 0.5, max_timeout: float = 10):
+        self.initial = initial
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.backoff = 1
+
+    def sample(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.backoff = 1
+
+    def timed_out(self) -> None:
+        self.backoff = min(self.backoff * 2, 64)
+
+    def timeout(self) -> float:
+        if self.srtt is None:
+            timeout = self.initial
+        else:
+            timeout = self.srtt + 4 * self.rttvar
+        return min(max(timeout * self.backoff, self.min_timeout), self.max_timeout)
+
+class PendingRequest:
+    """A command waiting for its response.
+
+    Responses are matched by content, so that a late reply to an earlier
+    request is not taken for the answer to this one.
+    """
+    __slots__ = ("kind", "command", "start_address", "prefix", "repeat", "timeout", "raw", "response", "future", "attempts",
+                 "late_replies")
+
+    def __init__(self, kind: str, command: bytes, start_address: int, prefix: bytes, repeat: int = 10,
+                 timeout: Optional[float] = None, raw: bool = False):
+        self.kind = kind  # "read" or "write"
+        self.command = command
+        self.start_address = start_address
+        self.prefix = prefix  # Function code and length, or the echoed address and value
+        self.repeat = repeat
+        self.timeout = timeout  # Fixed timeout instead of an adaptive one
+        self.raw = raw  # Return the payload of the response instead of parsing it
+        loop = asyncio.get_running_loop()
+        self.response = loop.create_future()  # Set by the notification handler
+        self.future = loop.create_future()  # Set once the request is complete, awaited by the caller
+        self.attempts = 0
+        self.late_replies = 0  # Replies to an earlier command with the same prefix, dropped before sending
+
+    def matches(self, frame: bytes) -> bool:
+        return frame[1:1 + len(self.prefix)] == self.prefix
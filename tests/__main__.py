@@ -4,6 +4,26 @@ from .compatibility_test import TestCompat
 from .transaction_test import TestTransaction
 from .variable_test import TestVariables
 from .main_test import TestMain
+from .session_test import TestSession
+from .registermap_test import TestRegisterMap
+from .crc_test import TestCrc
+from .decoder_test import TestDecoder
+from .homeassistant_test import TestHomeAssistant
+from .scheduler_test import TestScheduler
+from .plan_test import TestReadPlan
+from .deadband_test import TestDeadband
+from .assembler_test import TestAssembler
+from .history_test import TestHistory
+from .spool_test import TestSpool, TestPublisher
+from .simulator_test import TestSimulator
+from .metrics_test import TestMetrics
+from .instrumentation_test import TestInstrumentation
+from .request_test import TestRequests
+from .devicecache_test import TestDeviceCache
+from .snapshot_test import TestSnapshot
+from .coalescer_test import TestCoalescer
+from .registercache_test import TestRegisterCache
+from .capture_test import TestCapture
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,88 @@
+import random
+import unittest
+import sys
+sys.path.append("..")
+
+from src.assembler import FrameAssembler
+from src.crc import crc16
+from src.protocol import LumiaxClient
+
+def frame(body: bytes) -> bytes:
+    return body + crc16(body)
+
+class TestAssembler(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.read = frame(bytes([0xFE, 0x04, 0x0A]) + bytes(self.rng.randrange(256) for _ in range(10)))
+        self.write = frame(bytes([0xFE, 0x06, 0x90, 0x21, 0x05, 0x8C]))
+        self.assembler = FrameAssembler(size=64)
+
+    def feed(self, stream: bytes, mtu: int) -> list[bytes]:
+        frames = []
+        for i in range(0, len(stream), mtu):
+            frames += [bytes(f) for f in self.assembler.feed(stream[i:i + mtu])]
+        return frames
+
+    def test_fragmented(self):
+        stream = self.read + self.write + self.read
+        for mtu in [1, 2, 3, 7, 20, len(stream)]:
+            with self.subTest(mtu=mtu):
+                self.assembler.reset()
+                self.assertEqual([self.read, self.write, self.read], self.feed(stream, mtu))
+                self.assertEqual(0, len(self.assembler))
+
+    def test_returns_views(self):
+        frames = self.assembler.feed(self.read)
+        self.assertIsInstance(frames[0], memoryview)
+        self.assertIs(frames[0].obj, self.assembler.buffer)
+
+    def test_resync_after_garbage(self):
+        stream = bytes([0x00, 0x04, 0xFF, 0x13]) + self.read + bytes([0x37]) + self.write
+        for mtu in [1, 5, 20]:
+            with self.subTest(mtu=mtu):
+                self.assembler.reset()
+                self.assertEqual([self.read, self.write], self.feed(stream, mtu))
+
+    def test_corrupted_frame(self):
+        corrupted = bytearray(self.read)
+        corrupted[5] ^= 0x10
+        frames = self.feed(bytes(corrupted) + self.write, 4)
+        self.assertEqual([self.write], frames)
+        self.assertGreater(self.assembler.crc_failures, 0)
+        self.assertGreater(self.assembler.discarded, 0)
+
+    def test_exception_response(self):
+        response = frame(bytes([0xFE, 0x84, 0x02]))
+        self.assertEqual([response], self.feed(response + self.write, 3)[:1])
+        with self.assertRaises(Exception):
+            LumiaxClient().parse(0x3030, response)
+
+    def test_random_streams(self):
+        # Long streams wrap around the buffer many times
+        expected = []
+        stream = bytearray()
+        for _ in range(200):
+            if self.rng.random() < 0.2:
+                stream += bytes(self.rng.randrange(256) for _ in range(self.rng.randint(1, 3)))
+            f = self.rng.choice([self.read, self.write])
+            expected.append(f)
+            stream += f
+        frames = []
+        i = 0
+        while i < len(stream):
+            n = self.rng.randint(1, 20)
+            frames += [bytes(f) for f in self.assembler.feed(bytes(stream[i:i + n]))]
+            i += n
+        self.assertEqual(expected, frames)
+
+    def test_parse_view(self):
+        client = LumiaxClient()
+        recv_buf = bytes([0x01, 0x04, 0x38, 0x41, 0x01, 0x13, 0xF7, 0x00, 0x0F, 0x00, 0x00, 0x04, 0x38, 0x04, 0xB0, 0x04, 0x60, 0x04, 0x74, 0x05, 0x00, 0x04,0xB0, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x2C, 0x03, 0x20, 0x03, 0x20, 0x00, 0x00, 0x00,0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x3C, 0x00, 0x00, 0xB1, 0xB7])
+        assembler = FrameAssembler(client, size=64)
+        frames = [f for i in range(0, len(recv_buf), 20) for f in assembler.feed(recv_buf[i:i + 20])]
+        self.assertEqual(1, len(frames))
+        expected = client.parse(0x3011, recv_buf)
+        results = client.parse(0x3011, frames[0], check_crc=False)
+        self.assertEqual([r.value for r in expected], [r.value for r in results])
+if __name__ == "__main__":
+    unittest.main()
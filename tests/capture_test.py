@@ -0,0 +1,85 @@
+import contextlib
+import io
+import os
+import re
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from src.bleclient import BleClient
+from src.capture import CaptureWriter, COMMAND, NOTIFICATION, read_capture, replay
+from src.simulator import Simulator
+
+class TestCapture(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "capture.bin")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def record(self, addresses, **options):
+        simulator = Simulator(latency=0.001, connect_time=0, mtu=20, **options)
+        capture = CaptureWriter(self.path)
+        readings = {}
+        for address in addresses:
+            async with BleClient(address, bleak_client_factory=simulator.client, capture=capture) as client:
+                readings[address] = await client.read(0x3030, 41) + await client.read(0x9021, 12)
+        capture.close()
+        return readings
+
+    async def test_record_and_replay(self):
+        addresses = ["00:00:00:00:00:01", "00:00:00:00:00:02"]
+        readings = await self.record(addresses)
+        records = list(read_capture(self.path))
+        self.assertEqual(4, sum(record.kind == COMMAND for record in records))
+        self.assertGreater(sum(record.kind == NOTIFICATION for record in records), 4)  # Fragmented by the MTU
+        self.assertEqual(addresses, sorted({record.device for record in records}))
+
+        replayed = {address: [] for address in addresses}
+        async def handler(address, results):
+            replayed[address] += results
+        stats = await replay(self.path, handler)
+        self.assertEqual(4, stats.frames)
+        self.assertEqual(0, stats.errors)
+        for address in addresses:
+            self.assertEqual([(r.name, r.value) for r in readings[address]], [(r.name, r.value) for r in replayed[address]])
+
+    async def test_appends_and_ignores_cut_off_records(self):
+        await self.record(["00:00:00:00:00:01"])
+        await self.record(["00:00:00:00:00:02"])
+        with open(self.path, "ab") as file:
+            file.write(bytes(5))
+        stats = await replay(self.path)
+        self.assertEqual(4, stats.frames)
+        self.assertEqual(["00:00:00:00:00:01", "00:00:00:00:00:02"], sorted({record.device for record in read_capture(self.path)}))
+
+    async def test_stale_and_corrupted_fragments(self):
+        capture = CaptureWriter(self.path)
+        capture.record(NOTIFICATION, "00:00:00:00:00:01", bytes.fromhex("0104021770b724"))  # Before any command
+        capture.record(NOTIFICATION, "00:00:00:00:00:01", bytes.fromhex("0104021770b725"))
+        capture.close()
+        stats = await replay(self.path)
+        self.assertEqual(1, stats.stale)
+        self.assertEqual(1, stats.crc_failures)
+
+    async def test_replay_aggregated(self):
+        import main
+        await self.record(["00:00:00:00:00:01"])
+        messages = []
+        for aggregate in [False, True]:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                await main.replay_capture(self.path, aggregate)
+            messages.append(int(re.search(r"(\d+) messages", output.getvalue()).group(1)))
+        # Group documents instead of a state topic per value
+        self.assertLess(messages[1], messages[0])
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as file:
+            file.write(b"not a capture")
+        with self.assertRaises(Exception):
+            list(read_capture(self.path))
+
+if __name__ == "__main__":
+    unittest.main()
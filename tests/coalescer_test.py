@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+import sys
+sys.path.append("..")
+
+from src.coalescer import CommandCoalescer
+from src.protocol import Result
+from src.variables import variables
+
+def command(name: str, value: str) -> Result:
+    return Result(variables[name], value)
+
+class TestCoalescer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.coalescer = CommandCoalescer(window=0.02, max_delay=0.1)
+        self.queue = asyncio.Queue()
+
+    async def send(self, commands, interval: float = 0.005):
+        for item in commands:
+            self.queue.put_nowait(item)
+            await asyncio.sleep(interval)
+
+    async def test_latest_value_wins(self):
+        slider = [command("float_voltage", f"{13.5 + i / 10:.1f}") for i in range(5)]
+        sender = asyncio.create_task(self.send(slider + [command("boost_voltage", "14.4")]))
+        commands = await self.coalescer.collect(self.queue.get)
+        await sender
+        self.assertEqual([("float_voltage", "13.9"), ("boost_voltage", "14.4")], [(c.name, c.value) for c in commands])
+        self.assertEqual(6, self.coalescer.received)
+
+    async def test_window_ends(self):
+        sender = asyncio.create_task(self.send([command("float_voltage", "13.8"), command("boost_voltage", "14.4")], interval=0.05))
+        self.assertEqual(1, len(await self.coalescer.collect(self.queue.get)))
+        self.assertEqual(1, len(await self.coalescer.collect(self.queue.get)))
+        await sender
+
+    async def test_max_delay(self):
+        # A command every 10 ms never leaves a quiet window, but is written after max_delay
+        sender = asyncio.create_task(self.send([command("float_voltage", str(13 + i / 100)) for i in range(30)], interval=0.01))
+        start = asyncio.get_running_loop().time()
+        await self.coalescer.collect(self.queue.get)
+        self.assertLess(asyncio.get_running_loop().time() - start, 0.2)
+        sender.cancel()
+
+    def test_plan(self):
+        commands = [
+            command("timed_start_time_1_hours", "6"),
+            command("timed_start_time_1_seconds", "0"),
+            command("timed_start_time_1_minutes", "30"),
+            command("float_voltage", "13.8"),
+            command("manual_control_switch", "On"),
+            command("test_key_trigger", "On"),
+            command("boost_voltage", "not a number"),
+        ]
+        batches, rejected = self.coalescer.plan(commands)
+        self.assertEqual([
+            ["manual_control_switch"],  # Coils can only be written one at a time
+            ["test_key_trigger"],
+            ["float_voltage"],
+            ["timed_start_time_1_seconds", "timed_start_time_1_minutes", "timed_start_time_1_hours"],
+        ], [[c.name for c in batch] for batch in batches])
+        self.assertEqual(["boost_voltage"], [c.name for c, e in rejected])
+        self.coalescer.received = len(commands)
+        self.assertEqual(2, self.coalescer.saved)
+
+        start_address, frame = self.coalescer.protocol.get_write_command(0xFE, list(batches[-1]))
+        self.assertEqual(0x902F, start_address)
+        self.assertEqual(bytes([0xFE, 0x10, 0x90, 0x2F, 0x00, 0x03, 0x06, 0x00, 0x00, 0x00, 0x1E, 0x00, 0x06]), frame[:-2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import random
+import unittest
+import sys
+sys.path.append("..")
+
+from src import crc
+from src.crc import crc16, Crc16
+
+def crc16_bitwise(data: bytes) -> bytes:
+    crc = 0xFFFF
+    for n in range(len(data)):
+        crc ^= data[n]
+        for i in range(8):
+            if crc & 1:
+                crc >>= 1
+                crc ^= 0xA001
+            else:
+                crc >>= 1
+    return crc.to_bytes(2, 'little')
+
+class TestCrc(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(16)
+        self.samples = [b"", bytes([0x01, 0x04, 0x30, 0x11, 0x00, 0x1C])] + \
+            [rng.randbytes(rng.randint(1, 300)) for _ in range(200)]
+
+    def test_known_value(self):
+        self.assertEqual(bytes([0xAE, 0xC6]), crc16(bytes([0x01, 0x04, 0x30, 0x11, 0x00, 0x1C])))
+
+    def test_equivalence(self):
+        for data in self.samples:
+            self.assertEqual(crc16_bitwise(data), crc16(data))
+            self.assertEqual(crc16_bitwise(data), crc._crc16_update(crc.CRC16_INIT, data).to_bytes(2, 'little'))
+
+    def test_buffer_types(self):
+        data = self.samples[-1]
+        self.assertEqual(crc16(data), crc16(bytearray(data)))
+        self.assertEqual(crc16(data), crc16(memoryview(data)))
+
+    def test_streaming(self):
+        rng = random.Random(3)
+        for data in self.samples:
+            running = Crc16()
+            cursor = 0
+            while cursor < len(data):
+                size = rng.randint(1, 20)
+                running.update(data[cursor:cursor+size])
+                cursor += size
+            self.assertEqual(crc16_bitwise(data), running.digest())
+            running.reset()
+            self.assertEqual(crc16(b""), running.digest())
+
+    def test_residue(self):
+        for data in self.samples:
+            frame = data + crc16(data)
+            self.assertTrue(Crc16(frame).residue_ok)
+            if data:
+                corrupted = bytes([frame[0] ^ 0x01]) + frame[1:]
+                self.assertFalse(Crc16(corrupted).residue_ok)
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import sys
+sys.path.append("..")
+
+from src.deadband import Deadband, PublishFilter
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class TestDeadband(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.filter = PublishFilter(max_silence=60, clock=self.clock)
+
+    def test_absolute_deadband(self):
+        self.assertTrue(self.filter.should_publish("voltage", 13.2, "V"))
+        self.assertFalse(self.filter.should_publish("voltage", 13.24, "V"))
+        self.assertFalse(self.filter.should_publish("voltage", 13.16, "V"))
+        self.assertTrue(self.filter.should_publish("voltage", 13.3, "V"))
+        self.assertEqual((2, 2), (self.filter.sent, self.filter.suppressed))
+
+    def test_slow_drift_is_published(self):
+        # Compared against the last published value, not the last reading
+        self.assertTrue(self.filter.should_publish("voltage", 13.20, "V"))
+        self.assertFalse(self.filter.should_publish("voltage", 13.23, "V"))
+        self.assertTrue(self.filter.should_publish("voltage", 13.26, "V"))
+
+    def test_relative_deadband(self):
+        self.assertTrue(self.filter.should_publish("power", 1000, "W"))
+        self.assertFalse(self.filter.should_publish("power", 1015, "W"))
+        self.assertTrue(self.filter.should_publish("power", 1030, "W"))
+        self.assertTrue(self.filter.should_publish("small_power", 3, "W"))
+        self.assertTrue(self.filter.should_publish("small_power", 5, "W"))
+
+    def test_exact_match_without_deadband(self):
+        self.assertTrue(self.filter.should_publish("percentage", 50, "%"))
+        self.assertFalse(self.filter.should_publish("percentage", 50, "%"))
+        self.assertTrue(self.filter.should_publish("percentage", 51, "%"))
+        self.assertTrue(self.filter.should_publish("mode", "On", ""))
+        self.assertFalse(self.filter.should_publish("mode", "On", ""))
+        self.assertTrue(self.filter.should_publish("mode", "Off", ""))
+
+    def test_max_silence(self):
+        self.assertTrue(self.filter.should_publish("voltage", 13.2, "V"))
+        self.clock.now = 59
+        self.assertFalse(self.filter.should_publish("voltage", 13.2, "V"))
+        self.clock.now = 60
+        self.assertTrue(self.filter.should_publish("voltage", 13.2, "V"))
+        self.assertFalse(self.filter.should_publish("voltage", 13.2, "V"))
+
+    def test_forget(self):
+        self.filter.should_publish("voltage", 13.2, "V")
+        self.filter.forget("voltage")
+        self.assertTrue(self.filter.should_publish("voltage", 13.2, "V"))
+
+    def test_custom_deadbands(self):
+        publish_filter = PublishFilter({"V": Deadband(absolute=1)}, clock=self.clock)
+        self.assertTrue(publish_filter.should_publish("voltage", 13.2, "V"))
+        self.assertFalse(publish_filter.should_publish("voltage", 14, "V"))
+        self.assertTrue(publish_filter.should_publish("current", 1.0, "A"))
+        self.assertTrue(publish_filter.should_publish("current", 1.01, "A"))
+if __name__ == "__main__":
+    unittest.main()
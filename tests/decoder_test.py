@@ -0,0 +1,93 @@
+import random
+import struct
+import unittest
+import sys
+sys.path.append("..")
+
+from src import decoder
+from src.crc import crc16
+from src.decoder import BlockDecoder
+from src.protocol import LumiaxClient
+
+blocks = [
+    (0x04, 0x3000, 11),
+    (0x04, 0x3011, 28),
+    (0x04, 0x3030, 41),
+    (0x03, 0x9021, 12),
+]
+
+class TestDecoder(unittest.TestCase):
+    def setUp(self):
+        self.client = LumiaxClient()
+        rng = random.Random(4)
+        self.payloads = {}
+        for function_code, start_address, count in blocks:
+            decoder = BlockDecoder(function_code, start_address, count)
+            enums = {index for index, variable in decoder.fields if variable.func and not variable.multiplier}
+            payloads = []
+            for _ in range(50):
+                # keep enum registers small so that every lookup table has an entry
+                words = [rng.randint(0, 1) if index in enums else rng.getrandbits(16) for index in range(count)]
+                payloads.append(struct.pack(f">{count}H", *words))
+            self.payloads[(function_code, start_address, count)] = payloads
+
+    def expected(self, decoder: BlockDecoder, payload: bytes):
+        return [self.client.bytes_to_value(variable, payload, index * 2) for index, variable in decoder.fields]
+
+    def test_decode(self):
+        for key, payloads in self.payloads.items():
+            decoder = BlockDecoder(*key)
+            for payload in payloads:
+                results = decoder.decode(payload)
+                self.assertListEqual(self.expected(decoder, payload), [r.value for r in results])
+
+    def test_decode_many(self):
+        for key, payloads in self.payloads.items():
+            decoder = BlockDecoder(*key)
+            rows = [self.expected(decoder, payload) for payload in payloads]
+            columns = decoder.decode_many(payloads)
+            self.assertEqual(len(decoder.fields), len(columns))
+            for i, (variable, column) in enumerate(columns):
+                self.assertListEqual([row[i] for row in rows], list(column), variable.name)
+
+    def test_decode_many_without_numpy(self):
+        numpy, decoder.np = decoder.np, None
+        try:
+            self.test_decode_many()
+        finally:
+            decoder.np = numpy
+
+    def test_signed_32_bit(self):
+        block = BlockDecoder(0x04, 0x3045, 5)
+        payload = struct.pack(">HHhHh", 80, 1250, -512, 0xFC00, -2)  # low word first
+        for variable, column in block.decode_many([payload, payload]):
+            if variable.name == "battery_power":
+                self.assertListEqual([-665.6, -665.6], list(column))
+                self.assertEqual(-665.6, self.client.bytes_to_value(variable, payload, 6))
+            if variable.name == "battery_current":
+                self.assertListEqual([-5.12, -5.12], list(column))
+
+    def test_skips_truncated_32_bit(self):
+        block = BlockDecoder(0x04, 0x3045, 5)
+        self.assertNotIn("load_power", [v.name for v in block.variables])
+        self.assertIn("battery_power", [v.name for v in block.variables])
+        self.assertNotIn("battery_power", [v.name for v in BlockDecoder(0x04, 0x3045, 4).variables])
+
+    def test_decode_frames(self):
+        key = (0x04, 0x3030, 41)
+        payloads = self.payloads[key]
+        frames = []
+        for payload in payloads:
+            header = bytes([0x01, 0x04, len(payload)]) + payload
+            frames.append(header + crc16(header))
+        block = BlockDecoder(*key)
+        self.assertEqual(
+            [list(column) for _, column in block.decode_many(payloads)],
+            [list(column) for _, column in block.decode_frames(frames)])
+        frames[3] = frames[3][:-1] + bytes([frames[3][-1] ^ 0xFF])
+        with self.assertRaises(Exception):
+            block.decode_frames(frames)
+        with self.assertRaises(Exception):
+            BlockDecoder(0x04, 0x3030, 40).decode_frames(frames)
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+from bleak.exc import BleakError
+
+from src.bleclient import BleClient
+from src.devicecache import DeviceCache, GattHandles
+
+SERVICE_UUID = "0000ff00-0000-1000-8000-00805f9b34fb"
+
+class FakeScanner:
+    def __init__(self, detection_callback):
+        self.detection_callback = detection_callback
+        self.running = False
+
+    async def start(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+
+    def advertise(self, address: str, name: str = "BT-TH", rssi: int = -60):
+        advertisement = AdvertisementData(name, {}, {}, [], None, rssi, ())
+        self.detection_callback(BLEDevice(address, name, None, rssi), advertisement)
+
+class FakeCharacteristic:
+    def __init__(self, uuid: str, handle: int):
+        self.uuid = uuid
+        self.handle = handle
+        self.service_uuid = SERVICE_UUID
+
+class FakeServices:
+    def __init__(self, characteristics):
+        self.characteristics = characteristics
+
+    def get_characteristic(self, specifier):
+        for characteristic in self.characteristics:
+            if specifier in (characteristic.uuid, characteristic.handle):
+                return characteristic
+        return None
+
+class FakeBleakClient:
+    instances = []
+    fail = False
+
+    def __init__(self, address_or_device, disconnected_callback=None, **kwargs):
+        self.address_or_device = address_or_device
+        self.kwargs = kwargs
+        self.services = FakeServices([FakeCharacteristic(BleClient.NOTIFY_UUID, 17), FakeCharacteristic(BleClient.WRITE_UUID, 20)])
+        self.notified = None
+        FakeBleakClient.instances.append(self)
+
+    async def connect(self):
+        if FakeBleakClient.fail:
+            raise BleakError("device disappeared")
+
+    async def start_notify(self, specifier, callback):
+        self.notified = specifier
+
+class TestDeviceCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        FakeBleakClient.instances = []
+        FakeBleakClient.fail = False
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "gatt.json")
+        self.scanners = []
+        self.cache = self.create_cache()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def create_cache(self) -> DeviceCache:
+        def scanner_factory(**kwargs):
+            self.scanners.append(FakeScanner(**kwargs))
+            return self.scanners[-1]
+        return DeviceCache(self.path, scanner_factory=scanner_factory)
+
+    async def test_scan(self):
+        found = []
+        self.cache.listeners.append(found.append)
+        async with self.cache:
+            self.assertFalse(await self.cache.find(["aa:bb:cc:dd:ee:ff"], timeout=0.01))
+            asyncio.get_running_loop().call_later(0.01, self.scanners[0].advertise, "AA:BB:CC:DD:EE:FF")
+            self.assertTrue(await self.cache.find(["aa:bb:cc:dd:ee:ff"], timeout=1))
+            self.scanners[0].advertise("AA:BB:CC:DD:EE:FF", rssi=-70)
+        self.assertFalse(self.scanners[0].running)
+        self.assertEqual(1, len(found))
+        self.assertEqual(-70, self.cache.devices["AA:BB:CC:DD:EE:FF"].rssi)
+        self.assertEqual("BT-TH", self.cache.devices["AA:BB:CC:DD:EE:FF"].name)
+
+    def test_handles_are_persisted(self):
+        self.cache.store_gatt("aa:bb:cc:dd:ee:ff", GattHandles([SERVICE_UUID], 17, 20))
+        self.assertEqual(GattHandles([SERVICE_UUID], 17, 20), self.create_cache().gatt("AA:BB:CC:DD:EE:FF"))
+        self.cache.store_gatt("aa:bb:cc:dd:ee:ff", None)
+        self.assertIsNone(self.create_cache().gatt("AA:BB:CC:DD:EE:FF"))
+
+    async def test_connect(self):
+        await self.cache.start()
+        self.scanners[0].advertise("AA:BB:CC:DD:EE:FF")
+        mppt = BleClient("AA:BB:CC:DD:EE:FF", bleak_client_factory=FakeBleakClient, device_cache=self.cache)
+        await mppt.__aenter__()
+        first = FakeBleakClient.instances[0]
+        self.assertIsInstance(first.address_or_device, BLEDevice)
+        self.assertEqual({}, first.kwargs)
+        self.assertEqual(17, first.notified)
+        self.assertEqual(GattHandles([SERVICE_UUID], 17, 20), self.cache.gatt("AA:BB:CC:DD:EE:FF"))
+
+        # The next connection only discovers the known service
+        mppt = BleClient("AA:BB:CC:DD:EE:FF", bleak_client_factory=FakeBleakClient, device_cache=self.cache)
+        await mppt.__aenter__()
+        self.assertEqual({"services": [SERVICE_UUID]}, FakeBleakClient.instances[1].kwargs)
+        self.assertEqual(20, mppt.write_characteristic)
+
+        # A device that can't be reached anymore is looked up again
+        FakeBleakClient.fail = True
+        mppt = BleClient("AA:BB:CC:DD:EE:FF", bleak_client_factory=FakeBleakClient, device_cache=self.cache)
+        with self.assertRaises(BleakError):
+            await mppt.__aenter__()
+        self.assertIsNone(self.cache.get("AA:BB:CC:DD:EE:FF"))
+        mppt = BleClient("AA:BB:CC:DD:EE:FF", bleak_client_factory=FakeBleakClient, device_cache=self.cache)
+        self.assertEqual("AA:BB:CC:DD:EE:FF", FakeBleakClient.instances[-1].address_or_device)
+        await self.cache.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from src.history import HistoryStore, Tier, DAY, HOUR, MINUTE
+from src.protocol import Result, ResultContainer
+from src.variables import variables
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def readings(voltage: float, state: str = "On") -> ResultContainer:
+    return ResultContainer([
+        Result(**vars(variables["battery_voltage"]), value=voltage),
+        Result(**vars(variables["load_state"]), value=state),
+    ])
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.clock = FakeClock(100 * DAY)
+        self.store = HistoryStore(self.directory.name, clock=self.clock)
+        self.device = "AA:BB:CC:DD:EE:FF"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, start: float, seconds: float, step: float = 5):
+        t = start
+        while t < start + seconds:
+            self.clock.now = t
+            self.store.append(self.device, readings(12 + (t - start) / seconds))
+            t += step
+
+    def test_raw_range(self):
+        start = self.clock.now
+        self.fill(start, 10 * MINUTE)
+        points = self.store.query(self.device, "battery_voltage", start + 60, start + 120)
+        self.assertEqual(12, len(points))
+        self.assertEqual(start + 60, points[0].time)
+        self.assertAlmostEqual(12.1, points[0].mean)
+        self.assertEqual([], self.store.query(self.device, "load_state", start, start + 120))
+
+    def test_downsampling(self):
+        start = self.clock.now
+        self.fill(start, 2 * HOUR)
+        points = self.store.query(self.device, "battery_voltage", start, start + 2 * HOUR, resolution=MINUTE)
+        self.assertEqual(120, len(points))
+        self.assertEqual(12, points[0].count)
+        self.assertEqual(12, points[0].min)
+        self.assertAlmostEqual(12 + 55 / 7200, points[0].max)
+        hours = self.store.query(self.device, "battery_voltage", start, start + 2 * HOUR, resolution=HOUR)
+        self.assertEqual([720, 720], [point.count for point in hours])
+        self.assertAlmostEqual(12.25, hours[0].mean, places=3)
+
+    def test_reopen_merges_buckets(self):
+        start = self.clock.now
+        self.fill(start, 30)
+        self.store.close()
+        self.store = HistoryStore(self.directory.name, clock=self.clock)
+        self.fill(start + 30, 30)
+        points = self.store.query(self.device, "battery_voltage", start, start + MINUTE, resolution=MINUTE)
+        self.assertEqual(1, len(points))
+        self.assertEqual(12, points[0].count)
+
+    def test_falls_back_to_coarser_tier(self):
+        start = self.clock.now
+        self.fill(start, 2 * HOUR, step=60)
+        self.clock.now = start + 30 * DAY
+        tier = self.store.select_tier(start)
+        self.assertEqual("1m", tier.name)
+        self.assertEqual(120, len(self.store.query(self.device, "battery_voltage", start, start + 2 * HOUR)))
+
+    def test_retention(self):
+        tiers = [Tier("raw", 0, HOUR, 2 * HOUR)]
+        store = HistoryStore(self.directory.name, tiers=tiers, clock=self.clock)
+        start = self.clock.now
+        for i in range(6):
+            store.append(self.device, readings(12), timestamp=start + i * HOUR)
+        store.flush()
+        directory = store.get_directory(self.device, "battery_voltage")
+        self.assertEqual(6, len(os.listdir(directory)))
+        for path in [os.path.join(self.directory.name, ".DS_Store"), os.path.join(os.path.dirname(directory), "lock")]:
+            with open(path, "w"):
+                pass  # Stray files are ignored
+        self.assertEqual(3, store.enforce_retention(start + 6 * HOUR))
+        self.assertEqual(3, len(store.query(self.device, "battery_voltage", start, start + 6 * HOUR)))
+
+    def test_clock_going_back(self):
+        start = self.clock.now
+        self.store.append(self.device, readings(12), timestamp=start)
+        self.store.append(self.device, readings(13), timestamp=start - 10)
+        points = self.store.query(self.device, "battery_voltage", start - 60, start + 60)
+        self.assertEqual([start, start], [point.time for point in points])
+if __name__ == "__main__":
+    unittest.main()
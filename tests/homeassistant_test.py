@@ -0,0 +1,130 @@
+import asyncio
+import json
+import unittest
+import sys
+sys.path.append("..")
+
+from aiomqtt import Message, MqttError
+
+from src.homeassistant import MqttSensor
+from src.protocol import Result, ResultContainer
+from src.variables import variables
+
+class FakeSensor(MqttSensor):
+    def __init__(self, messages, **kwargs):
+        super().__init__(hostname="localhost", **kwargs)
+        self.incoming = messages
+        self.published = []
+
+    @property
+    def messages(self):
+        async def generator():
+            for message in self.incoming:
+                if isinstance(message, Exception):
+                    raise message
+                yield message
+            await asyncio.Event().wait()
+        return generator()
+
+    async def publish_message(self, topic, payload, retain=False, qos=0):
+        self.published.append((topic, payload, retain))
+
+def message(topic: str, payload: bytes) -> Message:
+    return Message(topic, payload, qos=2, retain=False, mid=1, properties=None)
+
+class TestHomeAssistant(unittest.IsolatedAsyncioTestCase):
+    async def test_default_device(self):
+        sensor = FakeSensor([])
+        self.assertIs(sensor, sensor.device())
+        self.assertEqual("homeassistant/sensor/solarlife/battery_voltage/state", sensor.get_state_topic(variables["battery_voltage"]))
+
+    async def test_device_topics(self):
+        sensor = FakeSensor([])
+        device = sensor.device("AA:BB:CC:DD:EE:FF")
+        self.assertIs(device, sensor.device("AA:BB:CC:DD:EE:FF"))
+        self.assertEqual("homeassistant/sensor/solarlife_aabbccddeeff/battery_voltage/state", device.get_state_topic(variables["battery_voltage"]))
+        self.assertEqual(["solarlife_mppt_ble_aabbccddeeff"], device.device_info["identifiers"])
+
+        await device.store_config(variables[:1])
+        await device.publish(variables[:0])
+        topic, payload, retain = sensor.published[0]
+        self.assertTrue(topic.startswith("homeassistant/sensor/solarlife_aabbccddeeff/"))
+        self.assertIn(b'"unique_id": "solarlife_aabbccddeeff_', payload)
+
+    async def test_suppresses_unchanged_values(self):
+        sensor = FakeSensor([])
+        voltage = variables["battery_voltage"]
+        def results(value):
+            return ResultContainer([Result(**vars(voltage), value=value)])
+        topic = sensor.get_state_topic(voltage)
+        for value in [13.2, 13.22, 13.4]:
+            await sensor.publish(results(value))
+        await sensor.publish(results(13.4), force=True)
+        states = [payload for t, payload, retain in sensor.published if t == topic]
+        self.assertEqual(["13.2", "13.4", "13.4"], states)
+        self.assertEqual(1, sensor.publish_filter.suppressed)
+
+    async def test_entities_are_cached(self):
+        voltage = variables["battery_voltage"]
+        entity = FakeSensor([]).get_entity(voltage)
+        self.assertIs(entity, FakeSensor([]).get_entity(voltage))
+        self.assertIsInstance(entity.config, bytes)
+        self.assertEqual(entity.state_topic, FakeSensor([]).get_state_topic(voltage))
+
+    async def test_republish_on_birth_message(self):
+        sensor = FakeSensor([])
+        device = sensor.device("00:00:00:00:00:01")
+        await device.store_config(variables[:2])
+        await device.store_config(variables[:2])
+        self.assertEqual(2, len(sensor.published))
+        sensor.incoming = [
+            message("homeassistant/status", b"offline"),
+            message("homeassistant/status", b"online"),
+        ]
+        sensor.start_dispatcher()
+        await asyncio.sleep(0.01)
+        self.assertEqual(4, len(sensor.published))
+        self.assertEqual(sensor.published[:2], sensor.published[2:])
+        sensor.dispatcher.cancel()
+
+    async def test_aggregated_state(self):
+        sensor = FakeSensor([], aggregate=True)
+        device = sensor.device("00:00:00:00:00:03")
+        voltage, current = variables["battery_voltage"], variables["battery_current"]
+        await device.publish(ResultContainer([Result(**vars(voltage), value=13.2), Result(**vars(current), value=1.5)]), group="status")
+        topic = "homeassistant/solarlife_000000000003/status/state"
+        configs = {t: json.loads(payload) for t, payload, retain in sensor.published if t.endswith("/config")}
+        config = configs["homeassistant/sensor/solarlife_000000000003/battery_voltage/config"]
+        self.assertEqual(topic, config["state_topic"])
+        self.assertEqual("{{ value_json.battery_voltage }}", config["value_template"])
+        states = [json.loads(payload) for t, payload, retain in sensor.published if t == topic]
+        self.assertEqual([{"battery_voltage": 13.2, "battery_current": 1.5}], states)
+
+        # A later update of a single value still publishes the whole document
+        await device.publish(ResultContainer([Result(**vars(current), value=2.5)]), force=True)
+        states = [json.loads(payload) for t, payload, retain in sensor.published if t == topic]
+        self.assertEqual({"battery_voltage": 13.2, "battery_current": 2.5}, states[-1])
+        self.assertEqual(2, len(states))
+
+    async def test_command_routing(self):
+        sensor = FakeSensor([
+            message("homeassistant/number/solarlife_000000000002/boost_voltage/command", b"14.4"),
+            message("homeassistant/number/solarlife_000000000001/float_voltage/command", b"13.6"),
+            message("homeassistant/number/unknown/float_voltage/command", b"13.6"),
+        ])
+        first = sensor.device("00:00:00:00:00:01")
+        second = sensor.device("00:00:00:00:00:02")
+        command = await asyncio.wait_for(first.get_command(), 1)
+        self.assertEqual(("float_voltage", "13.6"), (command.name, command.value))
+        command = await asyncio.wait_for(second.get_command(), 1)
+        self.assertEqual(("boost_voltage", "14.4"), (command.name, command.value))
+        sensor.dispatcher.cancel()
+
+    async def test_connection_error(self):
+        sensor = FakeSensor([MqttError("Disconnected")])
+        with self.assertRaises(MqttError):
+            await asyncio.wait_for(sensor.get_command(), 1)
+        with self.assertRaises(MqttError):
+            await asyncio.wait_for(sensor.device("00:00:00:00:00:01").get_command(), 1)
+if __name__ == "__main__":
+    unittest.main()
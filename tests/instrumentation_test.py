@@ -0,0 +1,84 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from src.bleclient import BleClient
+from src.instrumentation import Tracer, tracer, LogExporter, JsonLinesExporter, SummaryExporter
+from src.simulator import Simulator
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.records = []
+        tracer.add_exporter(self.records.append)
+
+    def tearDown(self):
+        tracer.remove_exporter(self.records.append)
+
+    def test_disabled(self):
+        disabled = Tracer()
+        self.assertFalse(disabled.enabled)
+        self.assertIs(disabled.span("a"), disabled.span("b"))
+        with disabled.span("a") as span:
+            span.set(ignored=True)
+        disabled.count("c")
+        summary = SummaryExporter()
+        disabled.add_exporter(summary)
+        disabled.remove_exporter(summary)
+        self.assertFalse(disabled.enabled)
+
+    def test_span(self):
+        with self.assertRaises(ValueError):
+            with tracer.span("work", device="a") as span:
+                span.set(step=1)
+                raise ValueError()
+        tracer.count("retries", 2)
+        self.assertEqual(["span", "counter"], [record.kind for record in self.records])
+        self.assertEqual({"device": "a", "step": 1, "error": "ValueError"}, self.records[0].attributes)
+        self.assertGreaterEqual(self.records[0].value, 0)
+        self.assertEqual(2, self.records[1].value)
+
+    async def test_read(self):
+        simulator = Simulator(latency=0.001, connect_time=0, mtu=20)
+        async with BleClient("00:00:00:00:00:01", bleak_client_factory=simulator.client) as mppt:
+            await mppt.read(0x3030, 41)
+        spans = {record.name: record for record in self.records if record.kind == "span"}
+        for name in ["connect", "notify_subscribe", "command_write", "first_fragment", "reassembly", "decode", "read"]:
+            self.assertIn(name, spans)
+        self.assertEqual(1, spans["read"].attributes["attempts"])
+        self.assertEqual(41 * 2 + 5, spans["reassembly"].attributes["length"])
+        self.assertLessEqual(spans["first_fragment"].value, spans["read"].value)
+
+    def test_exporters(self):
+        stream = io.StringIO()
+        log = LogExporter(stream)
+        summary = SummaryExporter()
+        with tempfile.TemporaryDirectory() as path:
+            lines = JsonLinesExporter(os.path.join(path, "trace.jsonl"))
+            for exporter in [log, summary, lines]:
+                tracer.add_exporter(exporter)
+            try:
+                for _ in range(3):
+                    tracer.timing("decode", 0.002, device="a")
+                tracer.count("crc_failures")
+                tracer.event("timeout", partial="fe04")
+            finally:
+                for exporter in [log, summary, lines]:
+                    tracer.remove_exporter(exporter)
+            lines.close()
+            with open(os.path.join(path, "trace.jsonl")) as file:
+                records = [json.loads(line) for line in file]
+        self.assertEqual(5, len(records))
+        self.assertEqual({"kind": "span", "name": "decode", "value": 0.002, "attributes": {"device": "a"}},
+                         {key: value for key, value in records[0].items() if key != "timestamp"})
+        self.assertIn("[span] decode 2.0ms device=a", stream.getvalue())
+        self.assertIn("[event] timeout partial=fe04", stream.getvalue())
+        self.assertEqual([3, 0.006], [summary.spans["decode"][0], round(summary.spans["decode"][1], 6)])
+        self.assertEqual(1, summary.counters["crc_failures"])
+        self.assertIn("decode", summary.report())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import functools
+import unittest
+import sys
+sys.path.append("..")
+
+from src.bleclient import BleClient
+from src.metrics import MetricsSnapshot
+from src.protocol import Result, ResultContainer
+from src.session import BleSession
+from src.simulator import Simulator
+from src.spool import Spool
+from src.variables import variables
+
+class TestMetrics(unittest.IsolatedAsyncioTestCase):
+    def test_readings(self):
+        metrics = MetricsSnapshot()
+        metrics.update("00:00:00:00:00:01", ResultContainer([
+            Result(variables["battery_voltage"], 13.2),
+            Result(variables["load_total_energy"], 1200),
+            Result(variables["battery_type"], "Lithium \"LiFePO4\""),
+        ]), duration=0.5)
+        text = metrics.render()
+        self.assertIn('solarlife_battery_voltage{device="00:00:00:00:00:01",unit="V"} 13.2', text)
+        self.assertIn("# TYPE solarlife_battery_voltage gauge", text)
+        self.assertIn("# TYPE solarlife_load_total_energy counter", text)
+        self.assertIn('solarlife_battery_type_info{device="00:00:00:00:00:01",value="Lithium \\"LiFePO4\\""} 1', text)
+        self.assertIn('solarlife_poll_duration_seconds{device="00:00:00:00:00:01"} 0.5', text)
+
+        metrics.update("00:00:00:00:00:01", ResultContainer([Result(variables["battery_voltage"], 13.4)]))
+        self.assertIn('unit="V"} 13.4', metrics.render())
+
+    async def test_link_counters(self):
+        simulator = Simulator(latency=0.001, connect_time=0, corruption=0.5)
+        session = BleSession("00:00:00:00:00:02", client_factory=functools.partial(BleClient, bleak_client_factory=simulator.client))
+        spool = Spool()
+        await spool.put(session.address, ResultContainer([Result(variables["battery_voltage"], 13.2)]))
+        metrics = MetricsSnapshot([session], spool)
+        async with session.transaction() as mppt:
+            for _ in range(5):
+                await mppt.read(0x3045, 13, timeout=0.05)
+        counters = session.counters()
+        self.assertGreater(counters["crc_failures"] + counters["retries"], 0)
+        await session.close()
+        self.assertEqual(counters, session.counters())  # Kept after the client is gone
+
+        text = metrics.render()
+        self.assertIn('solarlife_ble_connects_total{device="00:00:00:00:00:02"} 1', text)
+        self.assertIn(f'solarlife_ble_crc_failures_total{{device="00:00:00:00:00:02"}} {counters["crc_failures"]}', text)
+        self.assertIn("solarlife_spool_readings 1", text)
+
+    async def test_http(self):
+        metrics = MetricsSnapshot()
+        self.assertIsNot(metrics.sessions, MetricsSnapshot().sessions)
+        metrics.update("00:00:00:00:00:01", ResultContainer([Result(variables["battery_voltage"], 13.2)]))
+        server = await metrics.serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            return response
+
+        response = await get("/metrics")
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        self.assertIn(b"solarlife_battery_voltage", response)
+        response = await get("/metrics?name[]=solarlife_battery_voltage")
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK"))
+        for path in ["/", "/metricsfoo", "/metrics/foo"]:
+            response = await get(path)
+            self.assertTrue(response.startswith(b"HTTP/1.1 404"), path)
+        self.assertEqual(2, metrics.scrapes)
+        server.close()
+        await server.wait_closed()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+import sys
+sys.path.append("..")
+
+from src.variables import variables, status_registers, battery_and_load_parameters
+from src.protocol import LumiaxClient, ReadRequest, MAX_READ_COUNT
+from src.registermap import register_map
+
+class TestReadPlan(unittest.TestCase):
+    def setUp(self):
+        self.client = LumiaxClient()
+
+    def assertCovers(self, plan, items):
+        for variable in items:
+            end = variable.address + (2 if variable.is_32_bit else 1)
+            self.assertTrue(any(
+                r.start_address <= variable.address and end <= r.start_address + r.count and r.function_code in variable.function_codes
+                for r in plan), variable.name)
+
+    def assertValid(self, plan):
+        for request in plan:
+            self.assertLessEqual(request.count, MAX_READ_COUNT)
+            self.client.get_read_command(0xFE, request.start_address, request.count)
+
+    def test_battery_solar_load(self):
+        names = ["battery_voltage", "battery_current", "battery_power", "solar_panel_voltage",
+                 "solar_panel_current", "solar_panel_power", "load_voltage", "load_current", "load_power"]
+        items = [register_map.by_name(name)[0] for name in names]  # The real time block
+        plan = self.client.plan_reads(items)
+        self.assertEqual([ReadRequest(0x04, 0x3046, 12)], plan)
+        self.assertCovers(plan, items)
+
+    def test_names_resolve_like_variable_container(self):
+        for name in ["run_days", "battery_voltage", "equipment_id"]:
+            self.assertEqual(self.client.plan_reads([variables[name]]), self.client.plan_reads([name]), name)
+        self.assertEqual([ReadRequest(0x04, 0x316C, 1)], self.client.plan_reads(["run_days"]))
+        with self.assertRaises(Exception):
+            self.client.plan_reads(["unknown"])
+
+    def test_gap_tradeoff(self):
+        items = [register_map.by_name("run_days")[0], register_map.by_name("battery_voltage")[0]]
+        self.assertEqual([ReadRequest(0x04, 0x3031, 22)], self.client.plan_reads(items))
+        self.assertEqual([ReadRequest(0x04, 0x3031, 1), ReadRequest(0x04, 0x3046, 1)], self.client.plan_reads(items, request_cost=10))
+
+    def test_function_codes(self):
+        items = list(status_registers) + list(battery_and_load_parameters)
+        plan = self.client.plan_reads(items)
+        self.assertEqual({0x03, 0x04}, {r.function_code for r in plan})
+        self.assertCovers(plan, items)
+        self.assertValid(plan)
+
+    def test_frame_limit(self):
+        items = list(status_registers)
+        for request_cost in [0, 40, 1000]:
+            plan = self.client.plan_reads(items, request_cost)
+            self.assertCovers(plan, items)
+            self.assertValid(plan)
+        self.assertEqual(3, len(self.client.plan_reads(items, 1000)))
+
+    def test_whole_table(self):
+        items = [v for v in variables if any(fc in v.function_codes for fc in [0x02, 0x03, 0x04])]
+        plan = self.client.plan_reads(items)
+        self.assertCovers(plan, items)
+        self.assertValid(plan)
+        self.assertLess(len(plan), 12)
+
+    def test_unreadable(self):
+        with self.assertRaises(Exception):
+            self.client.plan_reads(["restore_system_default_values"])
+        with self.assertRaises(Exception):
+            self.client.plan_reads(["does_not_exist"])
+
+    def test_commands(self):
+        commands = self.client.get_read_commands(0x01, ["solar_panel_rated_voltage"])
+        self.assertEqual([(0x3000, bytes([0x01, 0x04, 0x30, 0x00, 0x00, 0x01, 0x3E, 0xCA]))], commands)
+if __name__ == "__main__":
+    unittest.main()
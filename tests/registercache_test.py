@@ -0,0 +1,77 @@
+import struct
+import unittest
+import sys
+sys.path.append("..")
+
+from src.bleclient import BleClient
+from src.protocol import Result
+from src.registercache import RegisterCache, CacheTtl
+from src.simulator import Simulator, SimulatedDevice
+from src.variables import variables
+
+class StubbornDevice(SimulatedDevice):
+    # Accepts writes of the float voltage, but keeps its old value
+    def handle(self, request: bytes):
+        float_voltage = self.registers[0x9026]
+        response = super().handle(request)
+        self.registers[0x9026] = float_voltage
+        return response
+
+class TestRegisterCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = RegisterCache([CacheTtl("parameters", 0x03, 0x9021, 0x906A, 60)], clock=lambda: self.now)
+        self.simulator = Simulator(latency=0.001, connect_time=0)
+
+    def client(self, **kwargs) -> BleClient:
+        return BleClient("00:00:00:00:00:01", bleak_client_factory=self.simulator.client, register_cache=self.cache, **kwargs)
+
+    def test_ttl(self):
+        self.cache.store("a", 0x03, 0x9021, struct.pack(">3H", 1, 2, 3))
+        self.assertEqual(struct.pack(">2H", 2, 3), self.cache.get("a", 0x03, 0x9022, 2))
+        self.assertIsNone(self.cache.get("a", 0x03, 0x9022, 3))  # Not complete
+        self.assertIsNone(self.cache.get("b", 0x03, 0x9021, 1))
+        self.cache.store("a", 0x04, 0x3030, struct.pack(">H", 1))
+        self.assertIsNone(self.cache.get("a", 0x04, 0x3030, 1))  # No TTL for live values
+        self.now = 60
+        self.assertIsNone(self.cache.get("a", 0x03, 0x9021, 1))
+        self.assertEqual((1, 4), (self.cache.hits, self.cache.misses))
+
+    def test_invalidate(self):
+        self.cache.store("a", 0x03, 0x9021, struct.pack(">H", 1))
+        self.cache.store("a", 0x04, 0x3030, struct.pack(">H", 1))
+        self.cache.invalidate("a", 0x04)
+        self.assertEqual([(0x03, 0x9021)], list(self.cache.devices["a"]))
+        self.cache.invalidate()
+        self.assertEqual({}, self.cache.devices["a"])
+
+    async def test_write_through(self):
+        async with self.client() as mppt:
+            await mppt.read(0x9021, 12)
+            results = await mppt.write([Result(variables["float_voltage"], "13.9")])
+            self.assertEqual(13.9, results["float_voltage"].value)  # Decoded from what was written
+            results = await mppt.read(0x9021, 12)
+            self.assertEqual(13.9, results["float_voltage"].value)
+        device = self.simulator.devices["00:00:00:00:00:01"]
+        self.assertEqual(2, device.requests)  # The second read came from the cache
+        self.assertEqual(1390, device.registers[0x9026])
+
+    async def test_switch_invalidates(self):
+        async with self.client() as mppt:
+            await mppt.read(0x9021, 12)
+            await mppt.write([Result(variables["restore_system_default_values"], "Restore")])
+            await mppt.read(0x9021, 12)
+        self.assertEqual(3, self.simulator.devices["00:00:00:00:00:01"].requests)
+
+    async def test_verify(self):
+        self.simulator.devices["00:00:00:00:00:01"] = StubbornDevice("00:00:00:00:00:01")
+        async with self.client(verify_writes=True) as mppt:
+            before = (await mppt.read(0x9026, 1))["float_voltage"].value
+            results = await mppt.write([Result(variables["float_voltage"], str(before + 0.5)), Result(variables["system_rated_voltage_level"], "12V")])
+            self.assertEqual(before, results["float_voltage"].value)
+            self.assertEqual("12V", results["system_rated_voltage_level"].value)
+            self.assertEqual(before, (await mppt.read(0x9026, 1))["float_voltage"].value)
+        self.assertEqual(3, self.simulator.devices["00:00:00:00:00:01"].requests)
+
+if __name__ == "__main__":
+    unittest.main()
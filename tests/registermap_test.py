@@ -0,0 +1,83 @@
+import unittest
+import sys
+sys.path.append("..")
+
+from src.variables import variables, battery_and_load_parameters, Variable, VariableContainer
+from src.registermap import RegisterMap, register_map
+from src.protocol import LumiaxClient
+
+class TestRegisterMap(unittest.TestCase):
+    def test_lookup(self):
+        for variable in variables:
+            for function_code in variable.function_codes:
+                self.assertIn(variable, register_map.lookup(function_code, variable.address))
+        self.assertEqual((), register_map.lookup(0x04, 0x9021))
+
+    def test_lookup_matches_scan(self):
+        for function_code in [0x02, 0x03, 0x04, 0x05, 0x06, 0x10]:
+            for address in {v.address for v in variables}:
+                expected = [v for v in variables if address == v.address and function_code in v.function_codes]
+                self.assertListEqual(expected, list(register_map.lookup(function_code, address)))
+
+    def test_in_range(self):
+        expected = [v for v in variables if v.address >= 0x3030 and v.address < 0x3030 + 41]
+        self.assertListEqual(expected, register_map.in_range(0x3030, 41))
+        self.assertListEqual([], register_map.in_range(0x3041, 4))
+
+    def test_layout(self):
+        layout = register_map.layout(0x04, 0x3045, 5)
+        self.assertEqual(["battery_percentage", "battery_voltage", "battery_current", "battery_power"],
+                         [v.name for _, v in layout])
+        self.assertEqual([0, 2, 4, 6], [offset for offset, _ in layout])
+        self.assertIs(layout, register_map.layout(0x04, 0x3045, 5))
+
+    def test_custom_table(self):
+        table = RegisterMap(variables[:2])
+        self.assertEqual(1, len(table.in_range(0x2000, 1)))
+        self.assertEqual((), table.lookup(0x04, 0x3030))
+
+    def test_reverse_lookup(self):
+        client = LumiaxClient()
+        for name, values in [
+            ("mt_series_load_mode", ["Always on", "Dusk to dawn", "Night light on time 5 hours", "Manual", "T0T", "Timing switch"]),
+            ("charging_at_zero_celsius", ["Normal charging", "No charging", "Slow charging"]),
+            ("battery_type", ["Lithium", "AGM"]),
+            ("mt_series_timing_period_1", [60 * h + m for h, m in [(0, 59), (1, 59), (2, 60), (23, 255)]]),
+        ]:
+            variable = battery_and_load_parameters[name]
+            for value in values:
+                raw = client._find_raw_value(variable, value)
+                self.assertIsNotNone(raw, f"{name}: {value}")
+                self.assertEqual(client._find_raw_value_by_brute_force(variable, value), raw, f"{name}: {value}")
+                self.assertEqual(value, variable.func(raw))
+        for name, value in [("mt_series_load_mode", "Never"), ("charging_at_zero_celsius", "normal charging"),
+                            ("mt_series_timing_period_1", 58)]:
+            variable = battery_and_load_parameters[name]
+            self.assertIsNone(client._find_raw_value(variable, value), f"{name}: {value}")
+            self.assertIsNone(client._find_raw_value_by_brute_force(variable, value), f"{name}: {value}")
+
+    def test_reverse_lookup_regenerated(self):
+        table = RegisterMap(battery_and_load_parameters)
+        variable = battery_and_load_parameters["charging_at_zero_celsius"]
+        self.assertEqual(2, table.reverse_lookup(variable)["Slow charging"])
+        self.assertIs(table.reverse_lookup(variable), table.reverse_lookup(variable))
+
+        changed = Variable(**{**vars(variable), "func": lambda x: ["Slow charging", "No charging"][x]})
+        self.assertEqual(0, table.reverse_lookup(changed)["Slow charging"])
+        table.clear_caches()
+        self.assertEqual(2, table.reverse_lookup(variable)["Slow charging"])
+
+    def test_clear_caches_reindexes(self):
+        items = list(battery_and_load_parameters)
+        table = RegisterMap(VariableContainer(items))
+        layout = table.layout(0x03, 0x9021, 2)
+        moved = Variable(**{**vars(items[0]), "address": 0x9022, "name": "moved"})
+        items[0] = moved
+        self.assertEqual(layout, table.layout(0x03, 0x9021, 2))
+        table.clear_caches()
+        self.assertEqual([moved], [v for v in table.lookup(0x03, 0x9022) if v.name == "moved"])
+        self.assertEqual((), table.lookup(0x03, 0x9021))
+        self.assertIs(moved, table.variable("moved"))
+        self.assertNotEqual(layout, table.layout(0x03, 0x9021, 2))
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+import sys
+sys.path.append("..")
+
+from bleak.exc import BleakError
+
+from src.bleclient import BleClient
+from src.protocol import LumiaxClient
+from src.simulator import Simulator
+from src.transaction import RttEstimator
+
+class TestRequests(unittest.IsolatedAsyncioTestCase):
+    def client(self, **options) -> BleClient:
+        simulator = Simulator(connect_time=0, **options)
+        return BleClient("00:00:00:00:00:01", bleak_client_factory=simulator.client)
+
+    def test_rtt_estimator(self):
+        rtt = RttEstimator(initial=2, min_timeout=0.1, max_timeout=5)
+        self.assertEqual(2, rtt.timeout())
+        rtt.sample(0.2)
+        self.assertAlmostEqual(0.2 + 4 * 0.1, rtt.timeout())
+        for _ in range(50):
+            rtt.sample(0.2)
+        self.assertAlmostEqual(0.2, rtt.timeout(), delta=0.01)
+        rtt.timed_out()
+        rtt.timed_out()
+        self.assertAlmostEqual(0.8, rtt.timeout(), delta=0.04)
+        for _ in range(10):
+            rtt.timed_out()
+        self.assertEqual(5, rtt.timeout())
+        rtt.sample(0.01)
+        self.assertLess(rtt.timeout(), 0.5)  # The backoff is gone with a fresh sample
+
+    def test_response_prefix(self):
+        client = LumiaxClient()
+        self.assertEqual(bytes([0x04, 26]), client.response_prefix(client.get_read_command(0xFE, 0x3045, 13)))
+        command = bytes.fromhex("fe0690210005")
+        self.assertEqual(command[1:], client.response_prefix(command))
+
+    async def test_late_response_is_dropped(self):
+        async with self.client(latency=0.05) as mppt:
+            self.assertFalse(await mppt.read(0x3045, 13, repeat=1, timeout=0.01))
+            # The reply to the first read arrives while waiting for this one
+            results = await mppt.read(0x9021, 12, timeout=1)
+        self.assertEqual(0x9021, results[0].address)
+        self.assertEqual(1, mppt.stale_responses)
+        self.assertEqual(1, mppt.retries)
+
+    async def test_late_response_with_same_prefix(self):
+        async with self.client(latency=0.05) as mppt:
+            self.assertFalse(await mppt.read(0x3045, 13, repeat=1, timeout=0.03))
+            # Same function code and length, the late reply to the first read must not be decoded as this one
+            results = await mppt.read(0x3032, 13, timeout=1)
+        self.assertEqual(0x3032, results[0].address)
+        self.assertEqual(1, mppt.stale_responses)
+        self.assertEqual(2, mppt.client.device.requests)
+
+    async def test_stop_fails_request_in_flight(self):
+        async with self.client(latency=0.01, loss=1.0) as mppt:
+            task = asyncio.create_task(mppt.read(0x3045, 13, timeout=1))
+            await asyncio.sleep(0.02)
+            await mppt.stop()
+            with self.assertRaises(BleakError):
+                await asyncio.wait_for(task, 0.5)
+
+    async def test_queued_requests(self):
+        async with self.client(latency=0.01) as mppt:
+            replies = await asyncio.gather(mppt.read(0x3030, 41), mppt.read(0x3045, 13), mppt.read(0x9021, 12))
+            self.assertEqual([0x3030, 0x3045, 0x9021], [results[0].address for results in replies])
+            self.assertIsNotNone(mppt.rtt.srtt)
+            self.assertLess(mppt.rtt.timeout(), 2)
+            self.assertEqual(3, mppt.client.device.requests)
+
+    async def test_cancelled_request(self):
+        async with self.client(latency=0.01, loss=1.0) as mppt:
+            task = asyncio.create_task(mppt.read(0x3045, 13, timeout=0.01))
+            await asyncio.sleep(0.025)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.02)
+            self.assertLessEqual(mppt.retries, 4)
+            self.assertIsNone(mppt.pending)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+import sys
+sys.path.append("..")
+
+from src.registermap import register_map
+from src.protocol import ReadRequest
+from src.scheduler import PollScheduler, ReadGroup
+from src.variables import VariableContainer
+
+def group(name, start_address, count, interval, priority=0):
+    return ReadGroup(name, VariableContainer(register_map.in_range(start_address, count)), interval, priority)
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.groups = [
+            group("counters", 0x3038, 9, 3600),
+            group("power", 0x3045, 13, 5, priority=2),
+            group("status", 0x3032, 6, 20, priority=1),
+            group("parameters", 0x9021, 12, 3600),
+        ]
+        self.scheduler = PollScheduler(self.groups, clock=lambda: self.now)
+
+    def test_initially_all_due(self):
+        self.assertEqual(["power", "status", "counters", "parameters"], [g.name for g in self.scheduler.due()])
+
+    def test_intervals(self):
+        self.scheduler.complete(self.scheduler.due(), 0.1)
+        self.assertEqual([], self.scheduler.due())
+        self.assertEqual(5, self.scheduler.next_wakeup())
+        self.now = 5
+        self.assertEqual(["power"], [g.name for g in self.scheduler.due()])
+        self.scheduler.complete(self.scheduler.due(), 0.1)
+        self.now = 20
+        self.assertEqual(["power", "status"], [g.name for g in self.scheduler.due()])
+
+    def test_plan_coalesces(self):
+        plan = self.scheduler.plan(self.scheduler.due())
+        self.assertEqual([
+            ReadRequest(0x03, 0x9021, 12),
+            ReadRequest(0x04, 0x3032, 32),
+        ], plan)
+        self.scheduler.request_cost = 0
+        plan = self.scheduler.plan(self.scheduler.due())
+        self.assertEqual([
+            ReadRequest(0x03, 0x9021, 12),
+            ReadRequest(0x04, 0x3032, 15),
+            ReadRequest(0x04, 0x3045, 13),
+        ], plan)
+        plan = self.scheduler.plan([self.groups[1]])
+        self.assertEqual([ReadRequest(0x04, 0x3045, 13)], plan)
+
+    def test_plan_respects_frame_limit(self):
+        wide = group("wide", 0x3000, 0x3059 - 0x3000, 20)
+        for request in self.scheduler.plan([wide]):
+            self.assertLessEqual(request.count, 127)
+
+    def test_backoff(self):
+        power = [self.groups[1]]
+        self.scheduler.complete(power, 4.0)
+        self.assertEqual({0: 2, 1: 1, 2: 1}, self.scheduler.slowdown)
+        self.assertEqual(5, self.scheduler.next_due["power"])  # Lower priorities give way first
+        for _ in range(3):
+            self.scheduler.complete(power, 4.0)
+        self.assertEqual({0: 8, 1: 2, 2: 1}, self.scheduler.slowdown)
+        for _ in range(4):
+            self.scheduler.complete(power, 4.0)
+        self.assertEqual({0: 8, 1: 8, 2: 4}, self.scheduler.slowdown)
+        self.assertEqual(20, self.scheduler.next_due["power"])
+        self.scheduler.complete(power, 0.1)
+        self.assertEqual({0: 8, 1: 8, 2: 3}, self.scheduler.slowdown)  # Higher priorities recover first
+        for _ in range(30):
+            self.scheduler.complete(power, 0.1)
+        self.assertEqual({0: 1, 1: 1, 2: 1}, self.scheduler.slowdown)
+
+    def test_priority_changes_schedule(self):
+        # A link that can't keep up with everything keeps polling power at its interval
+        self.scheduler.complete(self.scheduler.due(), 4.0)
+        for _ in range(3):
+            self.now += 5
+            self.scheduler.complete(self.scheduler.due(), 4.0)
+        self.assertEqual(self.now + 5, self.scheduler.next_due["power"])
+        self.assertEqual(3600 * 2, self.scheduler.next_due["counters"])
+        self.assertEqual(1, self.scheduler.slowdown[2])
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+import sys
+sys.path.append("..")
+
+from bleak.exc import BleakError
+
+from src.session import BleSession, SessionState
+
+class FakeClient:
+    instances = []
+    fail_connects = 0
+
+    def __init__(self, address, disconnected_callback=None):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.closed = False
+        FakeClient.instances.append(self)
+
+    async def __aenter__(self):
+        if FakeClient.fail_connects > 0:
+            FakeClient.fail_connects -= 1
+            raise BleakError("device not found")
+        self.is_connected = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.is_connected = False
+        self.closed = True
+
+    def drop_link(self):
+        self.is_connected = False
+        self.disconnected_callback(self)
+
+class TestSession(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        FakeClient.instances = []
+        FakeClient.fail_connects = 0
+        self.session = BleSession("00:11:22:33:44:55", min_backoff=0.01, max_backoff=0.04, client_factory=FakeClient)
+
+    async def test_reuses_connection(self):
+        for _ in range(3):
+            async with self.session.transaction() as client:
+                self.assertTrue(client.is_connected)
+        self.assertEqual(len(FakeClient.instances), 1)
+        self.assertEqual(self.session.connects, 1)
+        self.assertEqual(self.session.requests, 3)
+        self.assertEqual(self.session.state, SessionState.CONNECTED)
+        self.assertIsNotNone(self.session.health()["mean_request_latency"])
+
+    async def test_reconnects_after_link_loss(self):
+        async with self.session.transaction() as client:
+            client.drop_link()
+        self.assertEqual(self.session.state, SessionState.DISCONNECTED)
+        async with self.session.transaction() as client:
+            self.assertTrue(client.is_connected)
+        self.assertEqual(len(FakeClient.instances), 2)
+        self.assertTrue(FakeClient.instances[0].closed)
+        self.assertEqual(self.session.link_losses, 1)
+
+    async def test_drops_connection_on_error(self):
+        with self.assertRaises(BleakError):
+            async with self.session.transaction():
+                raise BleakError("write failed")
+        self.assertIsNone(self.session.client)
+        self.assertTrue(FakeClient.instances[0].closed)
+
+    async def test_backoff(self):
+        FakeClient.fail_connects = 3
+        backoffs = []
+        for _ in range(3):
+            with self.assertRaises(BleakError):
+                await self.session.connect()
+            self.assertEqual(self.session.state, SessionState.BACKOFF)
+            backoffs.append(self.session.backoff)
+        self.assertEqual(backoffs, [0.01, 0.02, 0.04])
+        client = await self.session.connect()
+        self.assertTrue(client.is_connected)
+        self.assertEqual(self.session.backoff, 0)
+        self.assertEqual(self.session.connect_failures, 3)
+
+    async def test_close(self):
+        async with self.session:
+            async with self.session.transaction():
+                pass
+        self.assertEqual(self.session.state, SessionState.DISCONNECTED)
+        self.assertTrue(FakeClient.instances[0].closed)
+
+    async def test_limiter(self):
+        limiter = asyncio.Semaphore(2)
+        sessions = [BleSession(f"00:00:00:00:00:0{i}", client_factory=FakeClient, limiter=limiter) for i in range(5)]
+        active = 0
+        peak = 0
+        async def poll(session):
+            nonlocal active, peak
+            async with session.transaction():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+        await asyncio.gather(*[poll(session) for session in sessions for _ in range(2)])
+        self.assertEqual(2, peak)
+        self.assertTrue(all(client.closed for client in FakeClient.instances))
+        self.assertEqual(10, len(FakeClient.instances))
+if __name__ == "__main__":
+    unittest.main()
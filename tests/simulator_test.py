@@ -0,0 +1,63 @@
+import functools
+import unittest
+import sys
+sys.path.append("..")
+
+from bleak.exc import BleakError
+
+from src.bleclient import BleClient
+from src.crc import crc16
+from src.protocol import Result
+from src.session import BleSession
+from src.simulator import Simulator, SimulatedDevice
+from src.variables import variables
+
+class TestSimulator(unittest.IsolatedAsyncioTestCase):
+    def client(self, **options) -> BleClient:
+        simulator = Simulator(latency=0.001, connect_time=0, **options)
+        return BleClient("00:00:00:00:00:01", bleak_client_factory=simulator.client)
+
+    async def test_read(self):
+        async with self.client() as mppt:
+            results = await mppt.read(0x3030, 41)
+        self.assertEqual(0x3030, results[0].address)
+        self.assertAlmostEqual(13.2, results["battery_voltage"].value, delta=1.5)
+        self.assertAlmostEqual(80, results["battery_percentage"].value, delta=10)
+
+    async def test_write(self):
+        async with self.client(mtu=3) as mppt:
+            command = Result(variables["float_voltage"], "13.9")
+            await mppt.write([command])
+            results = await mppt.read(0x9021, 12)
+        self.assertEqual(13.9, results["float_voltage"].value)
+
+    async def test_loss_and_corruption(self):
+        async with self.client(loss=0.3, corruption=0.3) as mppt:
+            for _ in range(5):
+                results = await mppt.read(0x3045, 13, timeout=0.02)
+                self.assertEqual(13 - 3, len(results))  # Three 32-bit values span two registers
+        self.assertGreater(mppt.client.device.requests, 5)
+
+    async def test_link_loss(self):
+        simulator = Simulator(latency=0.001, connect_time=0, link_loss=0.5)
+        session = BleSession("00:00:00:00:00:02", min_backoff=0.001, max_backoff=0.001,
+                             client_factory=functools.partial(BleClient, bleak_client_factory=simulator.client))
+        reads = 0
+        while reads < 5:
+            try:
+                async with session.transaction() as mppt:
+                    await mppt.read(0x3045, 13)
+                    reads += 1
+            except BleakError:
+                pass
+        await session.close()
+        self.assertGreater(session.connects, 1)
+
+    def test_exception_response(self):
+        device = SimulatedDevice("00:00:00:00:00:03")
+        request = bytes.fromhex("fe04ff000001")
+        self.assertIsNone(device.handle(request + b"\x00\x00"))  # Bad CRC is ignored
+        response = device.handle(request + crc16(request))
+        self.assertEqual(0x84, response[1])
+if __name__ == "__main__":
+    unittest.main()
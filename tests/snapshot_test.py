@@ -0,0 +1,85 @@
+import functools
+import os
+import struct
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from src.bleclient import BleClient
+from src.protocol import LumiaxClient
+from src.session import BleSession
+from src.simulator import Simulator
+from src.snapshot import Snapshot, diff, plan_writes, restore_fleet, snapshot_fleet, save_snapshots, load_snapshots
+
+class TestSnapshot(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.simulator = Simulator(latency=0.001, connect_time=0)
+        client_factory = functools.partial(BleClient, bleak_client_factory=self.simulator.client)
+        self.sessions = [BleSession(f"00:00:00:00:00:0{i}", client_factory=client_factory) for i in range(3)]
+
+    async def asyncTearDown(self):
+        for session in self.sessions:
+            await session.close()
+
+    def test_range_write_command(self):
+        client = LumiaxClient()
+        command = bytes([0x01, 0x10, 0x90, 0x21, 0x00, 0x0A, 0x14, 0x00, 0x00, 0x04, 0x24, 0x04, 0x9C, 0x05, 0xA0, 0x05, 0xBE, 0x05, 0x50, 0x00, 0x00, 0x05, 0xA0, 0x05, 0x78, 0x00, 0x00, 0xCC, 0xE7])
+        registers = list(struct.unpack(">10H", command[7:27]))
+        self.assertEqual(command, client.get_range_write_command(0x01, 0x9021, registers))
+        self.assertEqual(bytes([0x10, 0x90, 0x21, 0x00, 0x0A]), client.response_prefix(command))
+        with self.assertRaises(Exception):
+            client.get_range_write_command(0x01, 0x9021, [0] * 128)
+
+    def test_plan_writes(self):
+        live = {address: 0 for address in list(range(0x9021, 0x9050)) + [0x9052, 0x9053, 0x9054]}
+        changes = {0x9022: 1, 0x9023: 2, 0x9026: 3, 0x9040: 4, 0x904F: 5, 0x9052: 6}
+        self.assertEqual([
+            (0x9022, [1, 2, 0, 0, 3]),  # The gap is bridged with the current values
+            (0x9040, [4]),
+            (0x904F, [5]),  # 0x9050 and 0x9051 are unknown and never written
+            (0x9052, [6]),
+        ], plan_writes(changes, live))
+        changes = {address: 1 for address in range(0x1000, 0x1000 + 200)}
+        runs = plan_writes(changes, changes)
+        self.assertEqual([127, 73], [len(values) for start, values in runs])
+
+    async def test_snapshot_and_restore(self):
+        source = self.simulator.devices
+        results = await snapshot_fleet(self.sessions[:1])
+        template = results[0]
+        self.assertIsInstance(template, Snapshot)
+        self.assertEqual(1, self.simulator.devices["00:00:00:00:00:00"].requests)  # All parameters in one read
+        self.assertIn(0x906A, template.registers)
+        self.assertNotIn(0x9050, template.registers)
+        self.assertEqual("Lithium", template.values["battery_type"])
+
+        template.registers[0x9026] = 1390  # Float voltage
+        template.registers[0x9027] = 1     # 12V
+        template.registers[0x906A] = 6000
+
+        with tempfile.TemporaryDirectory() as path:
+            save_snapshots(os.path.join(path, "snapshot.json"), [template])
+            snapshots = load_snapshots(os.path.join(path, "snapshot.json"))
+        self.assertEqual(template.registers, snapshots["00:00:00:00:00:00"].registers)
+
+        results = await restore_fleet(self.sessions, snapshots, dry_run=True)
+        self.assertEqual([3, 3, 3], [len(result.changes) for result in results])
+        self.assertNotEqual(1390, source["00:00:00:00:00:01"].registers[0x9026])
+
+        results = await restore_fleet(self.sessions, snapshots)
+        for result in results:
+            self.assertEqual({0x9026: 1390, 0x9027: 1, 0x906A: 6000}, result.changes)
+            self.assertEqual(2, result.frames)
+            self.assertEqual({}, result.mismatches)
+        for device in source.values():
+            self.assertEqual(1390, device.registers[0x9026])
+
+        results = await snapshot_fleet(self.sessions)
+        self.assertEqual(13.9, results[2].values["float_voltage"])
+        self.assertEqual({}, diff(template, results[2]))
+        results = await restore_fleet(self.sessions, snapshots)
+        self.assertEqual([0, 0, 0], [result.frames for result in results])
+
+if __name__ == "__main__":
+    unittest.main()
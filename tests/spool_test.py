@@ -0,0 +1,142 @@
+import asyncio
+import json
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+
+from aiomqtt import MqttError
+
+from src.homeassistant import MqttSensor
+from src.protocol import Result, ResultContainer
+from src.publisher import Publisher
+from src.scheduler import ReadGroup
+from src.spool import Spool, entry_results
+from src.variables import variables, VariableContainer
+
+class FakeSensor(MqttSensor):
+    def __init__(self, **kwargs):
+        super().__init__(hostname="localhost", **kwargs)
+        self.published = []
+        self.fail = False
+
+    async def publish_message(self, topic, payload, retain=False, qos=0):
+        if self.fail:
+            raise MqttError("Disconnected")
+        self.published.append((topic, payload))
+
+def readings(voltage: float) -> ResultContainer:
+    return ResultContainer([Result(**vars(variables["battery_voltage"]), value=voltage)])
+
+class TestSpool(unittest.IsolatedAsyncioTestCase):
+    async def replay(self, spool: Spool) -> list[float]:
+        voltages = []
+        async def handler(entries):
+            voltages.extend(entry["values"]["battery_voltage"] for entry in entries)
+        await spool.replay(handler)
+        return voltages
+
+    async def test_fifo(self):
+        spool = Spool(segment_bytes=200)
+        for i in range(10):
+            await spool.put("device", readings(12 + i / 10), timestamp=i)
+        self.assertEqual(10, len(spool))
+        self.assertGreater(len(spool.segments), 1)
+        self.assertEqual([12 + i / 10 for i in range(10)], await self.replay(spool))
+        self.assertEqual(0, len(spool))
+        self.assertEqual(0, spool.size)
+
+    async def test_on_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spool = Spool(directory, segment_bytes=200)
+            for i in range(5):
+                await spool.put("device", readings(12 + i), timestamp=i)
+            # Readings survive a restart
+            spool = Spool(directory, segment_bytes=200)
+            self.assertEqual(5, len(spool))
+            await spool.put("device", readings(17), timestamp=5)
+            self.assertEqual([12, 13, 14, 15, 16, 17], await self.replay(spool))
+            self.assertEqual(0, len(Spool(directory)))
+
+    async def test_failed_replay_keeps_entries(self):
+        spool = Spool()
+        await spool.put("device", readings(12))
+        async def handler(entries):
+            raise MqttError("Disconnected")
+        with self.assertRaises(MqttError):
+            await spool.replay(handler)
+        self.assertEqual([12], await self.replay(spool))
+
+    async def test_drop_oldest(self):
+        spool = Spool(max_bytes=1000, segment_bytes=200)
+        for i in range(50):
+            await spool.put("device", readings(i), timestamp=i)
+        self.assertLessEqual(spool.size, 1000)
+        self.assertEqual(50, len(spool) + spool.dropped)
+        self.assertEqual(49, (await self.replay(spool))[-1])
+
+    async def test_drop_newest(self):
+        spool = Spool(max_bytes=1000, segment_bytes=200, overflow="drop_newest")
+        for i in range(50):
+            await spool.put("device", readings(i), timestamp=i)
+        self.assertEqual(50, len(spool) + spool.dropped)
+        self.assertEqual(0, (await self.replay(spool))[0])
+
+    async def test_block(self):
+        spool = Spool(max_bytes=200, segment_bytes=100, overflow="block")
+        await spool.put("device", readings(1))
+        await spool.put("device", readings(2))
+        put = asyncio.create_task(spool.put("device", readings(3)))
+        await asyncio.sleep(0.01)
+        self.assertFalse(put.done())
+        voltages = await self.replay(spool)
+        await asyncio.wait_for(put, 1)
+        voltages += await self.replay(spool)
+        self.assertEqual([1, 2, 3], voltages)
+
+    async def test_entry_results(self):
+        results = entry_results({"time": 0, "device": "device", "values": {"battery_voltage": 12.5, "unknown": 1}})
+        self.assertEqual(12.5, results["battery_voltage"].value)
+        self.assertEqual(1, len(results))
+
+class TestPublisher(unittest.IsolatedAsyncioTestCase):
+    async def test_spools_while_offline(self):
+        publisher = Publisher(Spool())
+        self.assertFalse(await publisher.publish("device", readings(12.0)))
+        self.assertFalse(await publisher.publish("device", readings(12.5)))
+
+        sensor = FakeSensor()
+        await publisher.attach({"device": sensor})
+        history = [json.loads(payload) for topic, payload in sensor.published if topic == sensor.get_history_topic()]
+        self.assertEqual([[12.0, 12.5]], [[record["values"]["battery_voltage"] for record in records] for records in history])
+        states = [payload for topic, payload in sensor.published if topic == sensor.get_state_topic(variables["battery_voltage"])]
+        self.assertEqual(["12.5"], states)
+
+        self.assertTrue(await publisher.publish("device", readings(13.0)))
+        self.assertEqual(0, len(publisher.spool))
+
+    async def test_replay_aggregated(self):
+        publisher = Publisher(Spool(), [ReadGroup("status", VariableContainer([variables["battery_voltage"]]), 20)])
+        await publisher.publish("device", readings(12.0))
+        sensor = FakeSensor(aggregate=True)
+        await publisher.attach({"device": sensor})
+        config = [json.loads(payload) for topic, payload in sensor.published if topic.endswith("/config")]
+        self.assertEqual([sensor.get_group_topic("status")], [payload["state_topic"] for payload in config])
+        states = [json.loads(payload) for topic, payload in sensor.published if topic == sensor.get_group_topic("status")]
+        self.assertEqual([{"battery_voltage": 12.0}], states)
+
+        # Live polls keep updating the topic Home Assistant reads
+        self.assertTrue(await publisher.publish("device", readings(13.0), publisher.groups))
+        states = [json.loads(payload) for topic, payload in sensor.published if topic == sensor.get_group_topic("status")]
+        self.assertEqual(13.0, states[-1]["battery_voltage"])
+
+    async def test_connection_loss(self):
+        publisher = Publisher(Spool())
+        sensor = FakeSensor()
+        await publisher.attach({"device": sensor})
+        sensor.fail = True
+        self.assertFalse(await publisher.publish("device", readings(12.0)))
+        self.assertFalse(publisher.online)
+        self.assertEqual(1, len(publisher.spool))
+if __name__ == "__main__":
+    unittest.main()
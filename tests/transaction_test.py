@@ -4,6 +4,7 @@ sys.path.append("..")
 
 from src.variables import variables
 from src.protocol import LumiaxClient, Result
+from src.crc import crc16
 
 class TestTransaction(unittest.TestCase):
 
@@ -142,5 +143,15 @@ class TestTransaction(unittest.TestCase):
         self.assertEqual(len(recv_buf) - 4, 4)
         results = self.client.parse(start_address, recv_buf)
         self.assertListEqual(list(results), [])
+
+    def test_results_share_variables(self):
+        results = self.client.parse(0x3011, bytes([0x01, 0x04, 0x04, 0x41, 0x01, 0x13, 0xF7]) + crc16(bytes([0x01, 0x04, 0x04, 0x41, 0x01, 0x13, 0xF7])))
+        for result in results:
+            self.assertIn(result.variable, variables)
+            self.assertEqual(result.variable.name, result.name)
+        variable = variables["battery_voltage"]
+        self.assertEqual(Result(variable, 13.2), Result(**vars(variable), value=13.2))
+        self.assertNotEqual(Result(variable, 13.2), Result(variable, 13.3))
+        self.assertEqual("V", Result(variable, 13.2).unit)
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file